@@ -0,0 +1,96 @@
+"""
+
+    Load-test client for the recommendation API.
+
+    Author: Explore Data Science Academy.
+
+    Description: Sends the benchmark suite's fixed, seeded three-title
+    queries to a running `api.server`, keeping `--concurrency` requests in
+    flight, and reports p50/p95/p99 latency, throughput and errors. With
+    `--batch N` the queries are sent N at a time to `/recommend/batch`.
+
+    Usage, from the root of the repository (with the server running):
+
+        python -m api.load_test --requests 500 --concurrency 16
+        python -m api.load_test --algorithm collab --batch 20
+
+"""
+
+# Script dependencies
+import json
+import time
+import asyncio
+import argparse
+import numpy as np
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError
+from benchmarks.run_benchmarks import make_queries
+
+
+async def run(url, algorithm, queries, n_requests, concurrency, batch):
+    """Send `n_requests` requests, `concurrency` at a time.
+
+    Returns
+    -------
+    tuple (list (float), int, float)
+        Latency of every successful request in ms, number of failed
+        requests and total seconds.
+
+    """
+    AsyncHTTPClient.configure(None, max_clients=concurrency)
+    client = AsyncHTTPClient()
+    latencies, errors = [], 0
+    counter = iter(range(n_requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            if batch:
+                path = '/recommend/batch'
+                body = {'algorithm': algorithm, 'top_n': 10,
+                        'queries': [queries[(i * batch + j) % len(queries)]
+                                    for j in range(batch)]}
+            else:
+                path = '/recommend'
+                body = {'algorithm': algorithm, 'top_n': 10,
+                        'movies': queries[i % len(queries)]}
+            start = time.perf_counter()
+            try:
+                await client.fetch(url + path, method='POST',
+                                   body=json.dumps(body),
+                                   request_timeout=120)
+                latencies.append((time.perf_counter() - start) * 1000)
+            except (HTTPClientError, OSError):
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return latencies, errors, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the API.')
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--algorithm', default='content')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--batch', type=int, default=0,
+                        help='Queries per batch request; 0 sends single '
+                             'requests.')
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    queries = make_queries(n_queries=args.queries, seed=args.seed)
+    latencies, errors, elapsed = asyncio.run(run(
+        args.url, args.algorithm, queries, args.requests, args.concurrency,
+        args.batch))
+    print(f'{len(latencies)} requests ({errors} errors) in {elapsed:.2f}s: '
+          f'{len(latencies) / elapsed:.1f} requests/s')
+    if latencies:
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        print(f'latency p50 {p50:.1f} ms, p95 {p95:.1f} ms, '
+              f'p99 {p99:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
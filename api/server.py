@@ -0,0 +1,422 @@
+"""
+
+    Asynchronous HTTP API for the recommenders.
+
+    Author: Explore Data Science Academy.
+
+    Description: Serves the recommenders to other services over HTTP,
+    alongside (or instead of) the Streamlit app. Built on Tornado, which
+    is already installed with Streamlit. Endpoints:
+
+        POST /recommend        {"algorithm": "content", "movies": [...],
+                                "top_n": 10}
+                            -> {"recommendations": [...]}
+        POST /recommend/batch  {"algorithm": "collab", "queries": [[...], ...],
+                                "top_n": 10}
+                            -> {"results": [[...], ...]}
+        GET  /users/<id>/recommendations?top_n=10
+                            -> {"recommendations": [...]}
+        GET  /titles?q=matrix&limit=20
+                            -> {"titles": [...]}
+        POST /ratings          {"ratings": [{"userId": 1, "movieId": 2,
+                                             "rating": 4.5}, ...]}
+                            -> {"accepted": 1, "seq": 42}
+        GET  /health           -> {"status": "ok", ...}
+        GET  /metrics          -> stage metrics in Prometheus text format,
+                                  including the stages run by workers
+
+    Scoring is CPU-bound, so it runs on a pool of worker processes while
+    the event loop only parses requests. The models are loaded before the
+    pool is started, so forked workers share them (copy-on-write, and the
+    memory-mapped model files through the page cache) instead of each
+    loading their own. Results are cached, and concurrent identical
+    requests are coalesced: only the first is computed, the others await
+    its result. Batches are de-duplicated and split into one chunk per
+    worker. Per-user recommendations are looked up in the table
+    precomputed by `recommenders.batch_job`. Title searches (see
+    `utils.title_search`) take well under a millisecond, so they are
+    answered on the event loop. New ratings are appended to the rating
+    log of `utils.online_updates`, which every worker applies to its
+    models on its next request. Workers profile every query they score
+    and send the profiles back with the results, so the server process
+    holds the stage metrics of the whole pool.
+
+    With `--snapshot`, the server process publishes the shared snapshot
+    (see `api.snapshot`) if none exists yet, and every worker memory-maps
+    the models and indexes from it instead of holding its own copy.
+    Publishing a new snapshot generation while the server runs swaps it
+    in atomically; cached results of the previous generation are no
+    longer served.
+
+    Usage, from the root of the repository:
+
+        python -m api.server --port 8000 --workers 4
+        python -m api.server --workers 8 --snapshot resources/models/shared
+
+"""
+
+# Script dependencies
+import json
+import asyncio
+import argparse
+import importlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import tornado.web
+from utils import profiling, shared_store
+from utils.online_updates import get_online_updates
+from utils.result_cache import LRUCache
+
+# Algorithm name -> (module, function)
+ALGORITHMS = {
+    'content': ('recommenders.content_based', 'content_model'),
+    'collab': ('recommenders.collaborative_based', 'collab_model'),
+    'hybrid': ('recommenders.hybrid_based', 'hybrid_model'),
+    'item': ('recommenders.collaborative_based', 'item_factor_model'),
+}
+MAX_TOP_N = 100
+MAX_BATCH = 1000
+
+
+def preload():
+    """Import every recommender and load the models and indexes they
+    look up per request, so that workers forked afterwards share them."""
+    from recommenders.collaborative_based import MODEL_PATH
+    from recommenders.content_features import load_features
+    from recommenders.content_index import load_neighbour_index
+    from recommenders.item_similarity import load_item_engine
+    from recommenders.svd_scoring import load_factors
+    from utils.catalogue import get_catalogue
+    from utils.popularity import get_popularity
+    from utils.ratings_index import get_ratings_index
+    for module_name, _ in ALGORITHMS.values():
+        importlib.import_module(module_name)
+    get_catalogue()
+    get_ratings_index()
+    get_popularity()
+    load_features()
+    load_neighbour_index()
+    load_factors(MODEL_PATH)
+    load_item_engine(MODEL_PATH)
+
+
+def recommend_many(algorithm, queries, top_n, snapshot=None):
+    """Run one recommender over several queries; runs in a worker process.
+
+    Parameters
+    ----------
+    algorithm : str
+        Key of `ALGORITHMS`.
+    queries : list (list (str))
+        Movie titles of each query.
+    top_n : int
+        Number of recommendations per query.
+    snapshot : str, optional
+        Directory of the snapshot generation to serve from, as resolved
+        by the server process; see `utils.shared_store.pinned`.
+
+    Returns
+    -------
+    tuple (list (list (str)), list (dict))
+        Recommended titles for each query, and the profile of each query
+        (see `utils.profiling.RequestProfile.as_dict`), to be added to the
+        metrics of the server process.
+
+    """
+    module_name, function_name = ALGORITHMS[algorithm]
+    model = getattr(importlib.import_module(module_name), function_name)
+    results, profiles = [], []
+    with shared_store.pinned(snapshot):
+        for movies in queries:
+            with profiling.profile(f'worker {algorithm}',
+                                   observe=False) as request:
+                results.append(list(model(movie_list=list(movies),
+                                          top_n=top_n)))
+            profiles.append(request.as_dict())
+    return results, profiles
+
+
+class Recommender:
+    """Cached, coalescing front of the worker pool.
+
+    Parameters
+    ----------
+    pool : concurrent.futures.Executor
+        Pool running `recommend_many`.
+    workers : int
+        Number of workers in the pool, used to split batches.
+    cache : utils.result_cache.LRUCache
+        Cache of results keyed by (snapshot generation, last logged
+        rating, algorithm, movies, top_n).
+
+    """
+
+    def __init__(self, pool, workers, cache):
+        self.pool = pool
+        self.workers = workers
+        self.cache = cache
+        self.coalesced = 0
+        # Key -> future of the computation currently running for it
+        self._inflight = {}
+
+    async def recommend_batch(self, algorithm, queries, top_n):
+        """Recommendations for many queries, computing each distinct
+        uncached query once.
+
+        Parameters
+        ----------
+        algorithm : str
+            Key of `ALGORITHMS`.
+        queries : list (list (str))
+            Movie titles of each query.
+        top_n : int
+            Number of recommendations per query.
+
+        Returns
+        -------
+        list (list (str))
+            Recommended titles for each query.
+
+        """
+        # Every query is computed from the generation live now
+        snapshot = shared_store.attach()
+        generation = snapshot.generation if snapshot else None
+        # Results computed before the latest rating was logged are stale
+        seq = get_online_updates().poll()
+        keys = [(generation, seq, algorithm, tuple(movies), top_n)
+                for movies in queries]
+        results, waiting, missing = {}, {}, []
+        for key in dict.fromkeys(keys):
+            cached = self.cache.get(key)
+            if cached is not None:
+                results[key] = cached
+            elif key in self._inflight:
+                self.coalesced += 1
+                waiting[key] = self._inflight[key]
+            else:
+                missing.append(key)
+
+        if missing:
+            loop = asyncio.get_running_loop()
+            size = -(-len(missing) // self.workers)
+            for start in range(0, len(missing), size):
+                chunk = missing[start:start + size]
+                future = loop.run_in_executor(
+                    self.pool, recommend_many, algorithm,
+                    [list(key[3]) for key in chunk], top_n,
+                    snapshot.directory if snapshot else None)
+                for i, key in enumerate(chunk):
+                    waiting[key] = self._inflight[key] = asyncio.ensure_future(
+                        self._settle(key, future, i))
+
+        for key, future in waiting.items():
+            results[key] = await future
+        return [results[key] for key in keys]
+
+    async def _settle(self, key, chunk_future, position):
+        """Result of one query out of its chunk, cached once known."""
+        try:
+            results, profiles = await chunk_future
+            result = results[position]
+            profiling.observe(profiles[position])
+            self.cache.put(key, result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+
+class BaseHandler(tornado.web.RequestHandler):
+
+    def initialize(self, recommender):
+        self.recommender = recommender
+
+    def write_error(self, status_code, **kwargs):
+        self.finish({'error': self._reason})
+
+    def parse(self, field):
+        """Validate the JSON body, returning (algorithm, field, top_n)."""
+        try:
+            body = json.loads(self.request.body)
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason='Body is not valid JSON')
+        if not isinstance(body, dict):
+            raise tornado.web.HTTPError(400, reason='Body must be an object')
+        algorithm = body.get('algorithm', 'content')
+        if algorithm not in ALGORITHMS:
+            raise tornado.web.HTTPError(
+                400, reason=f'Unknown algorithm: {algorithm}')
+        top_n = body.get('top_n', 10)
+        if not isinstance(top_n, int) or not 0 < top_n <= MAX_TOP_N:
+            raise tornado.web.HTTPError(
+                400, reason=f'top_n must be between 1 and {MAX_TOP_N}')
+        if field not in body:
+            raise tornado.web.HTTPError(400, reason=f'Missing "{field}"')
+        return algorithm, body[field], top_n
+
+
+def _check_titles(movies):
+    if (not isinstance(movies, list) or not movies
+            or not all(isinstance(title, str) for title in movies)):
+        raise tornado.web.HTTPError(
+            400, reason='Movies must be a non-empty list of titles')
+
+
+class RecommendHandler(BaseHandler):
+
+    async def post(self):
+        algorithm, movies, top_n = self.parse('movies')
+        _check_titles(movies)
+        with profiling.profile(f'api {algorithm}'):
+            results = await self.recommender.recommend_batch(
+                algorithm, [movies], top_n)
+        self.write({'recommendations': results[0]})
+
+
+class BatchHandler(BaseHandler):
+
+    async def post(self):
+        algorithm, queries, top_n = self.parse('queries')
+        if not isinstance(queries, list) or len(queries) > MAX_BATCH:
+            raise tornado.web.HTTPError(
+                400, reason=f'Queries must be a list of at most {MAX_BATCH}')
+        for movies in queries:
+            _check_titles(movies)
+        with profiling.profile(f'api {algorithm} batch'):
+            results = await self.recommender.recommend_batch(
+                algorithm, queries, top_n)
+        self.write({'results': results})
+
+
+class UserHandler(BaseHandler):
+
+    def get(self, user_id):
+        from recommenders.batch_job import recommend_for_user
+        top_n = self.get_argument('top_n', '10')
+        if not top_n.isdigit() or not 0 < int(top_n) <= MAX_TOP_N:
+            raise tornado.web.HTTPError(
+                400, reason=f'top_n must be between 1 and {MAX_TOP_N}')
+        try:
+            with shared_store.pinned():
+                titles = recommend_for_user(int(user_id), int(top_n))
+        except FileNotFoundError:
+            raise tornado.web.HTTPError(
+                503, reason='No precomputed recommendations')
+        if titles is None:
+            raise tornado.web.HTTPError(404, reason='Unknown user')
+        self.write({'recommendations': titles})
+
+
+class TitlesHandler(BaseHandler):
+
+    def get(self):
+        from utils.title_search import search_titles
+        limit = self.get_argument('limit', '20')
+        if not limit.isdigit() or not 0 < int(limit) <= MAX_TOP_N:
+            raise tornado.web.HTTPError(
+                400, reason=f'limit must be between 1 and {MAX_TOP_N}')
+        self.write({'titles': search_titles(self.get_argument('q', ''),
+                                            int(limit))})
+
+
+class RatingsHandler(BaseHandler):
+
+    async def post(self):
+        try:
+            body = json.loads(self.request.body)
+            ratings = body['ratings']
+            records = [(rating['userId'], rating['movieId'], rating['rating'])
+                       for rating in ratings]
+        except (ValueError, KeyError, TypeError):
+            raise tornado.web.HTTPError(
+                400, reason='Body must be {"ratings": [{"userId", '
+                            '"movieId", "rating"}, ...]}')
+        if not 0 < len(records) <= MAX_BATCH or not all(
+                isinstance(user_id, int) and isinstance(movie_id, int)
+                and isinstance(rating, (int, float))
+                for user_id, movie_id, rating in records):
+            raise tornado.web.HTTPError(
+                400, reason=f'Between 1 and {MAX_BATCH} ratings with '
+                            f'integer ids and numeric ratings')
+        log = get_online_updates().log
+        try:
+            # SQLite blocks while writing, so append off the event loop
+            seq = await asyncio.get_running_loop().run_in_executor(
+                None, log.append, records)
+        except ValueError as error:
+            raise tornado.web.HTTPError(400, reason=str(error))
+        self.write({'accepted': len(records), 'seq': seq})
+
+
+class HealthHandler(BaseHandler):
+
+    def get(self):
+        cache = self.recommender.cache
+        snapshot = shared_store.attach()
+        self.write({'status': 'ok', 'workers': self.recommender.workers,
+                    'cached': len(cache), 'cache_hits': cache.hits,
+                    'cache_misses': cache.misses,
+                    'coalesced': self.recommender.coalesced,
+                    'snapshot': snapshot.generation if snapshot else None,
+                    'ratings_seq': get_online_updates().poll(),
+                    'memory_mb': shared_store.memory_usage()})
+
+
+class MetricsHandler(BaseHandler):
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write(profiling.prometheus_text())
+
+
+def make_app(recommender):
+    """Tornado application serving a `Recommender`."""
+    args = dict(recommender=recommender)
+    return tornado.web.Application([
+        (r'/recommend', RecommendHandler, args),
+        (r'/recommend/batch', BatchHandler, args),
+        (r'/users/(\d+)/recommendations', UserHandler, args),
+        (r'/titles', TitlesHandler, args),
+        (r'/ratings', RatingsHandler, args),
+        (r'/health', HealthHandler, args),
+        (r'/metrics', MetricsHandler, args),
+    ])
+
+
+async def serve(port, workers, cache_size):
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = None
+    # Workers started with `spawn` load their own copy of the models
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                               initializer=preload)
+    recommender = Recommender(pool, workers, LRUCache(maxsize=cache_size))
+    make_app(recommender).listen(port)
+    print(f'Serving recommendations on http://localhost:{port} '
+          f'with {workers} workers')
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recommendation API.')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--cache-size', type=int, default=10000)
+    parser.add_argument('--snapshot',
+                        help='Serve from the shared snapshot in this '
+                             'directory, building it if needed.')
+    args = parser.parse_args()
+    if args.snapshot:
+        from api.snapshot import build_snapshot
+        shared_store.configure(args.snapshot)
+        if shared_store.attach() is None:
+            print('Building shared snapshot...')
+            build_snapshot(args.snapshot)
+    print('Loading models...')
+    preload()
+    asyncio.run(serve(args.port, args.workers, args.cache_size))
+
+
+if __name__ == '__main__':
+    main()
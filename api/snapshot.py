@@ -0,0 +1,228 @@
+"""
+
+    Build the shared serving snapshot and measure worker memory.
+
+    Author: Explore Data Science Academy.
+
+    Description: Builds the ratings index, content features, popularity
+    table, SVD factors and item similarity index once, in this (loader)
+    process, and publishes them as a new generation of a shared snapshot
+    (see `utils.shared_store`). Serving processes then memory-map them
+    instead of each building their own copy. Running the build again,
+    e.g. after retraining the model, swaps the new generation into every
+    running process atomically.
+
+    `--measure` starts `--workers` fresh processes which each load every
+    recommender and answer the benchmark queries, first loading
+    everything in-process and then attached to the snapshot, and reports
+    the memory of every worker while all of them are alive. With
+    `--budget-mb`, it fails if a worker attached to the snapshot holds
+    more private memory than the budget.
+
+    Usage, from the root of the repository:
+
+        python -m api.snapshot
+        python -m api.snapshot --measure --workers 4 --budget-mb 140
+
+"""
+
+# Script dependencies
+import sys
+import argparse
+import importlib
+import multiprocessing
+from utils import shared_store
+from utils.registry import registry
+from utils.data_store import MOVIES_PATH, RATINGS_PATH
+
+SNAPSHOT_DIR = 'resources/models/shared'
+MODEL_PATH = 'resources/models/Base_SVD.pkl'
+# Private memory allowed per worker attached to the snapshot, in MB
+WORKER_BUDGET_MB = 140
+
+
+def build_snapshot(snapshot_dir=SNAPSHOT_DIR, model_path=MODEL_PATH,
+                   path_to_ratings=RATINGS_PATH, path_to_movies=MOVIES_PATH):
+    """Build every shared structure and publish them as a new generation.
+
+    Parameters
+    ----------
+    snapshot_dir : str
+        Snapshot directory.
+    model_path : str
+        Path to the pickled SVD model (its bundle is used if present).
+    path_to_ratings : str
+        Path to the ratings stored in .csv format.
+    path_to_movies : str
+        Path to the movie database stored in .csv format.
+
+    Returns
+    -------
+    str
+        Directory of the new generation.
+
+    """
+    from utils.popularity import get_popularity
+    from utils.catalogue import SharedCatalogue, get_catalogue
+    from utils.ratings_index import get_ratings_index
+    from recommenders.svd_scoring import load_factors
+    from recommenders.content_features import feature_sources, load_features
+    from recommenders.item_similarity import load_item_engine
+
+    # Build from the source files rather than from an older snapshot
+    previous = shared_store.SHARED_DIR
+    shared_store.configure(None)
+    try:
+        catalogue = get_catalogue(path_to_movies)
+        index = get_ratings_index(path_to_ratings, path_to_movies,
+                                  live=False)
+        matrix = load_features(path_to_movies).matrix
+        inverted = matrix.T.tocsr()
+        popularity = get_popularity(path_to_ratings, path_to_movies,
+                                    live=False)
+        factors = load_factors(model_path, live=False)
+        engine = load_item_engine(model_path, path_to_ratings,
+                                  path_to_movies)
+        groups = {
+            'catalogue': (
+                [path_to_movies], SharedCatalogue.arrays_of(catalogue), {}),
+            'ratings_index': (
+                [path_to_ratings, path_to_movies],
+                {'user_ids': index.user_ids, 'indptr': index.indptr,
+                 'item_rows': index.item_rows, 'ratings': index.ratings},
+                {}),
+            'content_features': (
+                feature_sources(path_to_movies),
+                {'data': matrix.data, 'indices': matrix.indices,
+                 'indptr': matrix.indptr, 'inverted_data': inverted.data,
+                 'inverted_indices': inverted.indices,
+                 'inverted_indptr': inverted.indptr},
+                {'shape': list(matrix.shape)}),
+            'popularity': (
+                [path_to_ratings, path_to_movies],
+                {'counts': popularity.counts,
+                 'bayesian': popularity.bayesian, 'top': popularity.top,
+                 'genre_names': popularity.genre_names,
+                 'genre_top': popularity.genre_top,
+                 'year_values': popularity.year_values,
+                 'year_top': popularity.year_top},
+                {'prior': popularity.prior,
+                 'global_mean': popularity.global_mean}),
+            'factors': (
+                [model_path],
+                {'pu': factors.pu, 'qi': factors.qi, 'bu': factors.bu,
+                 'bi': factors.bi, 'user_ids': factors.user_ids,
+                 'item_ids': factors.item_ids},
+                {'global_mean': float(factors.global_mean),
+                 'rating_scale': [float(bound)
+                                  for bound in factors.rating_scale],
+                 'biased': bool(factors.biased)}),
+            'item_engine': (
+                [model_path, path_to_ratings, path_to_movies],
+                {'vectors': engine.vectors, 'centroids': engine.centroids,
+                 'list_items': engine.list_items,
+                 'list_indptr': engine.list_indptr},
+                {'n_probe': engine.n_probe}),
+        }
+        directory = shared_store.write_snapshot(snapshot_dir, groups)
+    finally:
+        shared_store.configure(previous)
+        # Drop the in-process copies; they are served from the snapshot
+        registry.invalidate()
+    return directory
+
+
+def _measure_worker(snapshot_dir, queries, barrier, results):
+    """Load and exercise every recommender, then report memory once every
+    worker has done so."""
+    from api.server import ALGORITHMS, preload
+    shared_store.configure(snapshot_dir)
+    preload()
+    for module_name, function_name in ALGORITHMS.values():
+        model = getattr(importlib.import_module(module_name), function_name)
+        for movies in queries:
+            model(movie_list=movies, top_n=10)
+    barrier.wait()
+    results.put(shared_store.memory_usage())
+    # Stay alive until every worker has measured, so shared pages are
+    # divided among all of them
+    barrier.wait()
+
+
+def measure(workers, snapshot_dir=None, n_queries=20):
+    """Memory of `workers` fresh worker processes, all alive at once.
+
+    Parameters
+    ----------
+    workers : int
+        Number of worker processes.
+    snapshot_dir : str, optional
+        Snapshot the workers attach to. Without one, every worker loads
+        its own copy of everything.
+    n_queries : int
+        Number of benchmark queries each worker answers per recommender.
+
+    Returns
+    -------
+    list (dict)
+        `utils.shared_store.memory_usage` of every worker.
+
+    """
+    from benchmarks.run_benchmarks import make_queries
+    queries = make_queries(n_queries=n_queries)
+    # Spawned rather than forked, so that nothing is inherited from this
+    # process and each worker only shares what it maps from the snapshot
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [context.Process(target=_measure_worker,
+                                 args=(snapshot_dir, queries, barrier,
+                                       results))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    usage = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return usage
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Build the shared serving snapshot.')
+    parser.add_argument('--output', default=SNAPSHOT_DIR)
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--ratings', default=RATINGS_PATH)
+    parser.add_argument('--movies', default=MOVIES_PATH)
+    parser.add_argument('--measure', action='store_true',
+                        help='Measure worker memory instead of building.')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--budget-mb', type=float, default=WORKER_BUDGET_MB)
+    args = parser.parse_args()
+
+    if not args.measure:
+        directory = build_snapshot(args.output, args.model, args.ratings,
+                                   args.movies)
+        print(f'Published shared snapshot: {directory}')
+        return
+
+    if shared_store.attach(args.output) is None:
+        build_snapshot(args.output, args.model, args.ratings, args.movies)
+    print(f"{'mode':<10}{'worker':>8}{'rss':>10}{'pss':>10}"
+          f"{'shared':>10}{'private':>10}  (MB)")
+    over = []
+    for mode, snapshot_dir in (('private', None), ('shared', args.output)):
+        for worker, usage in enumerate(measure(args.workers, snapshot_dir)):
+            print(f"{mode:<10}{worker:>8}{usage['rss']:>10.1f}"
+                  f"{usage['pss']:>10.1f}{usage['shared']:>10.1f}"
+                  f"{usage['private']:>10.1f}")
+            if snapshot_dir and usage['private'] > args.budget_mb:
+                over.append(usage['private'])
+    if over:
+        print(f'{len(over)} worker(s) over the budget of '
+              f'{args.budget_mb:.0f} MB private memory')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+"""
+
+    Benchmark suite for recommender latency, throughput and memory.
+
+    Author: Explore Data Science Academy.
+
+    Description: Runs a fixed, seeded set of three-title queries against
+    each recommender and reports p50/p95/p99 latency, queries per second,
+    the cost of the first (cold) call, the time taken to import the
+    recommender module and the peak resident memory of the process.
+
+    Every (target, scale) pair runs in a fresh Python process, so import
+    time and peak memory are not polluted by other targets. Besides the
+    bundled `resources/data` files (scale 1), synthetic catalogues can be
+    generated by replicating the movies, users and ratings `scale` times,
+    to show how each path grows with the size of the data.
+
+    Usage, from the root of the repository:
+
+        python -m benchmarks.run_benchmarks
+        python -m benchmarks.run_benchmarks --scales 1 10 100 \\
+            --targets content collab --output after.json
+        python -m benchmarks.run_benchmarks --compare before.json after.json
+
+    To compare two revisions, run the suite with `--output` on each
+    checkout and then `--compare` the two result files.
+
+    NB: the content features and the columnar data cache are built on
+    the first run at each scale, and cached in the synthetic data
+    directory afterwards.
+
+"""
+
+# Script dependencies
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import importlib
+import subprocess
+import numpy as np
+import pandas as pd
+
+DATA_DIR = 'resources/data'
+SYNTHETIC_DIR = 'resources/data/synthetic'
+
+# Benchmark target -> (module, function)
+TARGETS = {
+    'content': ('recommenders.content_based', 'content_model'),
+    'collab': ('recommenders.collaborative_based', 'collab_model'),
+    'collab_2': ('recommenders.collaborative_based_2', 'collab_model'),
+    'load_movie_titles': ('utils.data_loader', 'load_movie_titles'),
+}
+
+
+def make_scaled_dataset(scale, data_dir=DATA_DIR, out_dir=SYNTHETIC_DIR):
+    """Write a copy of the data with every movie, user and rating
+    replicated `scale` times under fresh ids.
+
+    Replica 0 keeps the original ids and titles, so the benchmark queries
+    resolve at every scale; later replicas get a ' [k]' title suffix.
+
+    Parameters
+    ----------
+    scale : int
+        Number of replicas.
+    data_dir : str
+        Directory holding the original movies.csv and ratings.csv.
+    out_dir : str
+        Directory under which the `x<scale>` dataset is written.
+
+    Returns
+    -------
+    str
+        Directory holding the scaled movies.csv and ratings.csv.
+
+    """
+    target = os.path.join(out_dir, f'x{scale}')
+    if os.path.exists(os.path.join(target, 'ratings.csv')):
+        return target
+    os.makedirs(target, exist_ok=True)
+    movies = pd.read_csv(os.path.join(data_dir, 'movies.csv'))
+    ratings = pd.read_csv(os.path.join(data_dir, 'ratings.csv'))
+    movie_offset = int(movies['movieId'].max()) + 1
+    user_offset = int(ratings['userId'].max()) + 1
+
+    movie_copies = []
+    for k in range(scale):
+        copy = movies.copy()
+        copy['movieId'] += k * movie_offset
+        if k > 0:
+            copy['title'] = copy['title'] + f' [{k}]'
+        movie_copies.append(copy)
+    pd.concat(movie_copies).to_csv(os.path.join(target, 'movies.csv'),
+                                   index=False)
+
+    # Ratings are written replica by replica to keep memory bounded
+    ratings_path = os.path.join(target, 'ratings.csv')
+    for k in range(scale):
+        copy = ratings.copy()
+        copy['movieId'] += k * movie_offset
+        copy['userId'] += k * user_offset
+        copy.to_csv(ratings_path, index=False, mode='a' if k else 'w',
+                    header=(k == 0))
+    return target
+
+
+def make_queries(data_dir=DATA_DIR, n_queries=50, seed=42):
+    """Fixed set of three-title queries drawn from well-rated movies.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory holding the original movies.csv and ratings.csv.
+    n_queries : int
+        Number of queries.
+    seed : int
+        Random seed, so the same queries are used on every run.
+
+    Returns
+    -------
+    list (list (str))
+        Three titles per query.
+
+    """
+    movies = pd.read_csv(os.path.join(data_dir, 'movies.csv'))
+    ratings = pd.read_csv(os.path.join(data_dir, 'ratings.csv'))
+    counts = ratings['movieId'].value_counts()
+    popular = movies[movies['movieId'].isin(counts[counts >= 20].index)]
+    titles = sorted(popular['title'].unique())
+    rng = np.random.default_rng(seed)
+    return [list(rng.choice(titles, 3, replace=False))
+            for _ in range(n_queries)]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in KB elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_target(target, queries, data_dir):
+    """Benchmark one target within the current process.
+
+    Parameters
+    ----------
+    target : str
+        Key of `TARGETS`.
+    queries : list (list (str))
+        Three-title queries.
+    data_dir : str
+        Directory holding the movies.csv and ratings.csv to serve.
+
+    Returns
+    -------
+    dict
+        Timings (in ms), throughput and peak memory.
+
+    """
+    module_name, function_name = TARGETS[target]
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    import_ms = (time.perf_counter() - start) * 1000
+    function = getattr(module, function_name)
+
+    if target == 'load_movie_titles':
+        from utils.registry import registry
+        movies_path = os.path.join(data_dir, 'movies.csv')
+
+        def call(query):
+            # Measure a load from the columnar cache, not the registry
+            registry.invalidate(('movies', movies_path))
+            return function(movies_path)
+    else:
+        def call(query):
+            return function(movie_list=query, top_n=10)
+
+    start = time.perf_counter()
+    call(queries[0])
+    first_ms = (time.perf_counter() - start) * 1000
+
+    latencies = []
+    start = time.perf_counter()
+    for query in queries:
+        began = time.perf_counter()
+        call(query)
+        latencies.append((time.perf_counter() - began) * 1000)
+    elapsed = time.perf_counter() - start
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {'import_ms': import_ms, 'first_call_ms': first_ms,
+            'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99,
+            'qps': len(queries) / elapsed, 'peak_rss_mb': peak_rss_mb()}
+
+
+def run_in_subprocess(target, scale, n_queries, seed):
+    """Run one (target, scale) benchmark in a fresh Python process."""
+    env = dict(os.environ)
+    if scale > 1:
+        data_dir = make_scaled_dataset(scale)
+        env['RECOMMENDER_DATA_DIR'] = data_dir
+        env['RECOMMENDER_CONTENT_INDEX_DIR'] = os.path.join(data_dir,
+                                                            'content_index')
+        env['RECOMMENDER_CONTENT_FEATURES_DIR'] = os.path.join(
+            data_dir, 'content_features')
+        env['RECOMMENDER_POPULARITY_DIR'] = os.path.join(data_dir,
+                                                         'popularity')
+    command = [sys.executable, '-m', 'benchmarks.run_benchmarks',
+               '--worker', target, '--scales', str(scale),
+               '--queries', str(n_queries), '--seed', str(seed)]
+    completed = subprocess.run(command, env=env, capture_output=True,
+                               text=True)
+    if completed.returncode != 0:
+        return {'error': completed.stderr.strip().splitlines()[-1]}
+    # Recommenders may print progress, the result is the last line
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def format_results(results):
+    """Format benchmark results as a plain-text table."""
+    columns = ['import_ms', 'first_call_ms', 'p50_ms', 'p95_ms', 'p99_ms',
+               'qps', 'peak_rss_mb']
+    lines = [f"{'target':<18}{'scale':>6}" +
+             ''.join(f'{column:>15}' for column in columns)]
+    for result in results:
+        line = f"{result['target']:<18}{result['scale']:>6}"
+        if 'error' in result:
+            lines.append(line + f"  error: {result['error']}")
+            continue
+        lines.append(line + ''.join(f'{result[column]:>15.2f}'
+                                    for column in columns))
+    return '\n'.join(lines)
+
+
+def compare_results(before, after):
+    """Format the relative change between two sets of results.
+
+    Parameters
+    ----------
+    before, after : list (dict)
+        Results loaded from two `--output` files.
+
+    Returns
+    -------
+    str
+        One line per (target, scale) present in both, with the change in
+        p50 latency, p99 latency, throughput and peak memory.
+
+    """
+    baseline = {(r['target'], r['scale']): r for r in before}
+    lines = [f"{'target':<18}{'scale':>6}{'p50':>12}{'p99':>12}"
+             f"{'qps':>12}{'peak_rss':>12}"]
+    for result in after:
+        old = baseline.get((result['target'], result['scale']))
+        if old is None or 'error' in old or 'error' in result:
+            continue
+        changes = [result[column] / old[column] - 1 for column in
+                   ('p50_ms', 'p99_ms', 'qps', 'peak_rss_mb')]
+        lines.append(f"{result['target']:<18}{result['scale']:>6}" +
+                     ''.join(f'{change:>+12.1%}' for change in changes))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--targets', nargs='+', default=list(TARGETS),
+                        choices=list(TARGETS))
+    parser.add_argument('--scales', nargs='+', type=int, default=[1])
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write results as JSON to a file.')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='Compare two result files and exit.')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as before, open(args.compare[1]) as after:
+            print(compare_results(json.load(before), json.load(after)))
+        return
+
+    queries = make_queries(n_queries=args.queries, seed=args.seed)
+    if args.worker:
+        data_dir = os.environ.get('RECOMMENDER_DATA_DIR', DATA_DIR)
+        print(json.dumps(run_target(args.worker, queries, data_dir)))
+        return
+
+    results = []
+    for scale in args.scales:
+        for target in args.targets:
+            result = run_in_subprocess(target, scale, args.queries, args.seed)
+            result.update(target=target, scale=scale)
+            results.append(result)
+            print(format_results([result]).splitlines()[-1], flush=True)
+    print()
+    print(format_results(results))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
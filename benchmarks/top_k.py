@@ -0,0 +1,196 @@
+"""
+
+    Equivalence checks and benchmarks of the top-k helpers.
+
+    Author: Explore Data Science Academy.
+
+    Description: Every helper of `utils.topk` must return exactly what a
+    stable descending sort truncated to k entries returns, or switching
+    to it could change a recommendation. `check_equivalence` compares
+    them with full sorts on random scores, drawn from a few distinct
+    values so that ties are common, and also covering -inf scores (e.g.
+    masked movies), k = 0 and k larger than the number of scores.
+
+    `benchmark` then times each helper against the full sort it replaces
+    on random scores of catalogue size and beyond (the bundled catalogue
+    holds ~62k movies):
+
+        top_k         argsort of the scores
+        top_k_rows    argsort of every row of a block of scores
+        merge_top_k   argsort of every column, all blocks concatenated
+
+    Usage, from the root of the repository:
+
+        python -m benchmarks.top_k
+        python -m benchmarks.top_k --sizes 62000 620000 6200000 --k 50
+
+    Exits with an error if any helper differs from the full sort.
+
+"""
+
+# Script dependencies
+import sys
+import time
+import argparse
+import numpy as np
+from utils.topk import top_k, top_k_rows, merge_top_k
+
+# Number of movies in the bundled catalogue
+CATALOGUE_SIZE = 62000
+# Rows per block of the row-wise and block-wise benchmarks
+BLOCK_ROWS = 256
+
+
+def _scores(rng, shape, n_distinct=None):
+    """Random scores, with repeated values and a few -inf ones."""
+    if n_distinct:
+        values = rng.integers(0, n_distinct, size=shape).astype(np.float64)
+    else:
+        values = rng.random(shape)
+    values[rng.random(shape) < 0.05] = -np.inf
+    return values
+
+
+def _sorted_top_k(values, k, ties=None):
+    """Reference: full stable descending sort, truncated."""
+    if ties is None:
+        return np.argsort(-values, kind='stable')[:k]
+    return np.lexsort((np.arange(len(values)), ties, -values))[:k]
+
+
+def check_equivalence(n_trials=300, seed=0):
+    """Compare every helper with a full sort on random scores.
+
+    Parameters
+    ----------
+    n_trials : int
+        Number of random cases per helper.
+    seed : int
+        Random seed.
+
+    Returns
+    -------
+    list (str)
+        Description of every case where a helper differed.
+
+    """
+    rng = np.random.default_rng(seed)
+    failures = []
+    for trial in range(n_trials):
+        n = int(rng.integers(1, 300))
+        k = int(rng.integers(0, n + 5))
+        n_distinct = int(rng.choice([2, 5, 50, 0]))
+        values = _scores(rng, n, n_distinct)
+        ties = rng.permutation(n)
+        if not np.array_equal(top_k(values, k), _sorted_top_k(values, k)):
+            failures.append(f'top_k: trial {trial}, n={n}, k={k}')
+        if not np.array_equal(top_k(values, k, ties=ties),
+                              _sorted_top_k(values, k, ties)):
+            failures.append(f'top_k with ties: trial {trial}, n={n}, k={k}')
+
+        matrix = _scores(rng, (int(rng.integers(1, 20)), n), n_distinct)
+        columns, scores = top_k_rows(matrix, k)
+        expected = np.argsort(-matrix, axis=1, kind='stable')[:, :k]
+        if not (np.array_equal(columns, expected) and np.array_equal(
+                scores, np.take_along_axis(matrix, expected, axis=1))):
+            failures.append(f'top_k_rows: trial {trial}, n={n}, k={k}')
+
+        block_rows = int(rng.integers(1, 40))
+        blocks = (matrix.T[start:start + block_rows]
+                  for start in range(0, n, block_rows))
+        for column, (rows, scores) in enumerate(merge_top_k(blocks, k)):
+            expected = _sorted_top_k(matrix[column], k)
+            if not (np.array_equal(rows, expected) and np.array_equal(
+                    scores, matrix[column][expected])):
+                failures.append(f'merge_top_k: trial {trial}, n={n}, k={k}')
+                break
+    return failures
+
+
+def _best_ms(function, repeats):
+    """Fastest of several runs of a function, in ms."""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def benchmark(sizes, k=10, repeats=5, seed=0):
+    """Time every helper against the full sort it replaces.
+
+    Parameters
+    ----------
+    sizes : list (int)
+        Numbers of scores, e.g. multiples of the catalogue size.
+    k : int
+        Number of entries kept.
+    repeats : int
+        Runs per timing; the fastest is kept.
+    seed : int
+        Random seed.
+
+    Returns
+    -------
+    list (dict)
+        Helper, number of scores, and sort and top-k timings in ms.
+
+    """
+    rng = np.random.default_rng(seed)
+    results = []
+    for n in sizes:
+        values = _scores(rng, n)
+        block = _scores(rng, (BLOCK_ROWS, n // BLOCK_ROWS))
+        matrix = _scores(rng, (n, 3))
+        cases = {
+            'top_k': (lambda: np.argsort(-values, kind='stable')[:k],
+                      lambda: top_k(values, k)),
+            'top_k_rows': (
+                lambda: np.argsort(-block, axis=1, kind='stable')[:, :k],
+                lambda: top_k_rows(block, k)),
+            'merge_top_k': (
+                lambda: np.argsort(-matrix, axis=0, kind='stable')[:k],
+                lambda: merge_top_k(
+                    (matrix[start:start + 65536]
+                     for start in range(0, n, 65536)), k)),
+        }
+        for name, (full_sort, selection) in cases.items():
+            results.append({'helper': name, 'n': n,
+                            'sort_ms': _best_ms(full_sort, repeats),
+                            'top_k_ms': _best_ms(selection, repeats)})
+    return results
+
+
+def format_results(results):
+    """Format benchmark results as a plain-text table."""
+    lines = [f"{'helper':<15}{'scores':>10}{'sort_ms':>12}{'top_k_ms':>12}"
+             f"{'speed-up':>10}"]
+    for result in results:
+        lines.append(f"{result['helper']:<15}{result['n']:>10}"
+                     f"{result['sort_ms']:>12.2f}{result['top_k_ms']:>12.2f}"
+                     f"{result['sort_ms'] / result['top_k_ms']:>9.1f}x")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sizes', nargs='+', type=int,
+                        default=[CATALOGUE_SIZE, 10 * CATALOGUE_SIZE])
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--trials', type=int, default=300)
+    args = parser.parse_args()
+
+    failures = check_equivalence(args.trials)
+    print(f'Equivalence with full sorts: {len(failures)} failure(s) in '
+          f'{args.trials} trials per helper')
+    for failure in failures[:20]:
+        print(f'  {failure}')
+    print(format_results(benchmark(args.sizes, args.k, args.repeats)))
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -25,23 +25,124 @@
 	https://docs.streamlit.io/en/latest/
 
 """
+# Startup timing
+from utils import startup
+
 # Streamlit dependencies
-import streamlit as st
+with startup.stage('import streamlit'):
+    import streamlit as st
 
 # Data handling dependencies
-import pandas as pd
-import numpy as np
+with startup.stage('import pandas and numpy'):
+    import pandas as pd
+    import numpy as np
 
 # Custom Libraries
 from utils.data_loader import load_movie_titles
-from recommenders.collaborative_based import collab_model
-from recommenders.content_based import content_model
+from utils.result_cache import LRUCache
+from utils import profiling, shared_store
+from utils.online_updates import get_online_updates
 
 #HTML renders
 import codecs
 
+# Heavy state (titles, recommendation results) is held in process-wide
+# cached resources, so Streamlit reruns and concurrent sessions share a
+# single copy. Older Streamlit releases only offer `st.cache`.
+if hasattr(st, 'cache_resource'):
+    cache_resource = st.cache_resource
+else:
+    cache_resource = st.cache(allow_output_mutation=True)
+
+@cache_resource
+def movie_titles():
+    return load_movie_titles('resources/data/movies.csv')
+
+@cache_resource
+def recommendation_cache():
+    # Recommendations memoised per (algorithm, titles, top_n)
+    return LRUCache(maxsize=1024, ttl=3600)
+
 # Data Loading
-title_list = load_movie_titles('resources/data/movies.csv')
+with startup.stage('load movie titles'):
+    title_list = movie_titles()
+
+# The recommenders pull in surprise and scikit-learn and load the model
+# artefacts when imported, so they are only imported the first time a
+# recommendation is requested (or by the optional background warm-up).
+startup.start_background_warm_up()
+
+def memoised(algorithm, movie_list, top_n, compute):
+    """Memoise a recommendation, profiling it if the timing breakdown is
+    switched on in the sidebar."""
+    enabled = st.session_state.get('show_timings', False)
+    # Every lookup of the recommendation uses the same snapshot generation
+    with shared_store.pinned() as snapshot:
+        # Results computed from an older generation, or before the latest
+        # rating was logged, are stale
+        key = (snapshot.generation if snapshot else None,
+               get_online_updates().poll(), algorithm, tuple(movie_list),
+               top_n)
+        with profiling.profile(algorithm, enabled,
+                               trace_memory=True) as request:
+            result = list(recommendation_cache().get_or_compute(key,
+                                                                compute))
+    if request is not None:
+        st.session_state['last_profile'] = request
+    return result
+
+def content_model(movie_list,top_n=10):
+    """Lazily import and run `recommenders.content_based.content_model`,
+    memoising the result."""
+    def compute():
+        with startup.stage('import content-based recommender'):
+            from recommenders.content_based import content_model as model
+        return model(movie_list, top_n=top_n)
+    return memoised('content', movie_list, top_n, compute)
+
+def collab_model(movie_list,top_n=10):
+    """Lazily import and run `recommenders.collaborative_based.collab_model`,
+    memoising the result."""
+    def compute():
+        with startup.stage('import collaborative recommender'):
+            from recommenders.collaborative_based import collab_model as model
+        return model(movie_list, top_n=top_n)
+    return memoised('collab', movie_list, top_n, compute)
+
+def hybrid_model(movie_list,top_n=10):
+    """Lazily import and run `recommenders.hybrid_based.hybrid_model`,
+    memoising the result."""
+    def compute():
+        with startup.stage('import hybrid recommender'):
+            from recommenders.hybrid_based import hybrid_model as model
+        return model(movie_list, top_n=top_n)
+    return memoised('hybrid', movie_list, top_n, compute)
+
+def item_factor_model(movie_list,top_n=10):
+    """Lazily import and run
+    `recommenders.collaborative_based.item_factor_model`, memoising the
+    result."""
+    def compute():
+        with startup.stage('import collaborative recommender'):
+            from recommenders.collaborative_based import (
+                item_factor_model as model)
+        return model(movie_list, top_n=top_n)
+    return memoised('item', movie_list, top_n, compute)
+
+def title_picker(label, titles):
+    """Movie picker over the whole catalogue: offers the titles best
+    matching the text typed in the search box above it, or `titles`
+    until something is typed. Returns None when nothing matches."""
+    query = st.text_input(f'Search: {label}', key=f'search {label}')
+    if query:
+        # The first search builds the index
+        with startup.stage('build title search index'):
+            from utils.title_search import search_titles
+            titles = search_titles(query)
+        if not titles:
+            st.selectbox(label, ['No matching movie'], disabled=True)
+            return None
+    return st.selectbox(label, titles)
 
 # App declaration
 def main():
@@ -62,18 +163,22 @@ def main():
         # Recommender System algorithm selection
         sys = st.radio("Select an algorithm",
                        ('Content Based Filtering',
-                        'Collaborative Based Filtering'))
+                        'Collaborative Based Filtering',
+                        'Hybrid',
+                        'Similar Movies (SVD item factors)'))
 
         # User-based preferences
         st.write('### Enter Your Three Favorite Movies')
-        movie_1 = st.selectbox('first Option',title_list[14930:15200])
-        movie_2 = st.selectbox('Second Option',title_list[25055:25255])
-        movie_3 = st.selectbox('Third Option',title_list[21100:21200])
+        movie_1 = title_picker('first Option',title_list[14930:15200])
+        movie_2 = title_picker('Second Option',title_list[25055:25255])
+        movie_3 = title_picker('Third Option',title_list[21100:21200])
         fav_movies = [movie_1,movie_2,movie_3]
+        # Every picker must hold a movie before recommending
+        ready = None not in fav_movies
 
         # Perform top-10 movie recommendation generation
         if sys == 'Content Based Filtering':
-            if st.button("Recommend"):
+            if st.button("Recommend", disabled=not ready):
                 print(fav_movies)
                 try:
                     with st.spinner('Crunching the numbers...'):
@@ -88,7 +193,7 @@ def main():
 
 
         if sys == 'Collaborative Based Filtering':
-            if st.button("Recommend"):
+            if st.button("Recommend", disabled=not ready):
                 try:
                     with st.spinner('Crunching the numbers...'):
                         top_recommendations = collab_model(movie_list=fav_movies,
@@ -101,9 +206,45 @@ def main():
                               We'll need to fix it!")
 
 
+        if sys == 'Hybrid':
+            if st.button("Recommend", disabled=not ready):
+                try:
+                    with st.spinner('Crunching the numbers...'):
+                        top_recommendations = hybrid_model(movie_list=fav_movies,
+                                                           top_n=10)
+                    st.title("We think you'll like:")
+                    for i,j in enumerate(top_recommendations):
+                        st.subheader(str(i+1)+'. '+j)
+                except:
+                    st.error("Oops! Looks like this algorithm does't work.\
+                              We'll need to fix it!")
+
+
+        if sys == 'Similar Movies (SVD item factors)':
+            if st.button("Recommend", disabled=not ready):
+                try:
+                    with st.spinner('Crunching the numbers...'):
+                        top_recommendations = item_factor_model(
+                            movie_list=fav_movies, top_n=10)
+                    st.title("We think you'll like:")
+                    for i,j in enumerate(top_recommendations):
+                        st.subheader(str(i+1)+'. '+j)
+                except:
+                    st.error("Oops! Looks like this algorithm does't work.\
+                              We'll need to fix it!")
+
+
     # -------------------------------------------------------------------
 
     # ------------- SAFE FOR ALTERING/EXTENSION -------------------
+    if page_selection == "Recommender System":
+        # Time (and memory) breakdown of the last recommendation
+        if st.sidebar.checkbox('Show timing breakdown', key='show_timings'):
+            request = st.session_state.get('last_profile')
+            if request is not None:
+                st.write('### Timing breakdown')
+                st.code(request.table())
+
     if page_selection == "Home":
         #st.title("Solution Overview")
         #st.write("Describe your winning approach on this page")
@@ -222,4 +363,6 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    with startup.stage('first render'):
+        main()
+    startup.print_report_once()
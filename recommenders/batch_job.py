@@ -0,0 +1,301 @@
+"""
+
+    Offline top-N recommendations for every user.
+
+    Author: Explore Data Science Academy.
+
+    Description: Scores every user known to the SVD model against every
+    movie, masks the movies each user has already rated and keeps the
+    top-N, so that a user's recommendations can later be served with a
+    single lookup. Users are scored in blocks: one (block x n_items)
+    matrix multiply per block, with the blocks fanned out across a pool of
+    worker processes.
+
+    The results are written as a table of NumPy arrays, published as a
+    new generation of a directory in the same way as a model bundle (see
+    `recommenders.model_bundle`):
+
+        <table>/CURRENT
+        <table>/<generation>/manifest.json
+        <table>/<generation>/user_ids.npy    sorted raw user ids
+        <table>/<generation>/movie_ids.npy   (n_users x top_n) int32
+        <table>/<generation>/scores.npy      (n_users x top_n) float16
+
+    Rows are padded with movie id -1 when a user has rated nearly every
+    movie. Meant to run nightly, from the root of the repository:
+
+        python -m recommenders.batch_job --top-n 50 --workers 4
+
+"""
+
+# Script dependencies
+import os
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from utils.registry import registry
+from utils.catalogue import get_catalogue
+from utils.data_store import MOVIES_PATH, RATINGS_PATH
+from utils.ingest import Progress
+from utils.ratings_index import get_ratings_index
+from utils.topk import top_k_rows
+from recommenders.svd_scoring import load_factors
+from recommenders.model_bundle import (current_generation, new_generation,
+                                       publish)
+
+MODEL_PATH = 'resources/models/Base_SVD.pkl'
+TABLE_DIR = 'resources/models/user_recommendations'
+TOP_N = 50
+BLOCK_SIZE = 512
+
+# Model, ratings and id mappings used by `score_users` in each process
+_job = {}
+
+
+def _init_worker(model_path, ratings_path, movies_path):
+    """Load what `score_users` needs. Forked workers inherit it from the
+    parent process, so this is then only a registry lookup."""
+    factors = load_factors(model_path)
+    catalogue = get_catalogue(movies_path)
+    _job.update(
+        factors=factors,
+        ratings=get_ratings_index(ratings_path, movies_path),
+        # Catalogue row -> inner item id of the model, -1 if unknown
+        inner_of_row=factors.item_index(catalogue.movie_ids))
+
+
+def score_users(start, stop, top_n):
+    """Top-N unrated movies of a block of users.
+
+    Parameters
+    ----------
+    start, stop : int
+        Range of inner user ids to score.
+    top_n : int
+        Number of movies kept per user.
+
+    Returns
+    -------
+    tuple (numpy.ndarray, numpy.ndarray)
+        (stop - start) x top_n raw movie ids (-1 for padding) and
+        estimated ratings (NaN for padding), best first.
+
+    """
+    factors = _job['factors']
+    est = np.asarray(factors.pu[start:stop]) @ np.asarray(factors.qi).T
+    if factors.biased:
+        est += np.asarray(factors.bu[start:stop])[:, None]
+        est += np.asarray(factors.bi)[None, :]
+        est += factors.global_mean
+
+    # Mask every movie the users have already rated
+    rows, _, owners = _job['ratings'].gather(factors.user_ids[start:stop])
+    inner = _job['inner_of_row'][rows]
+    known = inner >= 0
+    est[owners[known], inner[known]] = -np.inf
+
+    # Highest estimate first, ties broken on inner item id, row by row
+    top, top_scores = top_k_rows(est, top_n)
+
+    rated = ~np.isfinite(top_scores)
+    movie_ids = np.where(rated, -1, factors.item_ids[top]).astype(np.int32)
+    lower_bound, higher_bound = factors.rating_scale
+    scores = np.clip(top_scores, lower_bound, higher_bound)
+    scores[rated] = np.nan
+    return movie_ids, scores
+
+
+def run(model_path=MODEL_PATH, ratings_path=RATINGS_PATH,
+        movies_path=MOVIES_PATH, table_dir=TABLE_DIR, top_n=TOP_N,
+        block_size=BLOCK_SIZE, workers=None):
+    """Compute and publish the top-N table of every user.
+
+    Parameters
+    ----------
+    model_path : str
+        Path to the pickled SVD model (its bundle is used if present).
+    ratings_path : str
+        Path to the ratings stored in .csv format.
+    movies_path : str
+        Path to the movie database stored in .csv format.
+    table_dir : str
+        Directory of the published table.
+    top_n : int
+        Number of movies kept per user.
+    block_size : int
+        Number of users scored per matrix multiply.
+    workers : int, optional
+        Size of the process pool. Defaults to the number of CPUs.
+
+    Returns
+    -------
+    str
+        Directory of the new table generation.
+
+    """
+    _init_worker(model_path, ratings_path, movies_path)
+    factors = _job['factors']
+    n_users = factors.n_users
+    top_n = min(top_n, factors.n_items)
+    # Rows of the table are ordered by raw user id, for binary search
+    order = np.argsort(factors.user_ids, kind='stable')
+    row_of_inner = np.empty(n_users, dtype=np.int64)
+    row_of_inner[order] = np.arange(n_users)
+
+    os.makedirs(table_dir, exist_ok=True)
+    generation, directory = new_generation(table_dir)
+    np.save(os.path.join(directory, 'user_ids.npy'),
+            factors.user_ids[order].astype(np.int64))
+    movie_ids = np.lib.format.open_memmap(
+        os.path.join(directory, 'movie_ids.npy'), mode='w+',
+        dtype=np.int32, shape=(n_users, top_n))
+    scores = np.lib.format.open_memmap(
+        os.path.join(directory, 'scores.npy'), mode='w+',
+        dtype=np.float16, shape=(n_users, top_n))
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = None
+    start = time.perf_counter()
+    progress = Progress('users')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker,
+                             initargs=(model_path, ratings_path,
+                                       movies_path)) as pool:
+        blocks = [(first, min(first + block_size, n_users))
+                  for first in range(0, n_users, block_size)]
+        results = pool.map(score_users, *zip(*blocks),
+                           [top_n] * len(blocks))
+        for (first, last), (block_ids, block_scores) in zip(blocks, results):
+            rows = row_of_inner[first:last]
+            movie_ids[rows] = block_ids
+            scores[rows] = block_scores
+            progress.update(last - first, last / n_users)
+    progress.done()
+    movie_ids.flush()
+    scores.flush()
+    del movie_ids, scores
+
+    manifest = {
+        'generation': generation,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'model': os.path.basename(model_path),
+        'ratings': os.path.basename(ratings_path),
+        'n_users': int(n_users),
+        'top_n': int(top_n),
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+    with open(os.path.join(directory, 'manifest.json'), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    publish(table_dir, generation)
+    return directory
+
+
+class UserRecommendations:
+    """Memory-mapped top-N table written by `run`.
+
+    Parameters
+    ----------
+    table_dir : str
+        Directory of the published table.
+
+    """
+
+    def __init__(self, table_dir=TABLE_DIR):
+        directory = current_generation(table_dir)
+        if directory is None:
+            raise FileNotFoundError(f'No recommendation table in: '
+                                    f'{table_dir}')
+        with open(os.path.join(directory, 'manifest.json')) as manifest_file:
+            self.manifest = json.load(manifest_file)
+        self.user_ids = np.load(os.path.join(directory, 'user_ids.npy'))
+        self.movie_ids = np.load(os.path.join(directory, 'movie_ids.npy'),
+                                 mmap_mode='r')
+        self.scores = np.load(os.path.join(directory, 'scores.npy'),
+                              mmap_mode='r')
+
+    def lookup(self, user_id, top_n=None):
+        """Precomputed recommendations of one user.
+
+        Parameters
+        ----------
+        user_id : int
+            Raw MovieLens user id.
+        top_n : int, optional
+            Number of movies to return, at most the table's `top_n`.
+
+        Returns
+        -------
+        tuple (numpy.ndarray, numpy.ndarray) or None
+            Raw movie ids and estimated ratings, best first, or None if
+            the user is not in the table.
+
+        """
+        row = np.searchsorted(self.user_ids, user_id)
+        if row == len(self.user_ids) or self.user_ids[row] != user_id:
+            return None
+        movie_ids = np.asarray(self.movie_ids[row, :top_n])
+        found = movie_ids >= 0
+        return (movie_ids[found],
+                np.asarray(self.scores[row, :top_n])[found].astype(float))
+
+
+def load_user_recommendations(table_dir=TABLE_DIR):
+    """Top-N table shared process-wide, reloaded when a new one is
+    published."""
+    return registry.get(('user_recommendations', table_dir),
+                        lambda: UserRecommendations(table_dir),
+                        [os.path.join(table_dir, 'CURRENT')])
+
+
+def recommend_for_user(user_id, top_n=10, table_dir=TABLE_DIR,
+                       path_to_movies=MOVIES_PATH):
+    """Titles of the precomputed recommendations of a MovieLens user.
+
+    Parameters
+    ----------
+    user_id : int
+        Raw MovieLens user id.
+    top_n : int
+        Number of recommendations to return.
+    table_dir : str
+        Directory of the published table.
+    path_to_movies : str
+        Path to the movie database stored in .csv format.
+
+    Returns
+    -------
+    list (str) or None
+        Titles of the top-n movies, or None if the user is unknown.
+
+    """
+    found = load_user_recommendations(table_dir).lookup(user_id, top_n)
+    if found is None:
+        return None
+    catalogue = get_catalogue(path_to_movies)
+    rows = [catalogue.row_of_movie_id(movie_id) for movie_id in found[0]]
+    return catalogue.titles_of([row for row in rows if row is not None])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Precompute top-N recommendations for every user.')
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--ratings', default=RATINGS_PATH)
+    parser.add_argument('--movies', default=MOVIES_PATH)
+    parser.add_argument('--output', default=TABLE_DIR)
+    parser.add_argument('--top-n', type=int, default=TOP_N)
+    parser.add_argument('--block-size', type=int, default=BLOCK_SIZE)
+    parser.add_argument('--workers', type=int)
+    args = parser.parse_args()
+    directory = run(args.model, args.ratings, args.movies, args.output,
+                    args.top_n, args.block_size, args.workers)
+    print(f'Published recommendation table: {directory}')
+
+
+if __name__ == '__main__':
+    main()
@@ -35,20 +35,32 @@ import pickle
 import copy
 from surprise import Reader, Dataset
 from surprise import SVD, NormalPredictor, BaselineOnly, KNNBasic, NMF
+from surprise import Prediction
 from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.metrics.pairwise import linear_kernel
 from sklearn.feature_extraction.text import CountVectorizer
+from recommenders.svd_scoring import load_factors
+from utils.registry import get_user_ids
+from utils.catalogue import get_catalogue
+from utils.data_store import RATINGS_PATH, load_movies, load_ratings
+from utils.ratings_index import get_ratings_index
+from utils.popularity import fallback_rows
+from recommenders.item_similarity import load_item_engine
+from utils.profiling import instrument, span
+from utils.topk import top_k
 
 
 
 # Importing data
-movies_df = pd.read_csv('resources/data/movies.csv',sep = ',',delimiter=',')
-ratings_df = pd.read_csv('resources/data/ratings.csv')
-ratings_df.drop(['timestamp'], axis=1,inplace=True)
+movies_df = load_movies()
+ratings_df = load_ratings()
 
 # We make use of an SVD model trained on a subset of the MovieLens 10k dataset.
-model=pickle.load(open('resources/models/Base_SVD.pkl', 'rb'))
+# The model and the rating user ids are loaded once, on first use, and
+# shared through the process-wide registry in `utils.registry`.
+MODEL_PATH = 'resources/models/Base_SVD.pkl'
 
+@instrument()
 def prediction_item(item_id):
     """Map a given favourite movie to users within the
        MovieLens dataset with the same preference.
@@ -64,16 +76,18 @@ def prediction_item(item_id):
         User IDs of users with similar high ratings for the given movie.
 
     """
-    # Data preprosessing
-    reader = Reader(rating_scale=(0, 5))
-    load_df = Dataset.load_from_df(ratings_df,reader)
-    a_train = load_df.build_full_trainset()
-
+    factors = load_factors(MODEL_PATH)
+    user_ids = get_user_ids(RATINGS_PATH)
+    # Score every user for the item in a single matrix product
+    estimates = factors.score(factors.user_index(user_ids),
+                              factors.item_index([item_id]))[:, 0]
     predictions = []
-    for ui in a_train.all_users():
-        predictions.append(model.predict(iid=item_id,uid=ui, verbose = False))
+    for uid, est in zip(user_ids, estimates):
+        predictions.append(Prediction(uid, item_id, None, est,
+                                      {'was_impossible': False}))
     return predictions
 
+@instrument()
 def pred_movies(movie_list):
     """Maps the given favourite movies selected within the app to corresponding
     users within the MovieLens dataset.
@@ -91,19 +105,167 @@ def pred_movies(movie_list):
     """
     # Store the id of users
     id_store=[]
-    # For each movie selected by a user of the app,
-    # predict a corresponding user within the dataset with the highest rating
-    for i in movie_list:
-        predictions = prediction_item(item_id = i)
-        predictions.sort(key=lambda x: x.est, reverse=True)
-        # Take the top 10 user id's from each movie with highest rankings
-        for pred in predictions[:10]:
-            id_store.append(pred.uid)
+    # For each movie selected by a user of the app, predict the users
+    # within the dataset with the highest rating. All movies are scored
+    # against all users at once.
+    factors = load_factors(MODEL_PATH)
+    top_users = factors.top_users(movie_list, k=10,
+                                  user_ids=get_user_ids(RATINGS_PATH))
+    # Take the top 10 user id's from each movie with highest rankings
+    for users in top_users:
+        id_store.extend(users.tolist())
     # Return a list of user id's
     return id_store
 
+@instrument()
+def item_factor_model(movie_list,top_n=10,exact=False,n_probe=None):
+    """Recommends the movies whose SVD item factors are closest to those
+       of the movies supplied by the app user, among the movies rated
+       often enough for their factors to be reliable (see
+       `recommenders.item_similarity`).
+
+    Parameters
+    ----------
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    top_n : int
+        Number of top recommendations to return to the user.
+    exact : bool
+        Score every movie rather than searching the approximate index.
+    n_probe : int, optional
+        Number of index clusters searched in approximate mode; higher is
+        slower but finds more of the exact neighbours.
+
+    Returns
+    -------
+    list (str)
+        Titles of the top-n movie recommendations to the user.
+
+    """
+    with span('title lookup'):
+        catalogue = get_catalogue()
+        index_list = catalogue.rows_of_titles(movie_list)
+    factors = load_factors(MODEL_PATH)
+    # Inner ids of the chosen movies which the model knows about
+    items = factors.item_index(catalogue.movie_ids_of(index_list))
+    items = items[items >= 0]
+    rows = []
+    if len(items) > 0:
+        with span('similarity'):
+            engine = load_item_engine(MODEL_PATH)
+            # Ask for a few extra results, as some may not be in the
+            # catalogue
+            found, _ = engine.search(engine.query_vector(items),
+                                     k=2 * top_n, exact=exact,
+                                     n_probe=n_probe, exclude=items)
+            rows = [catalogue.row_of_movie_id(movie_id)
+                    for movie_id in factors.item_ids[found]]
+            rows = [row for row in rows if row is not None][:top_n]
+    if len(rows) < top_n:
+        with span('fallback'):
+            # Too few similar movies (or none the model knows): fill up
+            # with the best-rated movies sharing a genre with the chosen
+            # ones
+            rows += list(fallback_rows(index_list, top_n - len(rows),
+                                       exclude=list(index_list) + rows))
+    return catalogue.titles_of(rows)
+
+def fold_in_user(index_list,implied_rating=None,reg=0.1):
+    """Folds an app user into the SVD latent space from their favourite
+       movies.
+
+    Parameters
+    ----------
+    index_list : list (int)
+        Catalogue rows of the favourite movies.
+    implied_rating : float, optional
+        Rating assumed for each favourite movie. Defaults to the top of
+        the model's rating scale.
+    reg : float
+        Regularisation strength of the fold-in least-squares problem.
+
+    Returns
+    -------
+    tuple (SVDFactors, numpy.ndarray, float, numpy.ndarray) or None
+        The factors the user was folded into, the inner ids of the
+        favourite movies they know, and the user's bias and factor
+        vector. None if the model knows none of the favourite movies.
+
+    """
+    catalogue = get_catalogue()
+    factors = load_factors(MODEL_PATH)
+    # Inner ids of the chosen movies which the model knows about
+    items = factors.item_index(catalogue.movie_ids_of(index_list))
+    items = items[items >= 0]
+    if len(items) == 0:
+        return None
+    if implied_rating is None:
+        implied_rating = factors.rating_scale[1]
+    user_bias, user_factors = factors.fold_in(
+        items, np.full(len(items), implied_rating), reg=reg)
+    return factors, items, user_bias, user_factors
+
+def fold_in_estimates(user,index_list):
+    """Unclipped estimated ratings of some movies for an app user folded
+       in by `fold_in_user`; movies unknown to the model get the user's
+       baseline estimate.
+
+    Parameters
+    ----------
+    user : tuple
+        The user, as returned by `fold_in_user`.
+    index_list : numpy.ndarray
+        Catalogue rows of the movies to score.
+
+    Returns
+    -------
+    numpy.ndarray
+        Estimated rating of every movie.
+
+    """
+    factors, _, user_bias, user_factors = user
+    items = factors.item_index(get_catalogue().movie_ids_of(index_list))
+    return factors.score_user(user_bias, user_factors, items)
+
+def fold_in_candidates(user,n_candidates):
+    """Highest scoring movies for an app user folded into the SVD latent
+       space from their favourite movies. Unlike `collab_model`, no
+       existing users are scored, so the cost is independent of the
+       number of users in the dataset.
+
+    Parameters
+    ----------
+    user : tuple
+        The user, as returned by `fold_in_user`.
+    n_candidates : int
+        Maximum number of movies to return.
+
+    Returns
+    -------
+    tuple (numpy.ndarray, numpy.ndarray)
+        Catalogue rows and estimated ratings (clipped to the rating scale)
+        of the movies other than the favourites, best first.
+
+    """
+    catalogue = get_catalogue()
+    factors, items, user_bias, user_factors = user
+    # One matrix-vector product scores every movie; movies are ranked on
+    # the unclipped estimates, as clipping would tie the best ones
+    scores = factors.score_user(user_bias, user_factors)
+    scores[items] = -np.inf
+    # Ask for a few extra results, as some may not be in the catalogue
+    found = top_k(scores, 2 * n_candidates)
+    found = found[np.isfinite(scores[found])]
+    rows = [catalogue.row_of_movie_id(movie_id)
+            for movie_id in factors.item_ids[found]]
+    keep = [i for i, row in enumerate(rows) if row is not None]
+    keep = keep[:n_candidates]
+    return (np.array([rows[i] for i in keep], dtype=np.int64),
+            factors.clip(scores[found[keep]]))
+
 # !! DO NOT CHANGE THIS FUNCTION SIGNATURE !!
 # You are, however, encouraged to change its content.
+@instrument()
 def collab_model(movie_list,top_n=10):
     """Performs Collaborative filtering based upon a list of movies supplied
        by the app user.
@@ -124,20 +286,23 @@ def collab_model(movie_list,top_n=10):
 
 
 
-    indices = pd.Series(movies_df['title'])
-    movie_ids = pred_movies(movie_list)
-    df_init_users = ratings_df[ratings_df['userId']==movie_ids[0]]
-    for i in movie_ids :
-        df_init_users=df_init_users.append(ratings_df[ratings_df['userId']==i])
-
-
-    idx_1 = indices[indices == movie_list[0]].index[0]
-    idx_2 = indices[indices == movie_list[1]].index[0]
-    idx_3 = indices[indices == movie_list[2]].index[0]
-
-    num = int(str(idx_1)+str(idx_2)+str(idx_3))
-    random.seed(num)
-    ratings = movies_df.merge(ratings_df, on='movieId')
+    with span('title lookup'):
+        catalogue = get_catalogue()
+        # Resolve the chosen titles to catalogue rows, skipping unknown
+        # titles
+        index_list = catalogue.rows_of_titles(movie_list)
+    if len(index_list) == 0:
+        # Nothing to go on: the best-rated movies overall
+        with span('fallback'):
+            return catalogue.titles_of(fallback_rows(top_n=top_n))
+    # The SVD model is keyed on MovieLens movie ids rather than titles
+    movie_ids = pred_movies(catalogue.movie_ids_of(index_list))
+    with span('gather ratings'):
+        # Users picked for several of the chosen movies count several times
+        user_ids, user_weights = np.unique(movie_ids, return_counts=True)
+        # Every rating of the similar users, in a single slice of the
+        # user -> ratings index (already joined to catalogue rows)
+        item_rows, ratings, owners = get_ratings_index().gather(user_ids)
 
 
     # Creating a Series with the similarity scores in descending order
@@ -156,10 +321,26 @@ def collab_model(movie_list,top_n=10):
 
 
     #similar = get_similar(idx_1,5)
-    userId_list = list(df_init_users['userId'])
-    similar_users = ratings[ratings['userId'].isin(userId_list)].sort_values('rating',ascending=False)
-    similar_users = similar_users[similar_users['rating']>=3]
-    recommended_movies = random.choices(list(similar_users['title']),k=10)
+    # Score each movie the similar users liked (rated 3 or more) by the sum
+    # of their ratings, weighted by how often each user was picked
+    with span('merge'):
+        liked = ratings >= 3
+        scores = np.bincount(item_rows[liked],
+                             weights=(ratings * user_weights[owners])[liked],
+                             minlength=len(catalogue))
+        # Removing chosen movies
+        scores[index_list] = 0
+        candidates = np.flatnonzero(scores)
+    with span('top-k'):
+        # Highest score first, ties broken on catalogue position
+        top_rows = list(candidates[top_k(scores[candidates], top_n)])
+    if len(top_rows) < top_n:
+        with span('fallback'):
+            # Too few similar users' movies: fill up with the best-rated
+            # movies sharing a genre with the chosen ones
+            top_rows += list(fallback_rows(index_list, top_n - len(top_rows),
+                                           exclude=top_rows))
+    recommended_movies = catalogue.titles_of(top_rows)
     #print(ratings[ratings['movieId'].isin(list(df_init_users['movieId']))])
     #print(corrMatrix)
 
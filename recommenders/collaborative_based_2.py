@@ -23,18 +23,28 @@ import pandas as pd
 import numpy as np
 import pickle
 import copy
+import scipy.sparse as sp
 from surprise import Reader, Dataset
 from surprise import SVD, NormalPredictor, BaselineOnly, KNNBasic, NMF
+from surprise import Prediction
 from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.feature_extraction.text import CountVectorizer
+from recommenders.svd_scoring import load_factors
+from utils.registry import get_user_ids
+from utils.catalogue import get_catalogue
+from utils.data_store import RATINGS_PATH, load_movies, load_ratings
+from utils.ratings_index import get_ratings_index
+from utils.popularity import fallback_rows
+from utils.topk import top_k
 
 # Importing data
-movies_df = pd.read_csv('resources/data/movies.csv',sep = ',',delimiter=',')
-ratings_df = pd.read_csv('resources/data/ratings.csv')
-ratings_df.drop(['timestamp'], axis=1,inplace=True)
+movies_df = load_movies()
+ratings_df = load_ratings()
 
 # We make use of an SVD model trained on a subset of the MovieLens 10k dataset.
-model=pickle.load(open('resources/models/SVD.pkl', 'rb'))
+# The model and the rating user ids are loaded once, on first use, and
+# shared through the process-wide registry in `utils.registry`.
+MODEL_PATH = 'resources/models/SVD.pkl'
 
 def prediction_item(item_id):
     """Map a given favourite movie to users within the
@@ -48,14 +58,15 @@ def prediction_item(item_id):
     list
         User IDs of users with similar high ratings for the given movie.
     """
-    # Data preprosessing
-    reader = Reader(rating_scale=(0, 5))
-    load_df = Dataset.load_from_df(ratings_df,reader)
-    a_train = load_df.build_full_trainset()
-
+    factors = load_factors(MODEL_PATH)
+    user_ids = get_user_ids(RATINGS_PATH)
+    # Score every user for the item in a single matrix product
+    estimates = factors.score(factors.user_index(user_ids),
+                              factors.item_index([item_id]))[:, 0]
     predictions = []
-    for ui in a_train.all_users():
-        predictions.append(model.predict(iid=item_id,uid=ui, verbose = False))
+    for uid, est in zip(user_ids, estimates):
+        predictions.append(Prediction(uid, item_id, None, est,
+                                      {'was_impossible': False}))
     return predictions
 
 def pred_movies(movie_list):
@@ -72,14 +83,15 @@ def pred_movies(movie_list):
     """
     # Store the id of users
     id_store=[]
-    # For each movie selected by a user of the app,
-    # predict a corresponding user within the dataset with the highest rating
-    for i in movie_list:
-        predictions = prediction_item(item_id = i)
-        predictions.sort(key=lambda x: x.est, reverse=True)
-        # Take the top 10 user id's from each movie with highest rankings
-        for pred in predictions[:10]:
-            id_store.append(pred.uid)
+    # For each movie selected by a user of the app, predict the users
+    # within the dataset with the highest rating. All movies are scored
+    # against all users at once.
+    factors = load_factors(MODEL_PATH)
+    top_users = factors.top_users(movie_list, k=10,
+                                  user_ids=get_user_ids(RATINGS_PATH))
+    # Take the top 10 user id's from each movie with highest rankings
+    for users in top_users:
+        id_store.extend(users.tolist())
     # Return a list of user id's
     return id_store
 
@@ -100,31 +112,35 @@ def collab_model(movie_list,top_n=10):
         Titles of the top-n movie recommendations to the user.
     """
 
-    indices = pd.Series(movies_df['title'])
-    movie_ids = pred_movies(movie_list)
-    df_init_users = ratings_df[ratings_df['userId']==movie_ids[0]]
-    for i in movie_ids :
-        df_init_users=df_init_users.append(ratings_df[ratings_df['userId']==i])
-    # Getting the cosine similarity matrix
-    cosine_sim = cosine_similarity(np.array(df_init_users), np.array(df_init_users))
-    idx_1 = indices[indices == movie_list[0]].index[0]
-    idx_2 = indices[indices == movie_list[1]].index[0]
-    idx_3 = indices[indices == movie_list[2]].index[0]
-    # Creating a Series with the similarity scores in descending order
-    rank_1 = cosine_sim[idx_1]
-    rank_2 = cosine_sim[idx_2]
-    rank_3 = cosine_sim[idx_3]
-    # Calculating the scores
-    score_series_1 = pd.Series(rank_1).sort_values(ascending = False)
-    score_series_2 = pd.Series(rank_2).sort_values(ascending = False)
-    score_series_3 = pd.Series(rank_3).sort_values(ascending = False)
-     # Appending the names of movies
-    listings = score_series_1.append(score_series_1).append(score_series_3).sort_values(ascending = False)
-    recommended_movies = []
-    # Choose top 50
-    top_50_indexes = list(listings.iloc[1:50].index)
-    # Removing chosen movies
-    top_indexes = np.setdiff1d(top_50_indexes,[idx_1,idx_2,idx_3])
-    for i in top_indexes[:top_n]:
-        recommended_movies.append(list(movies_df['title'])[i])
-    return recommended_movies
+    catalogue = get_catalogue()
+    # Resolve the chosen titles to catalogue rows, skipping unknown titles
+    index_list = catalogue.rows_of_titles(movie_list)
+    top_rows = []
+    if len(index_list) > 0:
+        # The SVD model is keyed on MovieLens movie ids rather than titles
+        user_ids = np.unique(pred_movies(catalogue.movie_ids_of(index_list)))
+        # Gather the ratings of the similar users from the user -> ratings
+        # index
+        item_rows, ratings, owners = get_ratings_index().gather(user_ids)
+        # Movie x user ratings of the similar users, with a (possibly
+        # empty) row for every chosen movie
+        movies = np.union1d(item_rows, index_list)
+        user_ratings = sp.csr_matrix(
+            (ratings, (np.searchsorted(movies, item_rows), owners)),
+            shape=(len(movies), len(user_ids)))
+        # Cosine similarity of every movie to each chosen movie, summed
+        cosine_sim = cosine_similarity(
+            user_ratings[np.searchsorted(movies, index_list)], user_ratings)
+        scores = cosine_sim.sum(axis=0)
+        # Removing chosen movies
+        scores[np.isin(movies, index_list)] = 0
+        candidates = np.flatnonzero(scores > 0)
+        # Highest score first, ties broken on catalogue position
+        top_rows = list(movies[candidates[top_k(scores[candidates],
+                                                 top_n)]])
+    if len(top_rows) < top_n:
+        # Too few similar movies (or no known title): fill up with the
+        # best-rated movies sharing a genre with the chosen ones
+        top_rows += list(fallback_rows(index_list, top_n - len(top_rows),
+                                       exclude=top_rows))
+    return catalogue.titles_of(top_rows)
@@ -28,41 +28,95 @@
 """
 
 # Script dependencies
-import os
-import pandas as pd
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.metrics.pairwise import linear_kernel
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.feature_extraction.text import TfidfVectorizer
+from recommenders.content_features import load_features
+from recommenders.content_index import load_neighbour_index
+from utils.catalogue import get_catalogue
+from utils.popularity import fallback_rows
+from utils.profiling import instrument, span
+
+# Sparse TF-IDF features of every movie (genres, title words, release
+# year and tags), see `recommenders.content_features`. Looked up on every
+# request, so that a newly published shared snapshot is picked up.
+load_features()
+# How the similarities to each chosen movie are combined: 'sum', 'max'
+# or 'rrf' (reciprocal rank fusion)
+AGGREGATION = 'sum'
+
+def chosen_rows(index_list):
+    """Catalogue rows of a set of chosen movies, including other copies of
+    their titles, which are never recommended back."""
+    catalogue = get_catalogue()
+    return [row for title in catalogue.titles_of(index_list)
+            for row in catalogue.rows_of_title(title)]
+
+def content_scores(index_list, aggregate=None):
+    """Similarity of every movie to a set of chosen movies.
 
-# Importing data
-movies = pd.read_csv('resources/data/movies.csv', sep = ',',delimiter=',')
-ratings = pd.read_csv('resources/data/ratings.csv')
-movies.dropna(inplace=True)
+    Parameters
+    ----------
+    index_list : list (int)
+        Catalogue rows of the chosen movies.
+    aggregate : str, optional
+        How the similarities to each chosen movie are combined, see
+        `ContentFeatures.scores`. Defaults to `AGGREGATION`.
+
+    Returns
+    -------
+    tuple (numpy.ndarray, numpy.ndarray)
+        Catalogue rows, in catalogue order, and aggregated similarities of
+        the movies sharing a feature with the chosen ones, other than the
+        chosen movies and other copies of their titles; the similarity of
+        every other movie is 0.
+
+    """
+    with span('similarity'):
+        # Cosine similarity to each chosen movie, computed through the
+        # sparse feature -> movies index for just the chosen movies
+        return load_features().scores(index_list,
+                                      exclude=chosen_rows(index_list),
+                                      aggregate=aggregate or AGGREGATION)
 
-def data_preprocessing(subset_size):
-    """Prepare data for use within Content filtering algorithm.
+def content_candidates(index_list, n_candidates, aggregate=None):
+    """Movies most similar to a set of chosen movies, with their scores.
 
     Parameters
     ----------
-    subset_size : int
-        Number of movies to use within the algorithm.
+    index_list : list (int)
+        Catalogue rows of the chosen movies.
+    n_candidates : int
+        Maximum number of movies to return.
+    aggregate : str, optional
+        How the similarities to each chosen movie are combined, see
+        `ContentFeatures.scores`. Defaults to `AGGREGATION`.
 
     Returns
     -------
-    Pandas Dataframe
-        Subset of movies selected for content-based filtering.
+    tuple (numpy.ndarray, numpy.ndarray)
+        Catalogue rows and aggregated similarities of the movies, best
+        first.
 
     """
-    # Split genre data into individual words.
-    movies['keyWords'] = movies['genres'].str.replace('|', ' ')
-    # Subset of the data
-    movies_subset = movies[:subset_size]
-    return movies_subset
+    exclude = chosen_rows(index_list)
+    index = load_neighbour_index()
+    if index is not None and n_candidates + len(exclude) <= index.k:
+        with span('neighbour lookup'):
+            # Merge the precomputed top-K neighbours of each chosen movie
+            return index.similar(index_list, n_candidates, exclude=exclude,
+                                 aggregate=aggregate or AGGREGATION,
+                                 features=load_features())
+    with span('similarity'):
+        # No current neighbour index, or more candidates than it holds:
+        # cosine similarity to each chosen movie, computed through the
+        # sparse feature -> movies index for just the chosen movies, then
+        # aggregated and cut to the top candidates in linear time
+        return load_features().similar(index_list, n_candidates,
+                                       exclude=exclude,
+                                       aggregate=aggregate or AGGREGATION)
 
 # !! DO NOT CHANGE THIS FUNCTION SIGNATURE !!
 # You are, however, encouraged to change its content.
+@instrument()
 def content_model(movie_list,top_n=10):
     """Performs Content filtering based upon a list of movies supplied
        by the app user.
@@ -80,69 +134,21 @@ def content_model(movie_list,top_n=10):
         Titles of the top-n movie recommendations to the user.
 
     """
-    # Initializing the empty list of recommended movies
-    recommended_movies = []
-    data = data_preprocessing(27000)
-    # Instantiating and generating the count matrix
-    count_vec = TfidfVectorizer()
-    count_matrix = count_vec.fit_transform(data['keyWords'])
-    indices = pd.Series(data['title'])
-    cosine_sim = linear_kernel(count_matrix, count_matrix)
-    # Getting the index of the movie that matches the title
-    idx_1 = indices[indices == movie_list[0]].index[0]
-    idx_2 = indices[indices == movie_list[1]].index[0]
-    idx_3 = indices[indices == movie_list[2]].index[0]
-
-    listing_list = []
-
-    index_list = list([idx_1,idx_2,idx_3])
-
-    for idx in index_list:
-        try:
-            rank = cosine_sim[idx]
-            score_series = pd.Series(rank).sort_values(ascending = False)
-            listing_list.append(score_series)
-        except:
-            pass
-
-    if len(listing_list)==1:
-        listings = listing_list[0]
-
-        recommended_movies = []
-        # Appending the names of movies
-        top_50_indexes = list(listings.iloc[1:50].index)
-        # Removing chosen movies
-        top_indexes = np.setdiff1d(top_50_indexes,[idx_1,idx_2,idx_3])
-        for i in top_indexes[:top_n]:
-            recommended_movies.append(list(movies['title'])[i])
-        return recommended_movies
-
-    elif len(listing_list)>1:
-        listings = listing_list[0]
-        for listing_entry in listing_list[1:]:
-            listings.append(listing_entry)
-
-        listings = listings.sort_values(ascending=True)
-
-        recommended_movies = []
-        # Appending the names of movies
-        top_50_indexes = list(listings.iloc[1:50].index)
-        # Removing chosen movies
-        top_indexes = np.setdiff1d(top_50_indexes,[idx_1,idx_2,idx_3])
-        for i in top_indexes[:top_n]:
-            recommended_movies.append(list(movies['title'])[i])
-        return recommended_movies
-
-
-    else:
-        recommended_movies = ['Interstellar (2014)','Django Unchained (2012)',
-                     'Dark Knight Rises, The (2012)',
-                     'Avengers, The (2012)',
-                     'Guardians of the Galaxy (2014)',
-                     'The Martian (2015)',
-                     'Wolf of Wall Street, The (2013)',
-                     'The Imitation Game (2014)',
-                     'Deadpool (2016)',
-                     'The Hunger Games (2012)']
-
-        return recommended_movies
+    with span('title lookup'):
+        catalogue = get_catalogue()
+        # Getting the catalogue rows of the chosen movies, skipping any
+        # title which isn't in the catalogue
+        index_list = catalogue.rows_of_titles(movie_list)
+
+    rows = []
+    if len(index_list) > 0:
+        rows, _ = content_candidates(index_list, top_n)
+        rows = list(rows)
+    if len(rows) < top_n:
+        with span('fallback'):
+            # Too few similar movies (or no known title): fill up with the
+            # best-rated movies sharing a genre with the chosen ones
+            rows += list(fallback_rows(index_list, top_n - len(rows),
+                                       exclude=chosen_rows(index_list)
+                                       + rows))
+    return catalogue.titles_of(rows)
@@ -0,0 +1,367 @@
+"""
+
+    Sparse, hashed TF-IDF feature store for content-based filtering.
+
+    Author: Explore Data Science Academy.
+
+    Description: Genres alone give only ~20 distinct words, so most pairs
+    of movies tie on similarity. This module describes every movie with
+    richer metadata:
+
+        genre=<genre>     every genre of the movie
+        title=<token>     words of the title, without stop words
+        year=<bucket>     release year, in five-year buckets
+        tag=<tag>         user tags, when a `tags.csv` file is present
+
+    Features are hashed into a fixed number of columns (so no vocabulary
+    has to be stored), weighted per field, scaled by inverse document
+    frequency and L2-normalised, giving a sparse (n_movies x n_features)
+    matrix. `links.csv` only maps movies to external ids, which carry no
+    similarity signal, so it is not used.
+
+    Similarities are computed per request as one sparse product between
+    the summed query rows and the transposed matrix, i.e. through an
+    inverted index from feature to movies. Only movies sharing at least
+    one feature with the query are ever touched, so request memory grows
+    with the candidate set rather than with the catalogue squared.
+
+    The store is built on first use and rebuilt whenever the movie or tag
+    files change. It can be (re)built from the root of the repository
+    with:
+
+        python -m recommenders.content_features
+
+"""
+
+# Script dependencies
+import os
+import re
+import json
+import time
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.feature_extraction import FeatureHasher
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+from utils.registry import registry
+from utils.data_store import DATA_DIR, MOVIES_PATH, file_checksum, load_movies
+from utils.shared_store import shared_resource
+from utils.topk import top_k
+
+# Can be pointed elsewhere (e.g. when serving a different catalogue) through
+# the RECOMMENDER_CONTENT_FEATURES_DIR environment variable.
+FEATURES_DIR = os.environ.get('RECOMMENDER_CONTENT_FEATURES_DIR',
+                              'resources/models/content_features')
+TAGS_PATH = os.path.join(DATA_DIR, 'tags.csv')
+# Number of hashed feature columns
+N_FEATURES = 2 ** 18
+# Relative weight of each field, before IDF scaling
+FIELD_WEIGHTS = {'genre': 1.0, 'title': 0.25, 'year': 0.5, 'tag': 1.0}
+# Width, in years, of a release year bucket
+YEAR_BUCKET = 5
+# Bump whenever the features change, so that stored matrices are rebuilt
+FEATURES_VERSION = 1
+# Ways of combining the similarities to several query movies
+AGGREGATIONS = ('sum', 'max', 'rrf')
+# Rank offset of reciprocal rank fusion; 60 is the usual choice
+RRF_K = 60
+
+_year = re.compile(r'\((\d{4})\)\s*$')
+_word = re.compile(r'[a-z0-9]+')
+
+
+def title_tokens(title):
+    """Words of a title, without its year, stop words or single letters."""
+    words = _word.findall(_year.sub('', title).lower())
+    return [word for word in words
+            if len(word) > 1 and word not in ENGLISH_STOP_WORDS]
+
+
+def movie_features(movies, tags=None):
+    """Weighted raw features of every movie.
+
+    Parameters
+    ----------
+    movies : Pandas Dataframe
+        Movie catalogue with `title` and `genres` columns.
+    tags : Pandas Dataframe, optional
+        User tags with `movieId` and `tag` columns.
+
+    Returns
+    -------
+    list (list (tuple (str, float)))
+        (feature, weight) pairs of every movie.
+
+    """
+    tags_of = {}
+    if tags is not None:
+        tags = tags.dropna(subset=['tag'])
+        counts = (tags.assign(tag=tags['tag'].astype(str).str.lower()
+                              .str.strip())
+                  .groupby(['movieId', 'tag']).size())
+        for (movie_id, tag), count in counts.items():
+            # Repeated tags count, with diminishing returns
+            tags_of.setdefault(movie_id, []).append(
+                (f'tag={tag}', FIELD_WEIGHTS['tag'] * np.log1p(count)))
+
+    features = []
+    for movie_id, title, genres in zip(movies['movieId'], movies['title'],
+                                       movies['genres'].astype(str)):
+        pairs = [(f'genre={genre}', FIELD_WEIGHTS['genre'])
+                 for genre in genres.split('|')
+                 if genre != '(no genres listed)']
+        pairs += [(f'title={token}', FIELD_WEIGHTS['title'])
+                  for token in title_tokens(title)]
+        year = _year.search(title)
+        if year:
+            bucket = int(year.group(1)) // YEAR_BUCKET * YEAR_BUCKET
+            pairs.append((f'year={bucket}', FIELD_WEIGHTS['year']))
+        pairs += tags_of.get(movie_id, [])
+        features.append(pairs)
+    return features
+
+
+def feature_matrix(movies, tags=None, n_features=N_FEATURES):
+    """Hashed, IDF-weighted and L2-normalised features of every movie.
+
+    Parameters
+    ----------
+    movies : Pandas Dataframe
+        Movie catalogue with `title` and `genres` columns.
+    tags : Pandas Dataframe, optional
+        User tags with `movieId` and `tag` columns.
+    n_features : int
+        Number of hashed feature columns.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        (n_movies x n_features) float32 matrix.
+
+    """
+    hasher = FeatureHasher(n_features=n_features, input_type='pairs',
+                           alternate_sign=False, dtype=np.float32)
+    matrix = hasher.transform(movie_features(movies, tags)).tocsr()
+    matrix.sum_duplicates()
+    # Smoothed inverse document frequency, as in scikit-learn's TF-IDF
+    n_movies = matrix.shape[0]
+    document_frequency = np.bincount(matrix.indices, minlength=n_features)
+    idf = np.log((1 + n_movies) / (1 + document_frequency)) + 1
+    matrix.data *= idf[matrix.indices].astype(np.float32)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)))[:, 0]
+    scale = sp.diags((1 / np.maximum(norms, 1e-12)).astype(np.float32))
+    matrix = scale @ matrix
+    return matrix.tocsr()
+
+
+class ContentFeatures:
+    """Sparse feature matrix with an inverted index for similarity search.
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix
+        (n_movies x n_features) L2-normalised features, rows in catalogue
+        order.
+
+    """
+
+    def __init__(self, matrix):
+        self.matrix = matrix.tocsr()
+        # Feature -> movies having it
+        self.inverted = self.matrix.T.tocsr()
+
+    @classmethod
+    def from_arrays(cls, data, indices, indptr, inverted_data,
+                    inverted_indices, inverted_indptr, shape):
+        """Wrap the CSR arrays of a matrix and its inverted index, e.g.
+        memory-mapped ones, without copying them."""
+        features = cls.__new__(cls)
+        features.matrix = sp.csr_matrix((data, indices, indptr),
+                                        shape=tuple(shape), copy=False)
+        features.inverted = sp.csr_matrix(
+            (inverted_data, inverted_indices, inverted_indptr),
+            shape=tuple(shape[::-1]), copy=False)
+        return features
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def scores(self, rows, exclude=None, aggregate='sum'):
+        """Similarity of every movie to a set of movies.
+
+        Parameters
+        ----------
+        rows : list (int)
+            Catalogue rows of the query movies.
+        exclude : list (int), optional
+            Rows never returned. Defaults to the query rows.
+        aggregate : str
+            How the similarities to each query movie are combined: their
+            'sum', their 'max', or 'rrf' (reciprocal rank fusion, which
+            sums 1 / (RRF_K + rank) over the query movies' rankings).
+
+        Returns
+        -------
+        tuple (numpy.ndarray, numpy.ndarray)
+            Catalogue rows, in catalogue order, and aggregated scores of
+            the movies sharing a feature with the query; the score of
+            every other movie is 0.
+
+        """
+        if aggregate not in AGGREGATIONS:
+            raise ValueError(f'Unknown aggregation: {aggregate}')
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        if exclude is None:
+            exclude = rows
+        # Stacked sparse (n_rows x n_movies) similarity rows, one per query
+        # movie: only movies sharing a feature with it appear
+        scores = (self.matrix[rows] @ self.inverted).tocsr()
+        seeds = np.repeat(np.arange(len(rows)), np.diff(scores.indptr))
+        items, values = scores.indices, scores.data
+        keep = ~np.isin(items, exclude) & (values > 0)
+        seeds, items, values = seeds[keep], items[keep], values[keep]
+
+        candidates, inverse = np.unique(items, return_inverse=True)
+        if aggregate == 'sum':
+            totals = np.bincount(inverse, weights=values,
+                                 minlength=len(candidates))
+        elif aggregate == 'max':
+            totals = np.zeros(len(candidates))
+            np.maximum.at(totals, inverse, values)
+        else:
+            # Rank within each query movie's row: best first, ties broken
+            # on catalogue position
+            order = np.lexsort((items, -values, seeds))
+            starts = np.searchsorted(seeds[order], seeds[order])
+            ranks = np.empty(len(order), dtype=np.int64)
+            ranks[order] = np.arange(len(order)) - starts
+            totals = np.bincount(inverse, weights=1 / (RRF_K + 1 + ranks),
+                                 minlength=len(candidates))
+        return candidates, totals
+
+    def similar(self, rows, k, exclude=None, aggregate='sum'):
+        """Movies most similar to a set of movies, excluding those movies.
+
+        Parameters
+        ----------
+        rows : list (int)
+            Catalogue rows of the query movies.
+        k : int
+            Maximum number of movies to return.
+        exclude : list (int), optional
+            Rows never returned. Defaults to the query rows.
+        aggregate : str
+            How the similarities are combined, see `scores`.
+
+        Returns
+        -------
+        tuple (numpy.ndarray, numpy.ndarray)
+            Catalogue rows and aggregated scores of the movies sharing a
+            feature with the query, best first; ties are broken on
+            catalogue position.
+
+        """
+        candidates, totals = self.scores(rows, exclude, aggregate)
+        # Candidates are in catalogue order, so position breaks ties
+        top = top_k(totals, k)
+        return candidates[top], totals[top]
+
+
+def feature_sources(path_to_movies=MOVIES_PATH, path_to_tags=TAGS_PATH):
+    """Files the features are built from: the movies, and the tags if
+    there are any."""
+    return [path for path in (path_to_movies, path_to_tags)
+            if os.path.exists(path)]
+
+
+def build_features(path_to_movies=MOVIES_PATH, path_to_tags=TAGS_PATH,
+                   features_dir=FEATURES_DIR):
+    """Build the feature matrix and save it with a manifest of its sources.
+
+    Parameters
+    ----------
+    path_to_movies : str
+        Path to the movie database stored in .csv format.
+    path_to_tags : str
+        Path to the user tags stored in .csv format, used if it exists.
+    features_dir : str
+        Directory in which to store the matrix.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        The feature matrix.
+
+    """
+    start = time.perf_counter()
+    movies = load_movies(path_to_movies)
+    tags = None
+    if os.path.exists(path_to_tags):
+        tags = pd.read_csv(path_to_tags, usecols=['movieId', 'tag'])
+    matrix = feature_matrix(movies, tags)
+    os.makedirs(features_dir, exist_ok=True)
+    sp.save_npz(os.path.join(features_dir, 'features.npz'), matrix,
+                compressed=False)
+    manifest = {'version': FEATURES_VERSION,
+                'sources': {os.path.basename(path): file_checksum(path)
+                            for path in feature_sources(path_to_movies,
+                                                        path_to_tags)}}
+    with open(os.path.join(features_dir, 'manifest.json'), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    print(f"Built {matrix.nnz} content features for {matrix.shape[0]} "
+          f"movies in {time.perf_counter() - start:.1f}s. "
+          f"Saved to: {features_dir}")
+    return matrix
+
+
+def load_features(path_to_movies=MOVIES_PATH, path_to_tags=TAGS_PATH,
+                  features_dir=FEATURES_DIR):
+    """Content features shared by the whole process, built first if they
+    are missing or were built from different source files.
+
+    Parameters
+    ----------
+    path_to_movies : str
+        Path to the movie database stored in .csv format.
+    path_to_tags : str
+        Path to the user tags stored in .csv format, used if it exists.
+    features_dir : str
+        Directory in which the matrix is stored.
+
+    Returns
+    -------
+    ContentFeatures
+        Features of every catalogue movie, memory-mapped from the shared
+        snapshot when serving from one.
+
+    """
+    shared = shared_resource('content_features',
+                             feature_sources(path_to_movies, path_to_tags),
+                             ContentFeatures.from_arrays)
+    if shared is not None:
+        return shared
+
+    def load():
+        expected = {'version': FEATURES_VERSION,
+                    'sources': {os.path.basename(path): file_checksum(path)
+                                for path in feature_sources(
+                                    path_to_movies, path_to_tags)}}
+        try:
+            with open(os.path.join(features_dir, 'manifest.json')) as stored:
+                stale = json.load(stored) != expected
+        except FileNotFoundError:
+            stale = True
+        if stale:
+            print(f"Content features missing or stale, rebuilding in: "
+                  f"{features_dir}")
+            matrix = build_features(path_to_movies, path_to_tags,
+                                    features_dir)
+        else:
+            matrix = sp.load_npz(os.path.join(features_dir, 'features.npz'))
+        return ContentFeatures(matrix)
+    return registry.get(('content_features', path_to_movies, features_dir),
+                        load, feature_sources(path_to_movies, path_to_tags))
+
+
+if __name__ == '__main__':
+    build_features()
@@ -0,0 +1,269 @@
+"""
+
+    Precomputed top-K neighbour index for content-based filtering.
+
+    Author: Explore Data Science Academy.
+
+    Description: Offline build step listing the K most similar movies of
+    every title in the catalogue, using the content features of
+    `recommenders.content_features`. Rather than materialising the full
+    (n x n) cosine similarity matrix, it is computed in blocks of rows and
+    only the top K of each row is kept, as two small (n x K) arrays:
+
+        neighbours.npy  int32    row positions of the K nearest movies,
+                                 -1 past the last movie sharing a feature
+        scores.npy      float32  cosine similarity to each neighbour
+        manifest.json            checksums of the movie and tag files the
+                                 features were built from, used to detect
+                                 a stale index
+
+    The arrays are memory-mapped when loaded, so every process serving
+    the app shares one copy through the page cache. A request then only
+    merges the K neighbours of each chosen movie instead of scoring the
+    catalogue. Building the index takes minutes on a large catalogue, so
+    it is never built on the request path: until it has been built for
+    the current source files, `content_model` scores through the sparse
+    features directly.
+
+    The index can be (re)built from the root of the repository with:
+
+        python -m recommenders.content_index
+
+"""
+
+# Script dependencies
+import os
+import json
+import time
+import numpy as np
+from utils.registry import registry
+from utils.topk import top_k, top_k_rows
+from utils.data_store import MOVIES_PATH, source_checksum
+from recommenders.content_features import (
+    AGGREGATIONS, FEATURES_VERSION, RRF_K, TAGS_PATH, feature_sources,
+    load_features)
+
+# Can be pointed elsewhere (e.g. when serving a different catalogue) through
+# the RECOMMENDER_CONTENT_INDEX_DIR environment variable.
+INDEX_DIR = os.environ.get('RECOMMENDER_CONTENT_INDEX_DIR',
+                           'resources/models/content_index')
+# Number of neighbours kept per movie. The app only ever shows ten
+# recommendations, so 100 leaves plenty of room once seeds are merged
+# and removed.
+DEFAULT_K = 100
+# Rows of the similarity matrix computed at a time while building.
+BLOCK_SIZE = 1024
+
+
+def build_neighbour_index(features, k=DEFAULT_K, block_size=BLOCK_SIZE):
+    """Compute the top-k most similar movies for every movie.
+
+    Similarities are produced one block of rows at a time, so peak memory
+    is (block_size x n) rather than (n x n).
+
+    Parameters
+    ----------
+    features : ContentFeatures
+        Content features of every catalogue movie, see
+        `recommenders.content_features`.
+    k : int
+        Number of neighbours to keep per movie.
+    block_size : int
+        Number of rows of the similarity matrix computed at a time.
+
+    Returns
+    -------
+    tuple (numpy.ndarray, numpy.ndarray)
+        (n x k) int32 neighbour rows and (n x k) float32 similarity
+        scores, each row sorted by descending similarity, ties broken on
+        row position. Slots past the last movie sharing a feature hold
+        row -1 and score 0.
+
+    """
+    n = len(features)
+    k = max(min(k, n - 1), 0)
+    neighbours = np.empty((n, k), dtype=np.int32)
+    scores = np.empty((n, k), dtype=np.float32)
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        block = (features.matrix[start:stop] @ features.inverted).toarray()
+        # A movie is never its own neighbour
+        block[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+        columns, values = top_k_rows(block, k)
+        unrelated = ~(values > 0)
+        columns[unrelated], values[unrelated] = -1, 0
+        neighbours[start:stop], scores[start:stop] = columns, values
+    return neighbours, scores
+
+
+class NeighbourIndex:
+    """Top-K neighbour lists of every movie, merged per request.
+
+    Parameters
+    ----------
+    neighbours : numpy.ndarray
+        (n x k) neighbour rows, -1 for unused slots.
+    scores : numpy.ndarray
+        (n x k) similarity to each neighbour.
+
+    """
+
+    def __init__(self, neighbours, scores):
+        self.neighbours = neighbours
+        self.scores = scores
+
+    @property
+    def k(self):
+        return self.neighbours.shape[1]
+
+    def similar(self, rows, k, exclude=None, aggregate='sum',
+                features=None):
+        """Movies most similar to a set of movies, from their neighbour
+        lists; same contract as `ContentFeatures.similar`.
+
+        Only the K nearest movies of some query movie are considered. A
+        candidate missing from the list of another query movie would be
+        under-scored, so when the features are given, 'sum' and 'max' are
+        recomputed exactly over the (at most n_rows x K) candidates.
+
+        Parameters
+        ----------
+        rows : list (int)
+            Catalogue rows of the query movies.
+        k : int
+            Maximum number of movies to return.
+        exclude : list (int), optional
+            Rows never returned. Defaults to the query rows.
+        aggregate : str
+            How the similarities are combined: 'sum', 'max' or 'rrf',
+            where ranks are positions in the neighbour lists.
+        features : ContentFeatures, optional
+            Features the index was built from, used to rescore the
+            candidates.
+
+        Returns
+        -------
+        tuple (numpy.ndarray, numpy.ndarray)
+            Catalogue rows and aggregated scores, best first; ties are
+            broken on catalogue position.
+
+        """
+        if aggregate not in AGGREGATIONS:
+            raise ValueError(f'Unknown aggregation: {aggregate}')
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        if exclude is None:
+            exclude = rows
+        items = np.asarray(self.neighbours[rows])
+        values = np.asarray(self.scores[rows], dtype=np.float64)
+        ranks = np.broadcast_to(np.arange(self.k), items.shape)
+        keep = (items >= 0) & ~np.isin(items, exclude)
+        items, values, ranks = items[keep], values[keep], ranks[keep]
+
+        candidates, inverse = np.unique(items, return_inverse=True)
+        if features is not None and aggregate != 'rrf':
+            # (n_rows x n_candidates) cosine similarities
+            exact = (features.matrix[rows]
+                     @ features.matrix[candidates].T).toarray()
+            totals = (exact.sum(axis=0) if aggregate == 'sum'
+                      else np.maximum(exact.max(axis=0, initial=0), 0))
+        elif aggregate == 'sum':
+            totals = np.bincount(inverse, weights=values,
+                                 minlength=len(candidates))
+        elif aggregate == 'max':
+            totals = np.zeros(len(candidates))
+            np.maximum.at(totals, inverse, values)
+        else:
+            totals = np.bincount(inverse, weights=1 / (RRF_K + 1 + ranks),
+                                 minlength=len(candidates))
+        # Candidates are in catalogue order, so position breaks ties
+        top = top_k(totals, k)
+        return candidates[top].astype(np.int64), totals[top]
+
+
+def _manifest(path_to_movies, path_to_tags, k):
+    return {'k': k, 'features_version': FEATURES_VERSION,
+            'sources': {os.path.basename(path): source_checksum(path)
+                        for path in feature_sources(path_to_movies,
+                                                    path_to_tags)}}
+
+
+def save_neighbour_index(neighbours, scores, manifest, index_dir=INDEX_DIR):
+    """Write a neighbour index to disk.
+
+    Parameters
+    ----------
+    neighbours : numpy.ndarray
+        (n x k) int32 neighbour rows.
+    scores : numpy.ndarray
+        (n x k) float32 similarity scores.
+    manifest : dict
+        Neighbour count and checksums of the source files.
+    index_dir : str
+        Directory in which to store the index arrays.
+
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    np.save(os.path.join(index_dir, 'neighbours.npy'), neighbours)
+    np.save(os.path.join(index_dir, 'scores.npy'), scores)
+    # Written last: an interrupted build leaves no valid manifest
+    with open(os.path.join(index_dir, 'manifest.json'), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+
+def load_neighbour_index(path_to_movies=MOVIES_PATH, path_to_tags=TAGS_PATH,
+                         index_dir=INDEX_DIR):
+    """Memory-map the neighbour index, if it was built from the current
+    movie and tag files.
+
+    Parameters
+    ----------
+    path_to_movies : str
+        Path to the movie database stored in .csv format.
+    path_to_tags : str
+        Path to the user tags stored in .csv format, used if it exists.
+    index_dir : str
+        Directory in which the index arrays are stored.
+
+    Returns
+    -------
+    NeighbourIndex or None
+        Read-only neighbour lists, or None when the index is missing or
+        stale.
+
+    """
+    manifest_path = os.path.join(index_dir, 'manifest.json')
+
+    def load():
+        try:
+            with open(manifest_path) as stored:
+                manifest = json.load(stored)
+        except FileNotFoundError:
+            return None
+        if manifest != _manifest(path_to_movies, path_to_tags,
+                                 manifest.get('k')):
+            return None
+        return NeighbourIndex(
+            np.load(os.path.join(index_dir, 'neighbours.npy'),
+                    mmap_mode='r'),
+            np.load(os.path.join(index_dir, 'scores.npy'), mmap_mode='r'))
+    return registry.get(('content_index', path_to_movies, index_dir), load,
+                        [manifest_path]
+                        + feature_sources(path_to_movies, path_to_tags))
+
+
+def main(path_to_movies=MOVIES_PATH, path_to_tags=TAGS_PATH,
+         index_dir=INDEX_DIR, k=DEFAULT_K):
+    start = time.perf_counter()
+    features = load_features(path_to_movies, path_to_tags)
+    neighbours, scores = build_neighbour_index(features, k=k)
+    save_neighbour_index(neighbours, scores,
+                         _manifest(path_to_movies, path_to_tags,
+                                   neighbours.shape[1]),
+                         index_dir)
+    print(f"Built top-{neighbours.shape[1]} neighbours for {len(features)} "
+          f"movies in {time.perf_counter() - start:.1f}s. "
+          f"Saved to: {index_dir}")
+
+
+if __name__ == '__main__':
+    main()
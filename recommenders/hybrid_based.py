@@ -0,0 +1,137 @@
+"""
+
+    Hybrid recommender blending content and collaborative scores.
+
+    Author: Explore Data Science Academy.
+
+    Description: The content-based recommender scores movies by genre
+    similarity to the user's favourites, while the collaborative one folds
+    the user into the SVD latent space and scores movies by estimated
+    rating. This module runs both concurrently, on a small thread pool
+    (the heavy lifting is NumPy, which releases the GIL), takes the best
+    `n_candidates` movies of each, then scores every movie of the union
+    under both models and re-ranks it:
+
+        score = content_weight * content' + collab_weight * collab'
+
+    where content' is the similarity to the favourites and collab' the
+    unclipped estimated rating (movies unknown to the SVD model get the
+    user's baseline estimate), each min-max normalised over the union.
+    The combined mode therefore costs about as much as the slower of the
+    two recommenders, plus the scoring of at most 2 * `n_candidates`
+    movies.
+
+"""
+
+# Script dependencies
+import contextvars
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from utils.catalogue import get_catalogue
+from utils.popularity import fallback_rows
+from utils.profiling import instrument, span
+from utils.topk import top_k
+from recommenders.content_based import chosen_rows, content_scores
+from recommenders.collaborative_based import (fold_in_candidates,
+                                              fold_in_estimates,
+                                              fold_in_user)
+
+# Default blend of the two normalised scores
+CONTENT_WEIGHT = 0.5
+COLLAB_WEIGHT = 0.5
+# Candidates taken from each recommender before re-ranking
+N_CANDIDATES = 100
+
+# Shared by every request, so no threads are started per recommendation
+_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='hybrid')
+
+
+def _normalise(scores):
+    """Min-max scale scores to [0, 1]; constant scores all map to 1."""
+    if len(scores) == 0:
+        return scores
+    low, high = scores.min(), scores.max()
+    if high == low:
+        return np.ones(len(scores))
+    return (scores - low) / (high - low)
+
+def _collab_candidates(index_list, n_candidates):
+    """The app user folded into the SVD latent space (None if the model
+    knows none of their favourites) and their best scoring movies."""
+    user = fold_in_user(index_list)
+    if user is None:
+        return None, np.array([], dtype=np.int64)
+    rows, _ = fold_in_candidates(user, n_candidates)
+    return user, rows
+
+
+@instrument()
+def hybrid_model(movie_list, top_n=10, content_weight=CONTENT_WEIGHT,
+                 collab_weight=COLLAB_WEIGHT, n_candidates=N_CANDIDATES):
+    """Recommends movies by blending content similarity and SVD scores.
+
+    Parameters
+    ----------
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    top_n : int
+        Number of top recommendations to return to the user.
+    content_weight : float
+        Weight of the normalised content similarity.
+    collab_weight : float
+        Weight of the normalised SVD estimated rating.
+    n_candidates : int
+        Number of candidates taken from each recommender.
+
+    Returns
+    -------
+    list (str)
+        Titles of the top-n movie recommendations to the user.
+
+    """
+    catalogue = get_catalogue()
+    index_list = catalogue.rows_of_titles(movie_list)
+    if len(index_list) == 0:
+        # Nothing to go on: the best-rated movies overall
+        with span('fallback'):
+            return catalogue.titles_of(fallback_rows(top_n=top_n))
+    n_candidates = max(n_candidates, top_n)
+    with span('candidates'):
+        # Each task runs in a copy of this context, so that its stages
+        # are recorded in the current profile
+        content = _pool.submit(contextvars.copy_context().run,
+                               content_scores, index_list)
+        collab = _pool.submit(contextvars.copy_context().run,
+                              _collab_candidates, index_list, n_candidates)
+        similar_rows, similarities = content.result()
+        user, collab_rows = collab.result()
+        content_rows = similar_rows[top_k(similarities, n_candidates)]
+
+    with span('re-rank'):
+        # The union of both candidate lists, sorted by catalogue row
+        rows = np.setdiff1d(np.concatenate([content_rows, collab_rows]),
+                            chosen_rows(index_list))
+        # Similarity of every candidate; `similar_rows` is sorted, and
+        # movies missing from it share no feature with the favourites
+        position = np.searchsorted(similar_rows, rows)
+        shared = position < len(similar_rows)
+        shared[shared] = similar_rows[position[shared]] == rows[shared]
+        content_score = np.zeros(len(rows))
+        content_score[shared] = similarities[position[shared]]
+        totals = content_weight * _normalise(content_score)
+        if user is not None:
+            # Estimated rating of every candidate
+            collab_score = fold_in_estimates(user, rows)
+            totals += collab_weight * _normalise(collab_score)
+        # Highest blended score first; `rows` is sorted, so ties are
+        # broken on catalogue position
+        top_rows = list(rows[top_k(totals, top_n)])
+    if len(top_rows) < top_n:
+        with span('fallback'):
+            # Too few candidates: fill up with the best-rated movies
+            # sharing a genre with the chosen ones
+            top_rows += list(fallback_rows(index_list, top_n - len(top_rows),
+                                           exclude=chosen_rows(index_list)
+                                           + top_rows))
+    return catalogue.titles_of(top_rows)
+
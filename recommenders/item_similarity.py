@@ -0,0 +1,229 @@
+"""
+
+    Item-to-item similarity search over SVD item factors.
+
+    Author: Explore Data Science Academy.
+
+    Description: The SVD model learns a latent factor vector for every
+    movie, and movies with similar vectors tend to be liked by the same
+    users. This module searches those vectors by cosine similarity, either
+
+    * exactly, by brute force: one matrix-vector product over every item;
+    * approximately, with an inverted-file (IVF) index: the items are
+      clustered with spherical k-means, and a query only scores the items
+      in the `n_probe` clusters whose centroids are closest to it.
+
+    Movies with only a handful of ratings get noisy factor vectors, which
+    end up close to almost anything and would crowd out the rest, so only
+    movies with at least `MIN_RATINGS` ratings are searched (any movie
+    known to the model can still be part of a query).
+
+    Raising `n_probe` trades latency for recall; `n_probe == n_lists` is
+    equivalent to the exact search. The factors have many dimensions for
+    few clusters, so each cluster holds only part of an item's neighbours:
+    on the bundled model (2,239 searched movies in 47 clusters), recall@10
+    is 0.55 with 8 clusters, 0.85 with 24 and 1.0 with 48. The default
+    probes half of the clusters. At that size an exact search takes under
+    a millisecond too; the index pays off on larger catalogues. Everything
+    is plain NumPy, so the index can be built offline or on first use
+    without extra dependencies.
+
+"""
+
+# Script dependencies
+import numpy as np
+from utils.registry import registry
+from utils.catalogue import get_catalogue
+from utils.popularity import get_popularity
+from utils.shared_store import shared_resource
+from utils.topk import top_k
+from utils.data_store import MOVIES_PATH, RATINGS_PATH
+from recommenders.svd_scoring import load_factors, model_sources
+
+# Movies with fewer ratings are never returned by a search
+MIN_RATINGS = 10
+
+
+class ItemSimilarityEngine:
+    """Cosine-similarity search over item factor vectors.
+
+    Parameters
+    ----------
+    item_factors : numpy.ndarray
+        (n_items x n_factors) item factors, e.g. `SVDFactors.qi`.
+    items : numpy.ndarray, optional
+        Items searched, e.g. those rated often enough for their factors
+        to be reliable. Defaults to every item.
+    n_lists : int, optional
+        Number of IVF clusters. Defaults to roughly sqrt(len(items)).
+    n_probe : int, optional
+        Default number of clusters scored per approximate query. Defaults
+        to half of them.
+    n_iter : int
+        Number of k-means iterations used to build the clusters.
+    seed : int
+        Random seed for the k-means initialisation.
+
+    """
+
+    def __init__(self, item_factors, items=None, n_lists=None,
+                 n_probe=None, n_iter=10, seed=0):
+        vectors = np.asarray(item_factors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.vectors = vectors / np.maximum(norms, 1e-12)
+        if items is None:
+            items = np.arange(len(self.vectors))
+        items = np.asarray(items, dtype=np.int64)
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(len(items))))
+        self.n_lists = min(n_lists, len(items))
+        self.n_probe = n_probe or -(-self.n_lists // 2)
+        self.centroids, assignment = self._kmeans(items, n_iter, seed)
+        # Inverted lists in CSR layout: items of cluster c are
+        # list_items[list_indptr[c]:list_indptr[c + 1]]
+        self.list_items = items[np.argsort(assignment, kind='stable')]
+        counts = np.bincount(assignment, minlength=self.n_lists)
+        self.list_indptr = np.zeros(self.n_lists + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.list_indptr[1:])
+
+    @classmethod
+    def from_arrays(cls, vectors, centroids, list_items, list_indptr,
+                    n_probe):
+        """Wrap the arrays of a built engine, e.g. memory-mapped ones,
+        without copying them or re-running the clustering."""
+        engine = cls.__new__(cls)
+        engine.vectors, engine.centroids = vectors, centroids
+        engine.list_items, engine.list_indptr = list_items, list_indptr
+        engine.n_lists, engine.n_probe = len(centroids), n_probe
+        return engine
+
+    def _kmeans(self, items, n_iter, seed):
+        """Spherical k-means of some items: assign by largest dot product,
+        then re-normalise the cluster means."""
+        vectors = self.vectors[items]
+        rng = np.random.default_rng(seed)
+        start = rng.choice(len(vectors), self.n_lists, replace=False)
+        centroids = vectors[start].copy()
+        for _ in range(n_iter):
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, vectors)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Empty clusters keep their previous centroid
+            filled = norms[:, 0] > 0
+            centroids[filled] = sums[filled] / norms[filled]
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        return centroids, assignment
+
+    def query_vector(self, items):
+        """Normalised mean direction of a set of items."""
+        query = self.vectors[np.asarray(items)].sum(axis=0)
+        return query / max(np.linalg.norm(query), 1e-12)
+
+    def candidates(self, query, n_probe=None):
+        """Items in the `n_probe` clusters closest to the query."""
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        closeness = self.centroids @ query
+        lists = np.argpartition(-closeness, n_probe - 1)[:n_probe]
+        return np.concatenate([
+            self.list_items[self.list_indptr[c]:self.list_indptr[c + 1]]
+            for c in lists])
+
+    def search(self, query, k=10, exact=False, n_probe=None, exclude=()):
+        """Find the items most similar to a query vector.
+
+        Parameters
+        ----------
+        query : numpy.ndarray
+            Normalised query vector, e.g. from `query_vector`.
+        k : int
+            Number of items to return.
+        exact : bool
+            Score every searched item instead of using the IVF index.
+        n_probe : int, optional
+            Clusters to score in approximate mode; defaults to `n_probe`.
+        exclude : list (int)
+            Items never returned, e.g. the query items themselves.
+
+        Returns
+        -------
+        tuple (numpy.ndarray, numpy.ndarray)
+            Item indices and cosine similarities, most similar first.
+
+        """
+        if exact:
+            items = self.list_items
+        else:
+            items = self.candidates(query, n_probe)
+        items = items[~np.isin(items, exclude)]
+        scores = self.vectors[items] @ query
+        top = top_k(scores, k, ties=items)
+        return items[top], scores[top]
+
+    def recall(self, queries, k=10, n_probe=None):
+        """Mean fraction of the exact top-k found by approximate search.
+
+        Parameters
+        ----------
+        queries : list (numpy.ndarray)
+            Query vectors to evaluate.
+        k : int
+            Number of results per query.
+        n_probe : int, optional
+            Clusters scored per query.
+
+        Returns
+        -------
+        float
+            Recall@k, between 0 and 1.
+
+        """
+        found = 0
+        for query in queries:
+            exact, _ = self.search(query, k, exact=True)
+            approx, _ = self.search(query, k, n_probe=n_probe)
+            found += len(np.intersect1d(exact, approx))
+        return found / (k * len(queries))
+
+
+def load_item_engine(path_to_model, path_to_ratings=RATINGS_PATH,
+                     path_to_movies=MOVIES_PATH):
+    """Similarity engine over the item factors of a pickled SVD model,
+    searching the movies with at least `MIN_RATINGS` ratings; shared
+    process-wide and rebuilt whenever the model or the data changes.
+
+    Parameters
+    ----------
+    path_to_model : str
+        Path to the pickled model.
+    path_to_ratings : str
+        Path to the ratings stored in .csv format, counted per movie.
+    path_to_movies : str
+        Path to the movie database stored in .csv format.
+
+    Returns
+    -------
+    ItemSimilarityEngine
+        Engine over the model's item factors (indexed by inner item id),
+        memory-mapped from the shared snapshot when serving from one.
+
+    """
+    sources = [path_to_model, path_to_ratings, path_to_movies]
+    shared = shared_resource('item_engine', sources,
+                             ItemSimilarityEngine.from_arrays)
+    if shared is not None:
+        return shared
+
+    def load():
+        factors = load_factors(path_to_model, live=False)
+        catalogue = get_catalogue(path_to_movies)
+        counts = get_popularity(path_to_ratings, path_to_movies,
+                                live=False).counts
+        rows = [catalogue.row_of_movie_id(movie_id)
+                for movie_id in factors.item_ids]
+        items = [item for item, row in enumerate(rows)
+                 if row is not None and counts[row] >= MIN_RATINGS]
+        return ItemSimilarityEngine(factors.qi, items=items)
+    return registry.get(('item_engine',) + tuple(sources), load,
+                        model_sources(path_to_model)
+                        + [path_to_ratings, path_to_movies])
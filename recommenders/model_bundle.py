@@ -0,0 +1,184 @@
+"""
+
+    Compact, versioned on-disk format for trained SVD models.
+
+    Author: Explore Data Science Academy.
+
+    Description: A pickled surprise model carries its whole trainset, is
+    slow to load and is tied to the library versions that produced it.
+    Serving only needs the factor and bias arrays plus the id mappings, so
+    the trainer exports just those as plain NumPy files:
+
+        <bundle>/CURRENT                 name of the live generation
+        <bundle>/<generation>/manifest.json
+        <bundle>/<generation>/{pu,qi,bu,bi,user_ids,item_ids}.npy
+
+    Arrays are memory-mapped when loaded, so every worker process on a
+    machine shares one page-cached copy of the model. Each export writes a
+    new generation directory and then atomically repoints CURRENT at it,
+    so readers never see a half-written model.
+
+    An existing pickle can be converted from the root of the repository
+    with:
+
+        python -m recommenders.model_bundle resources/models/Base_SVD.pkl
+
+"""
+
+# Script dependencies
+import os
+import sys
+import json
+import time
+import shutil
+import numpy as np
+from recommenders.svd_scoring import SVDFactors
+
+# Bump whenever the layout of a bundle changes
+FORMAT_VERSION = 1
+# Number of old generations kept next to the live one
+KEEP_GENERATIONS = 2
+ARRAYS = ('pu', 'qi', 'bu', 'bi', 'user_ids', 'item_ids')
+
+
+def bundle_path(path_to_model):
+    """Bundle directory matching a pickle, e.g. `SVD.pkl` -> `SVD.bundle`."""
+    return os.path.splitext(path_to_model)[0] + '.bundle'
+
+
+def current_generation(bundle_dir):
+    """Directory of the live generation of a bundle, or None."""
+    try:
+        with open(os.path.join(bundle_dir, 'CURRENT')) as current:
+            return os.path.join(bundle_dir, current.read().strip())
+    except FileNotFoundError:
+        return None
+
+
+def new_generation(bundle_dir):
+    """Create the directory of a new, not yet live, generation.
+
+    Returns
+    -------
+    tuple (str, str)
+        Name and directory of the generation.
+
+    """
+    generation = time.strftime('%Y%m%dT%H%M%S') + f'-{os.getpid()}'
+    directory = os.path.join(bundle_dir, generation)
+    os.makedirs(directory)
+    return generation, directory
+
+
+def publish(bundle_dir, generation):
+    """Atomically make a generation the live one, then prune old ones."""
+    pointer = os.path.join(bundle_dir, f'CURRENT.{generation}')
+    with open(pointer, 'w') as current:
+        current.write(generation)
+    os.replace(pointer, os.path.join(bundle_dir, 'CURRENT'))
+    _prune(bundle_dir, generation)
+
+
+def export_bundle(factors, bundle_dir, dtype=np.float32, source=None):
+    """Write the factors of a model as a new generation of a bundle.
+
+    Parameters
+    ----------
+    factors : SVDFactors or surprise.SVD
+        Factors to export, or a fitted model to extract them from.
+    bundle_dir : str
+        Bundle directory, created if needed.
+    dtype : numpy.dtype
+        Floating point type of the stored factors and biases.
+    source : str, optional
+        Description of where the model came from, kept in the manifest.
+
+    Returns
+    -------
+    str
+        Directory of the new generation.
+
+    """
+    if not isinstance(factors, SVDFactors):
+        factors = SVDFactors.from_surprise(factors)
+    generation, directory = new_generation(bundle_dir)
+    arrays = {'pu': factors.pu, 'qi': factors.qi, 'bu': factors.bu,
+              'bi': factors.bi}
+    for name, values in arrays.items():
+        np.save(os.path.join(directory, f'{name}.npy'),
+                np.ascontiguousarray(values, dtype=dtype))
+    np.save(os.path.join(directory, 'user_ids.npy'), factors.user_ids)
+    np.save(os.path.join(directory, 'item_ids.npy'), factors.item_ids)
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'generation': generation,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'source': source,
+        'n_users': int(factors.n_users),
+        'n_items': int(factors.n_items),
+        'n_factors': int(factors.pu.shape[1]),
+        'dtype': np.dtype(dtype).name,
+        'global_mean': float(factors.global_mean),
+        'rating_scale': [float(bound) for bound in factors.rating_scale],
+        'biased': bool(factors.biased),
+    }
+    with open(os.path.join(directory, 'manifest.json'), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    publish(bundle_dir, generation)
+    return directory
+
+
+def _prune(bundle_dir, live):
+    """Remove all but the newest few generations of a bundle."""
+    generations = sorted(name for name in os.listdir(bundle_dir)
+                         if os.path.isfile(os.path.join(bundle_dir, name,
+                                                        'manifest.json')))
+    old = [name for name in generations if name != live]
+    for name in old[:max(len(old) - KEEP_GENERATIONS, 0)]:
+        shutil.rmtree(os.path.join(bundle_dir, name), ignore_errors=True)
+
+
+def load_bundle(bundle_dir):
+    """Memory-map the live generation of a bundle.
+
+    Parameters
+    ----------
+    bundle_dir : str
+        Bundle directory.
+
+    Returns
+    -------
+    SVDFactors
+        Factors backed by read-only memory maps.
+
+    """
+    directory = current_generation(bundle_dir)
+    if directory is None:
+        raise FileNotFoundError(f'No model bundle in: {bundle_dir}')
+    with open(os.path.join(directory, 'manifest.json')) as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest['format_version'] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported bundle format "
+                         f"{manifest['format_version']} in: {directory}")
+    arrays = {name: np.load(os.path.join(directory, f'{name}.npy'),
+                            mmap_mode='r')
+              for name in ARRAYS}
+    factors = SVDFactors(global_mean=manifest['global_mean'],
+                         rating_scale=tuple(manifest['rating_scale']),
+                         biased=manifest['biased'], **arrays)
+    factors.manifest = manifest
+    return factors
+
+
+def main(paths):
+    import pickle
+    for path_to_model in paths:
+        with open(path_to_model, 'rb') as model_file:
+            model = pickle.load(model_file)
+        directory = export_bundle(model, bundle_path(path_to_model),
+                                  source=os.path.basename(path_to_model))
+        print(f"Exported {path_to_model} to: {directory}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,536 @@
+"""
+
+    Vectorised batch scoring for trained SVD models.
+
+    Author: Explore Data Science Academy.
+
+    Description: Helpers which pull the learnt factor matrices out of a
+    fitted surprise `SVD` model once, and then score many (user, item)
+    pairs at a time with NumPy matrix products instead of calling
+    `model.predict` for every pair. Estimates are identical to those of
+    `SVD.predict`, including its handling of unknown users/items and the
+    clipping of estimates to the rating scale.
+
+    Online updates (see `utils.online_updates`) only change the rows of
+    the users and items they touch. Updated factors hold those rows in a
+    `RowOverlay` over the base arrays, which stay memory-mapped and shared
+    with the other processes instead of being copied into every worker.
+
+"""
+
+# Script dependencies
+import os
+from collections import ChainMap
+import numpy as np
+from utils.registry import registry, get_model
+from utils.shared_store import shared_resource
+from utils.online_updates import get_online_updates
+from utils.topk import merge_top_k
+
+# Users scored at a time when looking for the top users of some items
+USER_BLOCK = 65536
+# Ratings applied at a time by one vectorised SGD step of `partial_fit`
+SGD_BATCH = 256
+
+
+class RowOverlay:
+    """Read-only array made of a base array with some of its rows
+    replaced and rows appended after it.
+
+    Supports what `SVDFactors` does with its arrays: indexing with an
+    integer, a slice or an integer array, products with `@` and conversion
+    with `numpy.asarray`, which copies the whole array.
+
+    Parameters
+    ----------
+    base : numpy.ndarray
+        Array whose other rows are used as they are, e.g. memory-mapped.
+    rows : numpy.ndarray
+        Sorted positions of the replaced and appended rows; appended rows
+        follow `len(base)` without gaps.
+    values : numpy.ndarray
+        New value of each of those rows.
+
+    """
+
+    def __init__(self, base, rows, values):
+        self.base = base
+        self.rows = rows
+        self.values = values
+
+    @classmethod
+    def over(cls, array, rows, values):
+        """`array` with `rows` set to `values`, sharing every other row.
+
+        `array` may itself be an overlay, whose rows are merged with the
+        new ones rather than stacked, so lookups stay a single search.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        values = np.asarray(values)
+        if not isinstance(array, RowOverlay):
+            order = np.argsort(rows, kind='stable')
+            return cls(array, rows[order], values[order].astype(array.dtype))
+        kept = ~np.isin(array.rows, rows)
+        merged = np.concatenate([array.rows[kept], rows])
+        order = np.argsort(merged, kind='stable')
+        return cls(array.base, merged[order],
+                   np.concatenate([array.values[kept],
+                                   values.astype(array.dtype)])[order])
+
+    @property
+    def dtype(self):
+        return self.base.dtype
+
+    @property
+    def shape(self):
+        n_appended = int(np.sum(self.rows >= len(self.base)))
+        return (len(self.base) + n_appended,) + self.base.shape[1:]
+
+    @property
+    def ndim(self):
+        return self.base.ndim
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            key = np.arange(len(self))[key]
+        key = np.asarray(key, dtype=np.int64)
+        if key.ndim == 0:
+            return self[key[None]][0]
+        key = np.where(key < 0, key + len(self), key)
+        if len(key) and not 0 <= key.min() <= key.max() < len(self):
+            raise IndexError('Row index out of range')
+        out = self.base[np.minimum(key, len(self.base) - 1)]
+        positions = np.searchsorted(self.rows, key)
+        found = positions < len(self.rows)
+        found[found] = self.rows[positions[found]] == key[found]
+        out[found] = self.values[positions[found]]
+        return out
+
+    def __matmul__(self, other):
+        product = self.base @ other
+        out = np.zeros((len(self),) + product.shape[1:], dtype=product.dtype)
+        out[:len(self.base)] = product
+        out[self.rows] = self.values @ other
+        return out
+
+    def __array__(self, dtype=None):
+        out = np.empty(self.shape, dtype=self.dtype)
+        out[:len(self.base)] = self.base
+        out[self.rows] = self.values
+        return out if dtype is None else out.astype(dtype)
+
+
+class SVDFactors:
+    """Factor matrices and id mappings of a fitted SVD model.
+
+    Parameters
+    ----------
+    pu : numpy.ndarray
+        (n_users x n_factors) user factors.
+    qi : numpy.ndarray
+        (n_items x n_factors) item factors.
+    bu : numpy.ndarray
+        User biases.
+    bi : numpy.ndarray
+        Item biases.
+    global_mean : float
+        Mean of all ratings in the training set.
+    user_ids : array-like
+        Raw user id of every inner user id.
+    item_ids : array-like
+        Raw item id of every inner item id.
+    rating_scale : tuple (float, float)
+        Bounds into which estimates are clipped.
+    biased : bool
+        Whether the model was trained with baselines.
+
+    """
+
+    def __init__(self, pu, qi, bu, bi, global_mean, user_ids, item_ids,
+                 rating_scale, biased=True):
+        self.pu = pu
+        self.qi = qi
+        self.bu = bu
+        self.bi = bi
+        self.global_mean = global_mean
+        self.user_ids = np.asarray(user_ids)
+        self.item_ids = np.asarray(item_ids)
+        self.rating_scale = rating_scale
+        self.biased = biased
+        self._user_inner = {raw: inner for inner, raw in enumerate(user_ids)}
+        self._item_inner = {raw: inner for inner, raw in enumerate(item_ids)}
+
+    @classmethod
+    def from_surprise(cls, model):
+        """Extract the factors of a fitted surprise `SVD` model.
+
+        Parameters
+        ----------
+        model : surprise.SVD
+            A fitted SVD model.
+
+        Returns
+        -------
+        SVDFactors
+            The model's factors, biases and id mappings.
+
+        """
+        trainset = model.trainset
+        user_ids = [raw for raw, inner in sorted(
+            trainset._raw2inner_id_users.items(), key=lambda kv: kv[1])]
+        item_ids = [raw for raw, inner in sorted(
+            trainset._raw2inner_id_items.items(), key=lambda kv: kv[1])]
+        return cls(pu=model.pu, qi=model.qi, bu=model.bu, bi=model.bi,
+                   global_mean=trainset.global_mean,
+                   user_ids=user_ids, item_ids=item_ids,
+                   rating_scale=trainset.rating_scale,
+                   biased=model.biased)
+
+    @property
+    def n_users(self):
+        return self.pu.shape[0]
+
+    @property
+    def n_items(self):
+        return self.qi.shape[0]
+
+    def user_index(self, raw_ids):
+        """Map raw user ids to inner ids, using -1 for unknown users."""
+        return np.array([self._user_inner.get(raw, -1) for raw in raw_ids],
+                        dtype=np.int64)
+
+    def item_index(self, raw_ids):
+        """Map raw item ids to inner ids, using -1 for unknown items."""
+        return np.array([self._item_inner.get(raw, -1) for raw in raw_ids],
+                        dtype=np.int64)
+
+    def score(self, user_inner, item_inner):
+        """Estimate the ratings of a block of users for a block of items.
+
+        Parameters
+        ----------
+        user_inner : numpy.ndarray
+            Inner user ids, -1 for users unknown to the model.
+        item_inner : numpy.ndarray
+            Inner item ids, -1 for items unknown to the model.
+
+        Returns
+        -------
+        numpy.ndarray
+            (len(user_inner) x len(item_inner)) estimated ratings.
+
+        """
+        user_inner = np.asarray(user_inner)
+        item_inner = np.asarray(item_inner)
+        known_u = user_inner >= 0
+        known_i = item_inner >= 0
+        u = np.where(known_u, user_inner, 0)
+        i = np.where(known_i, item_inner, 0)
+
+        est = self.pu[u] @ self.qi[i].T
+        est[~known_u, :] = 0
+        est[:, ~known_i] = 0
+        if self.biased:
+            est += self.global_mean
+            est += np.where(known_u, self.bu[u], 0)[:, None]
+            est += np.where(known_i, self.bi[i], 0)[None, :]
+        else:
+            # Surprise falls back to the global mean when either is unknown
+            est[~(known_u[:, None] & known_i[None, :])] = self.global_mean
+        return self.clip(est)
+
+    def clip(self, est):
+        """Clip estimated ratings to the rating scale, in place."""
+        lower_bound, higher_bound = self.rating_scale
+        return np.clip(est, lower_bound, higher_bound, out=est)
+
+    def top_users(self, item_ids, k=10, user_ids=None):
+        """Find the users with the highest estimated rating for each item.
+
+        Parameters
+        ----------
+        item_ids : list
+            Raw ids of the items to score.
+        k : int
+            Number of users to return per item.
+        user_ids : array-like, optional
+            Raw ids of the candidate users. Defaults to every user known
+            to the model.
+
+        Returns
+        -------
+        list (numpy.ndarray)
+            Raw ids of the top-k users for every item, highest estimate
+            first. Ties keep the order of `user_ids`, as a stable sort of
+            the full list of predictions would.
+
+        """
+        if user_ids is None:
+            user_ids = self.user_ids
+            user_inner = np.arange(self.n_users)
+        else:
+            user_ids = np.asarray(user_ids)
+            user_inner = self.user_index(user_ids)
+        item_inner = self.item_index(item_ids)
+        # Only the running top k of each item is kept between blocks, so
+        # memory does not grow with the number of users
+        blocks = (self.score(user_inner[start:start + USER_BLOCK], item_inner)
+                  for start in range(0, len(user_inner), USER_BLOCK))
+        return [user_ids[rows] for rows, _ in merge_top_k(blocks, k)]
+
+    def fold_in(self, item_inner, ratings, reg=0.1):
+        """Place a new user in the latent space from a few ratings.
+
+        Solves the regularised least-squares problem
+
+            min  sum_i (r_i - mu - b_i - b_u - q_i . p_u)^2
+                 + reg * (b_u^2 + |p_u|^2)
+
+        for the user's bias b_u and factors p_u, keeping every item
+        parameter fixed. With only a handful of ratings the dual form is
+        used, so the cost is that of an (n_ratings x n_ratings) solve.
+
+        Parameters
+        ----------
+        item_inner : array-like
+            Inner ids of the rated items (all known to the model).
+        ratings : array-like
+            The user's (possibly implied) ratings of those items.
+        reg : float
+            Regularisation strength.
+
+        Returns
+        -------
+        tuple (float, numpy.ndarray)
+            The user's bias and factor vector.
+
+        """
+        item_inner = np.asarray(item_inner)
+        # Design matrix [1, q_i] over the user's bias and factors
+        design = np.hstack([np.ones((len(item_inner), 1)),
+                            self.qi[item_inner]])
+        residual = np.asarray(ratings, dtype=np.float64) - self.global_mean
+        if self.biased:
+            residual = residual - self.bi[item_inner]
+        else:
+            design = design[:, 1:]
+        gram = design @ design.T + reg * np.eye(len(item_inner))
+        weights = design.T @ np.linalg.solve(gram, residual)
+        if self.biased:
+            return weights[0], weights[1:]
+        return 0.0, weights
+
+    def _updated(self, users=None, items=None, new_user_ids=()):
+        """Factors sharing every row but the given ones with these.
+
+        `users` and `items` are (inner ids, factors, biases) of the rows
+        to replace or append; `new_user_ids` are the raw ids of appended
+        users, in inner id order.
+        """
+        factors = SVDFactors.__new__(SVDFactors)
+        factors.__dict__.update(self.__dict__)
+        if users is not None:
+            rows, pu, bu = users
+            factors.pu = RowOverlay.over(self.pu, rows, pu)
+            factors.bu = RowOverlay.over(self.bu, rows, bu)
+        if items is not None:
+            rows, qi, bi = items
+            factors.qi = RowOverlay.over(self.qi, rows, qi)
+            factors.bi = RowOverlay.over(self.bi, rows, bi)
+        if len(new_user_ids):
+            inner = {raw: self.n_users + position
+                     for position, raw in enumerate(new_user_ids)}
+            factors.user_ids = np.append(self.user_ids, new_user_ids)
+            # The base mapping is shared, only the new users are added
+            base = self._user_inner
+            if isinstance(base, ChainMap):
+                factors._user_inner = ChainMap({**base.maps[0], **inner},
+                                               *base.maps[1:])
+            else:
+                factors._user_inner = ChainMap(inner, base)
+        return factors
+
+    def add_users(self, raw_ids, item_inner, ratings, reg=0.1):
+        """Factors with new users appended, each folded in from their
+        ratings (see `fold_in`). These factors are left unchanged.
+
+        Parameters
+        ----------
+        raw_ids : list
+            Raw ids of the new users.
+        item_inner : list (numpy.ndarray)
+            Inner ids of the items rated by each user.
+        ratings : list (numpy.ndarray)
+            Each user's ratings of those items.
+        reg : float
+            Regularisation strength.
+
+        Returns
+        -------
+        SVDFactors
+            Factors knowing the new users, in the order of `raw_ids`.
+
+        """
+        if not len(raw_ids):
+            return self
+        biases, vectors = zip(*[
+            self.fold_in(items, values, reg=reg) if len(items)
+            else (0.0, np.zeros(self.pu.shape[1]))
+            for items, values in zip(item_inner, ratings)])
+        rows = self.n_users + np.arange(len(raw_ids))
+        return self._updated(users=(rows, np.array(vectors),
+                                    np.array(biases)),
+                             new_user_ids=list(raw_ids))
+
+    def partial_fit(self, user_inner, item_inner, ratings, n_epochs=10,
+                    lr=0.005, reg=0.02, batch_size=SGD_BATCH):
+        """Factors after a few SGD steps over new ratings, as surprise's
+        SVD takes when training. These factors are left unchanged.
+
+        Only the rows of the rating users and rated items are copied and
+        updated, so memory grows with the number of touched rows rather
+        than with the model. Each step applies up to `batch_size` ratings
+        at once, summing the updates of ratings sharing a user or item;
+        with `batch_size=1` this is surprise's sequential SGD.
+
+        Parameters
+        ----------
+        user_inner, item_inner : array-like
+            Inner ids of the user and item of every rating (all known to
+            the model).
+        ratings : array-like
+            Rating values.
+        n_epochs : int
+            Number of passes over the ratings.
+        lr : float
+            Learning rate; surprise's default.
+        reg : float
+            Regularisation strength; surprise's default.
+        batch_size : int
+            Ratings applied per vectorised step.
+
+        Returns
+        -------
+        SVDFactors
+            The updated factors.
+
+        """
+        user_rows, users = np.unique(np.asarray(user_inner, dtype=np.int64),
+                                     return_inverse=True)
+        item_rows, items = np.unique(np.asarray(item_inner, dtype=np.int64),
+                                     return_inverse=True)
+        if not len(user_rows):
+            return self
+        ratings = np.asarray(ratings, dtype=np.float64)
+        # Working copies of just the touched rows
+        pu = self.pu[user_rows].astype(np.float64)
+        qi = self.qi[item_rows].astype(np.float64)
+        bu = self.bu[user_rows].astype(np.float64)
+        bi = self.bi[item_rows].astype(np.float64)
+        for _ in range(n_epochs):
+            for start in range(0, len(ratings), batch_size):
+                u = users[start:start + batch_size]
+                i = items[start:start + batch_size]
+                user_factors, item_factors = pu[u], qi[i]
+                err = (ratings[start:start + batch_size]
+                       - np.einsum('ij,ij->i', user_factors, item_factors))
+                if self.biased:
+                    err -= self.global_mean + bu[u] + bi[i]
+                    np.add.at(bu, u, lr * (err - reg * bu[u]))
+                    np.add.at(bi, i, lr * (err - reg * bi[i]))
+                np.add.at(pu, u, lr * (err[:, None] * item_factors
+                                       - reg * user_factors))
+                np.add.at(qi, i, lr * (err[:, None] * user_factors
+                                       - reg * item_factors))
+        return self._updated(users=(user_rows, pu, bu),
+                             items=(item_rows, qi, bi))
+
+    def score_user(self, user_bias, user_factors, item_inner=None):
+        """Estimate the ratings of a folded-in user for a block of items.
+
+        Parameters
+        ----------
+        user_bias : float
+            The user's bias, from `fold_in`.
+        user_factors : numpy.ndarray
+            The user's factor vector, from `fold_in`.
+        item_inner : numpy.ndarray, optional
+            Inner item ids, -1 for items unknown to the model. Defaults to
+            every item, in inner id order.
+
+        Returns
+        -------
+        numpy.ndarray
+            Estimated rating of every item. The estimates are not clipped
+            to the rating scale, so items estimated beyond it still rank
+            apart; `clip` the ones reported as ratings.
+
+        """
+        if item_inner is None:
+            est = self.qi @ user_factors
+            if self.biased:
+                est += self.global_mean + user_bias + np.asarray(self.bi)
+            return est
+        item_inner = np.asarray(item_inner)
+        known = item_inner >= 0
+        i = item_inner[known]
+        # Surprise falls back to the baseline when the item is unknown
+        est = np.full(len(item_inner), self.global_mean, dtype=np.float64)
+        est[known] = self.qi[i] @ user_factors
+        if self.biased:
+            est += user_bias
+            est[known] += self.global_mean + self.bi[i]
+        return est
+
+
+def load_factors(path_to_model, live=True):
+    """Factors of a trained SVD model, shared process-wide.
+
+    The compact bundle exported next to the pickle (see
+    `recommenders.model_bundle`) is served when present; otherwise the
+    factors are extracted from the pickled surprise model itself.
+
+    Parameters
+    ----------
+    path_to_model : str
+        Path to the pickled model.
+    live : bool
+        Apply SGD updates for the ratings logged since the model was
+        trained (see `utils.online_updates`).
+
+    Returns
+    -------
+    SVDFactors
+        Factors of the model, reloaded whenever a new bundle generation
+        is published or the pickle changes. Memory-mapped from the shared
+        snapshot when serving from one.
+
+    """
+    from recommenders.model_bundle import bundle_path, load_bundle
+    factors = shared_resource(
+        'factors', [path_to_model],
+        lambda rating_scale, **arrays: SVDFactors(
+            rating_scale=tuple(rating_scale), **arrays))
+    if factors is None:
+        bundle_dir = bundle_path(path_to_model)
+
+        def load():
+            if os.path.exists(os.path.join(bundle_dir, 'CURRENT')):
+                return load_bundle(bundle_dir)
+            return SVDFactors.from_surprise(get_model(path_to_model))
+        factors = registry.get(('factors', path_to_model), load,
+                               model_sources(path_to_model))
+    if live:
+        factors = get_online_updates().factors(factors)
+    return factors
+
+
+def model_sources(path_to_model):
+    """Files whose changes invalidate anything derived from a model: the
+    bundle's CURRENT pointer when a bundle exists, else the pickle."""
+    from recommenders.model_bundle import bundle_path
+    pointer = os.path.join(bundle_path(path_to_model), 'CURRENT')
+    return [pointer] if os.path.exists(pointer) else [path_to_model]
@@ -4,36 +4,327 @@
 
     Author: Explore Data Science Academy.
 
-    Description: Simple script to train and save an instance of the
-    SVDpp algorithm on MovieLens data.
+    Description: Script to train and save an instance of the SVD algorithm
+    on MovieLens data. Three modes are available:
+
+    * train  - fit a model from scratch on the full ratings file.
+    * update - warm-start from a previously saved model and fold in new
+               ratings (including ratings of new users and movies) with a
+               few epochs of SGD, instead of retraining from scratch.
+    * search - evaluate a grid of hyper-parameter configurations with
+               k-fold cross-validation, fanning the configurations out
+               across a pool of worker processes.
+
+    Wall-clock time is reported per epoch and per configuration. The
+    `train` mode streams the ratings through the columnar cache of
+    `utils.data_store`, so it also works on the full MovieLens ratings.
+
+    Usage:
+
+        python resources/models/train_colbased.py train
+        python resources/models/train_colbased.py update --new-ratings new.csv
+        python resources/models/train_colbased.py search --workers 4
 
 """
 # Script dependencies
+import os
+import sys
+import time
+import pickle
+import argparse
+import itertools
 import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from surprise import SVD
 import surprise
-import pickle
+from surprise import accuracy
+from surprise.model_selection import KFold
+
+MODELS_DIR = os.path.dirname(os.path.abspath(__file__))
+RATINGS_PATH = os.path.join(MODELS_DIR, '..', 'data', 'ratings.csv')
+MODEL_PATH = os.path.join(MODELS_DIR, 'SVD.pkl')
+
+# Allow imports from the root of the repository
+sys.path.insert(0, os.path.join(MODELS_DIR, '..', '..'))
+from recommenders.model_bundle import bundle_path, export_bundle
+from utils.data_store import rating_columns
+from utils.ingest import build_trainset
+
+# Hyper-parameters of the production model
+SVD_PARAMS = dict(n_factors = 200 , lr_all = 0.005 , reg_all = 0.02 ,
+                  n_epochs = 40 , init_std_dev = 0.05)
+
+# Grid explored by the `search` mode
+SEARCH_GRID = dict(n_factors = [50, 100, 200], lr_all = [0.005, 0.01],
+                   reg_all = [0.02, 0.05], n_epochs = [20, 40])
+
+
+def load_ratings(path_to_ratings=RATINGS_PATH):
+    """Read the ratings, without timestamps, in compact dtypes."""
+    return pd.read_csv(path_to_ratings, usecols=['userId', 'movieId', 'rating'],
+                       dtype={'userId': np.int32, 'movieId': np.int32,
+                              'rating': np.float32})
 
-# Importing datasets
-ratings = pd.read_csv('ratings.csv')
-ratings.drop('timestamp',axis=1,inplace=True)
 
-def svd_pp(save_path):
+def load_dataset(ratings):
+    """Wrap a ratings frame in a surprise Dataset."""
     # Check the range of the rating
     min_rat = ratings['rating'].min()
     max_rat = ratings['rating'].max()
     # Changing ratings to their standard form
     reader = surprise.Reader(rating_scale = (min_rat,max_rat))
     # Loading the data frame using surprice
-    data_load = surprise.Dataset.load_from_df(ratings, reader)
-    # Insatntiating surpricce
-    method = SVD(n_factors = 200 , lr_all = 0.005 , reg_all = 0.02 , n_epochs = 40 , init_std_dev = 0.05)
+    return surprise.Dataset.load_from_df(ratings, reader)
+
+
+def fit_timed(params, trainset):
+    """Fit an SVD model, returning it with its timing.
+
+    Surprise runs every epoch within a single `fit` call, so the time per
+    epoch is the average over all epochs.
+
+    Returns
+    -------
+    tuple (surprise.SVD, float, float)
+        Fitted model, total seconds and seconds per epoch.
+
+    """
+    start = time.perf_counter()
+    model = SVD(**params).fit(trainset)
+    elapsed = time.perf_counter() - start
+    return model, elapsed, elapsed / params.get('n_epochs', 20)
+
+
+def svd_pp(save_path, ratings=None, path_to_ratings=RATINGS_PATH):
+    """Train the production SVD model from scratch and pickle it.
+
+    Unless a ratings frame is given, the trainset is built block by block
+    from the memory-mapped rating columns of `path_to_ratings`.
+    """
+    if ratings is None:
+        columns = rating_columns(path_to_ratings)
+        trainset = build_trainset(columns['userId'], columns['movieId'],
+                                  columns['rating'])
+    else:
+        trainset = load_dataset(ratings).build_full_trainset()
     # Loading a trainset into the model
-    model = method.fit(data_load.build_full_trainset())
-    print (f"Training completed. Saving model to: {save_path}")
+    model, elapsed, per_epoch = fit_timed(SVD_PARAMS, trainset)
+    print (f"Training completed in {elapsed:.1f}s "
+           f"({per_epoch:.2f}s per epoch). Saving model to: {save_path}")
+
+    save_model(model, save_path)
+
+
+def save_model(model, save_path):
+    """Pickle a model and export its compact serving bundle next to it."""
+    with open(save_path, 'wb') as model_file:
+        pickle.dump(model, model_file)
+    directory = export_bundle(model, bundle_path(save_path),
+                              source=os.path.basename(save_path))
+    print(f"Exported serving bundle to: {directory}")
+
+
+def _add_ids(raw2inner, raw_ids):
+    """Give inner ids to raw ids not yet in a trainset mapping."""
+    added = 0
+    for raw in raw_ids:
+        if raw not in raw2inner:
+            raw2inner[raw] = len(raw2inner)
+            added += 1
+    return added
+
+
+def fold_in(model, new_ratings, n_epochs=5, replay=1.0, users_only=False,
+            seed=0):
+    """Warm-start an SVD model on new ratings with a few epochs of SGD.
+
+    New users and movies get freshly initialised factors and zero biases;
+    existing factors continue from their trained values. The update rules
+    are those of surprise's SVD. To limit drift on the existing data, each
+    epoch also replays a random sample of the original ratings.
+
+    Parameters
+    ----------
+    model : surprise.SVD
+        Previously fitted model. Updated in place.
+    new_ratings : Pandas Dataframe
+        New `userId`, `movieId`, `rating` records.
+    n_epochs : int
+        Number of passes over the new ratings.
+    replay : float
+        Number of old ratings replayed per epoch, as a multiple of the
+        number of new ratings.
+    users_only : bool
+        Only update user factors and biases; movie factors stay frozen.
+    seed : int
+        Random seed for initialisation and shuffling.
+
+    Returns
+    -------
+    surprise.SVD
+        The updated model, still usable with `predict` and the app.
+
+    """
+    trainset = model.trainset
+    rng = np.random.default_rng(seed)
+    # The global mean is kept, as every bias was learnt relative to it
+    global_mean = trainset.global_mean
+    trainset._global_mean = global_mean
+
+    # Extend the id mappings and factor matrices for new users/movies
+    new_users = _add_ids(trainset._raw2inner_id_users, new_ratings['userId'])
+    new_items = _add_ids(trainset._raw2inner_id_items, new_ratings['movieId'])
+    shape = (new_users, model.n_factors)
+    model.pu = np.vstack([model.pu, rng.normal(model.init_mean,
+                                               model.init_std_dev, shape)])
+    shape = (new_items, model.n_factors)
+    model.qi = np.vstack([model.qi, rng.normal(model.init_mean,
+                                               model.init_std_dev, shape)])
+    model.bu = np.concatenate([model.bu, np.zeros(new_users)])
+    model.bi = np.concatenate([model.bi, np.zeros(new_items)])
+
+    old = np.array(list(trainset.all_ratings()))
+    users = np.array([trainset._raw2inner_id_users[u]
+                      for u in new_ratings['userId']])
+    items = np.array([trainset._raw2inner_id_items[i]
+                      for i in new_ratings['movieId']])
+    values = new_ratings['rating'].to_numpy(dtype=np.float64)
+
+    # Keep the trainset consistent so the model knows the new ids
+    for u, i, r in zip(users, items, values):
+        trainset.ur[u].append((i, r))
+        trainset.ir[i].append((u, r))
+    trainset.n_users = len(trainset._raw2inner_id_users)
+    trainset.n_items = len(trainset._raw2inner_id_items)
+    trainset.n_ratings += len(values)
+    trainset._inner2raw_id_users = None
+    trainset._inner2raw_id_items = None
+
+    pu, qi, bu, bi = model.pu, model.qi, model.bu, model.bi
+    n_replay = min(int(replay * len(values)), len(old))
+    for epoch in range(n_epochs):
+        start = time.perf_counter()
+        sample = old[rng.choice(len(old), n_replay, replace=False)]
+        epoch_u = np.concatenate([users, sample[:, 0].astype(int)])
+        epoch_i = np.concatenate([items, sample[:, 1].astype(int)])
+        epoch_r = np.concatenate([values, sample[:, 2]])
+        for j in rng.permutation(len(epoch_r)):
+            u, i = epoch_u[j], epoch_i[j]
+            err = epoch_r[j] - (global_mean + bu[u] + bi[i]
+                                + np.dot(qi[i], pu[u]))
+            bu[u] += model.lr_bu * (err - model.reg_bu * bu[u])
+            user_factors = pu[u].copy()
+            pu[u] += model.lr_pu * (err * qi[i] - model.reg_pu * pu[u])
+            if not users_only:
+                bi[i] += model.lr_bi * (err - model.reg_bi * bi[i])
+                qi[i] += model.lr_qi * (err * user_factors
+                                        - model.reg_qi * qi[i])
+        print(f"Epoch {epoch + 1}/{n_epochs}: {len(epoch_r)} ratings in "
+              f"{time.perf_counter() - start:.2f}s")
+    return model
+
+
+def evaluate_config(params, path_to_ratings, n_folds, seed):
+    """Cross-validate one hyper-parameter configuration.
+
+    Runs in a worker process, so it loads its own copy of the ratings.
+
+    Returns
+    -------
+    dict
+        The configuration with its mean RMSE and timings.
+
+    """
+    data = load_dataset(load_ratings(path_to_ratings))
+    start = time.perf_counter()
+    scores, epoch_times = [], []
+    for trainset, testset in KFold(n_splits=n_folds,
+                                   random_state=seed).split(data):
+        model, _, per_epoch = fit_timed(params, trainset)
+        epoch_times.append(per_epoch)
+        scores.append(accuracy.rmse(model.test(testset), verbose=False))
+    return dict(params, rmse=float(np.mean(scores)),
+                seconds=time.perf_counter() - start,
+                seconds_per_epoch=float(np.mean(epoch_times)))
+
+
+def search(path_to_ratings=RATINGS_PATH, grid=SEARCH_GRID, n_folds=3,
+           workers=None, seed=0):
+    """Evaluate every configuration of a grid in parallel.
+
+    Parameters
+    ----------
+    path_to_ratings : str
+        Path to the ratings stored in .csv format.
+    grid : dict
+        SVD parameter name -> list of values to try.
+    n_folds : int
+        Number of cross-validation folds per configuration.
+    workers : int, optional
+        Size of the process pool. Defaults to the number of CPUs.
+    seed : int
+        Random seed for the fold split, shared by every configuration.
+
+    Returns
+    -------
+    list (dict)
+        Results, best (lowest RMSE) first.
+
+    """
+    configs = [dict(zip(grid, values))
+               for values in itertools.product(*grid.values())]
+    results = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(evaluate_config, params, path_to_ratings,
+                               n_folds, seed) for params in configs]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            print(f"{result['rmse']:.4f} RMSE in {result['seconds']:.1f}s "
+                  f"({result['seconds_per_epoch']:.2f}s per epoch): "
+                  + ', '.join(f'{k}={result[k]}' for k in grid))
+    print(f"Searched {len(configs)} configurations in "
+          f"{time.perf_counter() - start:.1f}s")
+    return sorted(results, key=lambda result: result['rmse'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the SVD model.')
+    modes = parser.add_subparsers(dest='mode')
+    train = modes.add_parser('train', help='Fit a model from scratch.')
+    train.add_argument('--ratings', default=RATINGS_PATH)
+    train.add_argument('--output', default=MODEL_PATH)
+    update = modes.add_parser('update', help='Fold new ratings into a model.')
+    update.add_argument('--model', default=MODEL_PATH)
+    update.add_argument('--new-ratings', required=True)
+    update.add_argument('--output', help='Defaults to overwriting --model.')
+    update.add_argument('--epochs', type=int, default=5)
+    update.add_argument('--replay', type=float, default=1.0)
+    update.add_argument('--users-only', action='store_true')
+    grid = modes.add_parser('search', help='Parallel hyper-parameter search.')
+    grid.add_argument('--ratings', default=RATINGS_PATH)
+    grid.add_argument('--folds', type=int, default=3)
+    grid.add_argument('--workers', type=int)
+    args = parser.parse_args()
+
+    if args.mode == 'update':
+        with open(args.model, 'rb') as model_file:
+            model = pickle.load(model_file)
+        fold_in(model, load_ratings(args.new_ratings), n_epochs=args.epochs,
+                replay=args.replay, users_only=args.users_only)
+        output = args.output or args.model
+        print(f"Update completed. Saving model to: {output}")
+        save_model(model, output)
+    elif args.mode == 'search':
+        best = search(args.ratings, n_folds=args.folds, workers=args.workers)[0]
+        print('Best configuration: '
+              + ', '.join(f'{k}={best[k]}' for k in SEARCH_GRID))
+    else:
+        svd_pp(getattr(args, 'output', MODEL_PATH),
+               path_to_ratings=getattr(args, 'ratings', RATINGS_PATH))
 
-    return pickle.dump(model, open(save_path,'wb'))
 
 if __name__ == '__main__':
-    svd_pp('SVD.pkl')
+    main()
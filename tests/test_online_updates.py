@@ -0,0 +1,130 @@
+"""
+
+    Tests of the online rating updates.
+
+    Author: Explore Data Science Academy.
+
+    Description: Ratings appended to the log must be layered over the
+    ratings index, popularity table and SVD factors on the next request,
+    new batches being applied on top of the previous ones, while the base
+    models are left untouched (user-023).
+
+"""
+
+# Script dependencies
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from recommenders.svd_scoring import RowOverlay, SVDFactors
+from utils.catalogue import MovieCatalogue
+from utils.online_updates import OnlineUpdates, RatingLog
+from utils.popularity import PopularityTable, build_popularity
+from utils.ratings_index import RatingsIndex
+
+
+@pytest.fixture
+def catalogue():
+    return MovieCatalogue(pd.DataFrame({
+        'movieId': [10, 20, 30, 40],
+        'title': ['A (1995)', 'B (1995)', 'C (1999)', 'D (2000)'],
+        'genres': ['Drama', 'Comedy', 'Drama|Comedy', 'Action']}))
+
+
+@pytest.fixture
+def updates(tmp_path):
+    return OnlineUpdates(str(tmp_path / 'ratings.db'))
+
+
+def _append(updates, records):
+    """Append ratings, then move the log's modification time on, as a
+    write in a later clock tick would."""
+    updates.log.append(records)
+    stat = os.stat(updates.log.path)
+    later = stat.st_mtime_ns + 10 ** 9
+    os.utime(updates.log.path, ns=(later, later))
+
+
+# user-023: logged ratings layered over the base models
+
+def test_log_rejects_invalid_ratings(tmp_path):
+    log = RatingLog(str(tmp_path / 'ratings.db'))
+    for rating in (0.0, 5.5, 3.2):
+        with pytest.raises(ValueError):
+            log.append([(1, 10, rating)])
+    assert log.append([(1, 10, 4.5), (2, 20, 0.5)]) == 2
+    seqs, users, movies, ratings = log.read(after=1)
+    assert (seqs.tolist(), users.tolist(), movies.tolist(),
+            ratings.tolist()) == ([2], [2], [20], [0.5])
+
+
+def test_no_ratings_serve_the_base_models(updates, catalogue):
+    base = RatingsIndex([1], [0], [4.0])
+    assert updates.poll() == 0
+    assert updates.ratings_index(base, catalogue) is base
+
+
+def test_ratings_index_gains_logged_ratings(updates, catalogue):
+    base = RatingsIndex([1, 1, 2], [0, 1, 2], [4.0, 3.0, 5.0])
+    # movieId 99 is not in the catalogue
+    _append(updates, [(1, 20, 1.0), (3, 40, 2.5), (3, 99, 4.0)])
+    overlay = updates.ratings_index(base, catalogue)
+    assert updates.ratings_index(base, catalogue) is overlay
+
+    rows, ratings, owners = overlay.gather([1, 3])
+    assert sorted(zip(owners.tolist(), rows.tolist(), ratings.tolist())) \
+        == [(0, 0, 4.0), (0, 1, 1.0), (1, 3, 2.5)]
+    assert base.gather([3])[0].tolist() == []
+
+
+def test_popularity_counts_new_and_changed_ratings(updates, catalogue):
+    ratings_index = RatingsIndex([1, 2, 2], [0, 0, 1], [4.0, 2.0, 3.0])
+    base = PopularityTable(build_popularity(
+        np.array([2, 1, 0, 0]), np.array([3.0, 3.0, 0.0, 0.0]),
+        catalogue.genres, np.array([1995, 1995, 1999, 2000]), k=4))
+    counts = base.counts.copy()
+
+    # User 1 re-rates movie 10 twice; user 3 rates movies 10 and 40
+    _append(updates, [(1, 10, 5.0), (3, 10, 4.0)])
+    first = updates.popularity(base, ratings_index, catalogue)
+    _append(updates, [(1, 10, 3.0), (3, 40, 5.0)])
+    table = updates.popularity(base, ratings_index, catalogue)
+
+    assert table is not first
+    assert table.counts.tolist() == [3, 1, 0, 1]
+    # Sum of ratings of movie 10: 3 (user 1) + 2 (user 2) + 4 (user 3)
+    expected = ((base.prior * base.global_mean + 9.0) / (base.prior + 3))
+    assert np.isclose(table.bayesian[0], expected)
+    assert 3 in table.top.tolist()
+    assert np.array_equal(base.counts, counts)
+
+
+def test_factors_fold_in_new_users_and_share_rows(updates):
+    rng = np.random.default_rng(0)
+    base = SVDFactors(pu=rng.normal(size=(3, 2)), qi=rng.normal(size=(4, 2)),
+                      bu=np.zeros(3), bi=np.zeros(4), global_mean=3.5,
+                      user_ids=[1, 2, 3], item_ids=[10, 20, 30, 40],
+                      rating_scale=(0.5, 5.0))
+    pu = base.pu.copy()
+
+    # movieId 99 is unknown to the model, user 7 is new
+    _append(updates, [(1, 20, 5.0), (7, 30, 4.5), (7, 99, 1.0)])
+    first = updates.factors(base)
+    assert updates.factors(base) is first
+    _append(updates, [(7, 10, 1.0), (2, 40, 0.5)])
+    factors = updates.factors(base)
+
+    assert np.array_equal(base.pu, pu)
+    assert base.user_index([7]).tolist() == [-1]
+    assert factors.user_index([7, 1]).tolist() == [3, 0]
+    assert factors.item_index([99]).tolist() == [-1]
+    assert isinstance(factors.pu, RowOverlay) and factors.pu.base is base.pu
+    assert factors.pu.rows.tolist() == [0, 1, 3]
+    assert factors.qi.rows.tolist() == [0, 1, 2, 3]
+    # The new users' and movies' ratings moved their estimates
+    estimates = factors.score(factors.user_index([1, 7, 2]),
+                              factors.item_index([20, 10, 40]))
+    before = base.score(base.user_index([1, 2]),
+                        base.item_index([20, 40]))
+    assert estimates[0, 0] > before[0, 0]
+    assert estimates[2, 2] < before[1, 1]
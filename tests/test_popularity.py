@@ -0,0 +1,114 @@
+"""
+
+    Tests of the popularity table.
+
+    Author: Explore Data Science Academy.
+
+    Description: A table updated with some new ratings must rank movies
+    as a table rebuilt from the updated statistics does, as long as its
+    top lists are long enough to hold every movie (user-021, user-023),
+    and the fallbacks drawn from it must honour their exclusions.
+
+"""
+
+# Script dependencies
+import numpy as np
+import pytest
+from utils.popularity import PopularityTable, build_popularity
+
+GENRES = np.array(['Drama', 'Comedy', 'Drama|Comedy', 'Action',
+                   '(no genres listed)', 'Action|Drama', 'Comedy',
+                   'Drama', 'Action', 'Comedy|Action'])
+YEARS = np.array([1995, 1995, 2000, 0, 1999, 2000, 1995, 1999, 2000, 0])
+
+
+def _statistics(rng):
+    """Counts and means of every movie, a few of them unrated."""
+    counts = rng.integers(0, 20, len(GENRES))
+    counts[[3, 7]] = 0
+    means = np.where(counts > 0, rng.integers(2, 11, len(GENRES)) / 2, 0)
+    return counts, means
+
+
+def _ranked(rows, table):
+    """Reference: rated rows by descending Bayesian average, then row."""
+    rows = np.asarray(rows)
+    rows = rows[table.counts[rows] > 0]
+    return rows[np.lexsort((rows, -table.bayesian[rows]))]
+
+
+def _assert_lists(table):
+    """Every top list of a table ranks all of its rated movies."""
+    k = table.genre_top.shape[1]
+    assert table.top.tolist() == _ranked(np.arange(len(GENRES)),
+                                         table)[:k].tolist()
+    for genre, top in zip(table.genre_names, table.genre_top):
+        expected = _ranked([row for row, names in enumerate(GENRES)
+                            if genre in names.split('|')], table)[:k]
+        assert top[top >= 0].tolist() == expected.tolist()
+    for year, top in zip(table.year_values, table.year_top):
+        expected = _ranked(np.flatnonzero(YEARS == year), table)[:k]
+        assert top[top >= 0].tolist() == expected.tolist()
+
+
+# user-021, user-023: updates of the table
+
+@pytest.mark.parametrize('seed', range(5))
+def test_updated_matches_rebuilt_lists(seed):
+    rng = np.random.default_rng(seed)
+    counts, means = _statistics(rng)
+    arrays = build_popularity(counts, means, GENRES, YEARS, k=len(GENRES))
+    table = PopularityTable(arrays)
+    bayesian = table.bayesian.copy()
+    _assert_lists(table)
+
+    # New ratings of rated and unrated movies, and changed ratings
+    rows = np.array([0, 3, 5, 8])
+    count_delta = np.array([2, 1, 0, 3])
+    sum_delta = np.array([9.0, 4.5, -2.0, 7.5])
+    updated = table.updated(rows, count_delta, sum_delta, GENRES[rows],
+                            YEARS[rows])
+
+    new_counts = counts.copy()
+    new_counts[rows] += count_delta
+    sums = means * counts
+    sums[rows] += sum_delta
+    # The prior and global mean are kept until the table is rebuilt
+    expected = ((table.prior * table.global_mean + sums)
+                / (table.prior + new_counts))
+    assert np.array_equal(updated.counts, new_counts)
+    assert np.allclose(updated.bayesian, expected, atol=1e-5)
+    _assert_lists(updated)
+    # The original table is left unchanged
+    assert np.array_equal(table.counts, counts)
+    assert np.array_equal(table.bayesian, bayesian)
+
+
+def test_updated_keeps_lists_bounded():
+    rng = np.random.default_rng(0)
+    counts, means = _statistics(rng)
+    table = PopularityTable(build_popularity(counts, means, GENRES, YEARS,
+                                             k=3))
+    updated = table.updated(np.array([3, 7]), np.array([50, 50]),
+                            np.array([250.0, 250.0]), GENRES[[3, 7]],
+                            YEARS[[3, 7]])
+    assert updated.top.tolist()[:2] == [3, 7]
+    assert len(updated.top) == 3
+    assert updated.genre_top.shape == table.genre_top.shape
+
+
+def test_top_rows_filters_and_excludes():
+    rng = np.random.default_rng(0)
+    counts, means = _statistics(rng)
+    table = PopularityTable(build_popularity(counts, means, GENRES, YEARS))
+
+    rows = table.top_rows(top_n=3, genres=['Comedy'], exclude=[1])
+    assert 1 not in rows and len(rows) <= 3
+    assert all('Comedy' in GENRES[row] for row in rows)
+    assert np.all(np.diff(table.bayesian[rows]) <= 0)
+    assert all(YEARS[row] == 1995
+               for row in table.top_rows(genres=['Drama'], year=1995))
+    # Unknown genres fall back to the overall list
+    assert np.array_equal(table.top_rows(genres=['Western']),
+                          table.top_rows())
+    assert counts[table.top_rows(top_n=len(GENRES))].min() > 0
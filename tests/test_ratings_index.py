@@ -0,0 +1,124 @@
+"""
+
+    Tests of the user -> ratings index.
+
+    Author: Explore Data Science Academy.
+
+    Description: `build_csr` must group the ratings by user, keeping
+    their order in the file and dropping movies missing from the
+    catalogue, whatever the block size (user-008, user-015).
+    `RatingsIndex.gather` must return every rating of the requested users
+    and nothing else (user-008), and `RatingsOverlay` must let a newer
+    rating of a movie replace the user's older one (user-023).
+
+"""
+
+# Script dependencies
+import numpy as np
+import pandas as pd
+import pytest
+from utils.catalogue import MovieCatalogue
+from utils.ingest import build_csr
+from utils.ratings_index import RatingsIndex, RatingsOverlay
+
+
+@pytest.fixture
+def catalogue():
+    # movieId 30 is dropped: it has no genres
+    return MovieCatalogue(pd.DataFrame({
+        'movieId': [50, 10, 30, 40, 20],
+        'title': ['E (2001)', 'A (1995)', 'C (1999)', 'D (2000)', 'B (1995)'],
+        'genres': ['Drama', 'Comedy', None, 'Drama|Comedy', 'Action']}))
+
+
+def _ratings(rng, n_ratings=200):
+    """Random ratings, including some of movies missing from the
+    catalogue."""
+    return (rng.integers(1, 30, n_ratings),
+            rng.choice([10, 20, 30, 40, 50, 60], n_ratings),
+            (rng.integers(1, 11, n_ratings) / 2).astype(np.float32))
+
+
+def _by_user(user_ids, item_rows, ratings):
+    """Reference: each user's (row, rating) pairs in file order."""
+    grouped = {}
+    for user_id, row, rating in zip(user_ids, item_rows, ratings):
+        grouped.setdefault(int(user_id), []).append((int(row), rating))
+    return grouped
+
+
+# user-008, user-015: streamed CSR build
+
+@pytest.mark.parametrize('block_rows', [1, 7, 1000])
+def test_build_csr_groups_ratings_by_user(catalogue, block_rows):
+    rng = np.random.default_rng(block_rows)
+    user_ids, movie_ids, ratings = _ratings(rng)
+    users, indptr, item_rows, values = build_csr(
+        user_ids, movie_ids, ratings, catalogue, block_rows=block_rows)
+
+    rows = [catalogue.row_of_movie_id(movie_id) for movie_id in movie_ids]
+    known = [i for i, row in enumerate(rows) if row is not None]
+    expected = _by_user(user_ids[known], [rows[i] for i in known],
+                        ratings[known])
+    assert users.tolist() == sorted(expected)
+    assert item_rows.dtype == np.int32 and values.dtype == np.float32
+    for position, user_id in enumerate(users):
+        span = slice(indptr[position], indptr[position + 1])
+        assert list(zip(item_rows[span].tolist(), values[span])) \
+            == expected[int(user_id)]
+
+
+def test_build_csr_of_no_known_movies(catalogue):
+    users, indptr, item_rows, values = build_csr(
+        np.array([1, 2]), np.array([30, 60]), np.array([4.0, 3.0]),
+        catalogue)
+    assert len(users) == len(item_rows) == len(values) == 0
+    assert indptr.tolist() == [0]
+
+
+# user-008: gathering the ratings of a few users
+
+def test_gather_returns_every_rating_of_the_users():
+    rng = np.random.default_rng(0)
+    user_ids = rng.integers(1, 30, 300)
+    item_rows = rng.integers(0, 50, 300)
+    ratings = rng.integers(1, 11, 300) / 2
+    index = RatingsIndex(user_ids, item_rows, ratings)
+    expected = _by_user(user_ids, item_rows, ratings)
+
+    # 0 and 99 are unknown; 5 is asked for twice
+    raw_ids = [5, 0, 12, 99, 5, 29]
+    rows, values, owners = index.gather(raw_ids)
+    assert len(index) == 300
+    assert np.all(np.diff(owners) >= 0)
+    for position, raw_id in enumerate(raw_ids):
+        mine = owners == position
+        assert list(zip(rows[mine].tolist(), values[mine])) \
+            == expected.get(raw_id, [])
+
+
+def test_gather_of_unknown_users():
+    index = RatingsIndex([3, 1], [0, 1], [4.0, 2.0])
+    rows, values, owners = index.gather([2, 7])
+    assert len(rows) == len(values) == len(owners) == 0
+    rows, values, owners = RatingsIndex([], [], []).gather([1])
+    assert len(rows) == 0
+
+
+# user-023: newer ratings layered over the index
+
+def test_overlay_replaces_older_ratings():
+    base = RatingsIndex([1, 1, 2, 3], [0, 4, 4, 1], [4.0, 3.0, 2.0, 5.0])
+    # User 1 re-rates movie 4 twice, user 2 rates a new movie and user 9
+    # is new
+    overlay = RatingsOverlay(base, np.array([1, 2, 9, 1]),
+                             np.array([4, 7, 0, 4]),
+                             np.array([1.0, 3.5, 2.5, 0.5]))
+    rows, values, owners = overlay.gather([1, 2, 9, 5])
+
+    assert len(overlay) == 8
+    gathered = {(int(owner), int(row)): float(value)
+                for owner, row, value in zip(owners, rows, values)}
+    assert len(gathered) == len(rows)
+    assert gathered == {(0, 0): 4.0, (0, 4): 0.5, (1, 4): 2.0,
+                        (1, 7): 3.5, (2, 0): 2.5}
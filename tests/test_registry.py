@@ -0,0 +1,111 @@
+"""
+
+    Tests of the resource registry.
+
+    Author: Explore Data Science Academy.
+
+    Description: A cached resource must be loaded once, then reloaded
+    exactly when one of its source files is modified, created or removed,
+    or when it is invalidated (user-003).
+
+"""
+
+# Script dependencies
+import os
+import threading
+from utils.registry import ResourceRegistry
+
+
+class _Loader:
+    """Loader counting its calls and returning the source file's text."""
+
+    def __init__(self, path):
+        self.path = path
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as source:
+            return source.read()
+
+
+def _touch(path, text, mtime_ns):
+    with open(path, 'w') as source:
+        source.write(text)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+# user-003: modification-time invalidation
+
+def test_loads_once_while_sources_are_unchanged(tmp_path):
+    path = str(tmp_path / 'model.txt')
+    _touch(path, 'one', 10 ** 18)
+    registry, loader = ResourceRegistry(), _Loader(path)
+    assert registry.get('model', loader, [path]) == 'one'
+    assert registry.get('model', loader, [path]) == 'one'
+    assert loader.calls == 1
+
+
+def test_reloads_when_a_source_changes(tmp_path):
+    path = str(tmp_path / 'model.txt')
+    _touch(path, 'one', 10 ** 18)
+    registry, loader = ResourceRegistry(), _Loader(path)
+    registry.get('model', loader, [path])
+
+    # Same size, newer modification time
+    _touch(path, 'two', 10 ** 18 + 1)
+    assert registry.get('model', loader, [path]) == 'two'
+    # Same modification time, different size
+    _touch(path, 'three', 10 ** 18 + 1)
+    assert registry.get('model', loader, [path]) == 'three'
+    assert loader.calls == 3
+
+
+def test_reloads_when_a_source_appears_or_disappears(tmp_path):
+    path = str(tmp_path / 'model.txt')
+    registry, loader = ResourceRegistry(), _Loader(path)
+    assert registry.get('model', loader, [path]) is None
+    _touch(path, 'one', 10 ** 18)
+    assert registry.get('model', loader, [path]) == 'one'
+    os.remove(path)
+    assert registry.get('model', loader, [path]) is None
+    assert loader.calls == 3
+
+
+def test_invalidate(tmp_path):
+    path = str(tmp_path / 'model.txt')
+    _touch(path, 'one', 10 ** 18)
+    registry = ResourceRegistry()
+    first, second = _Loader(path), _Loader(path)
+    registry.get('first', first, [path])
+    registry.get('second', second, [path])
+
+    registry.invalidate('first')
+    registry.get('first', first, [path])
+    registry.get('second', second, [path])
+    assert (first.calls, second.calls) == (2, 1)
+    registry.invalidate()
+    registry.get('first', first, [path])
+    registry.get('second', second, [path])
+    assert (first.calls, second.calls) == (3, 2)
+
+
+def test_concurrent_requests_load_once(tmp_path):
+    path = str(tmp_path / 'model.txt')
+    _touch(path, 'one', 10 ** 18)
+    registry, loader = ResourceRegistry(), _Loader(path)
+    started = threading.Barrier(8)
+    results = []
+
+    def request():
+        started.wait()
+        results.append(registry.get('model', loader, [path]))
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['one'] * 8
+    assert loader.calls == 1
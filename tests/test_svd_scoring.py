@@ -0,0 +1,180 @@
+"""
+
+    Tests of the vectorised SVD scoring.
+
+    Author: Explore Data Science Academy.
+
+    Description: `SVDFactors.score` must reproduce surprise's
+    `SVD.predict`, including unknown users and items (user-002);
+    `fold_in` must solve the same ridge regression as its primal form
+    (user-013); and the online updates must only ever overlay rows on the
+    base arrays, with `partial_fit` matching surprise's sequential SGD
+    when it takes one rating at a time (user-023).
+
+"""
+
+# Script dependencies
+import numpy as np
+import pandas as pd
+import pytest
+from surprise import SVD, Dataset, Reader
+from recommenders.svd_scoring import RowOverlay, SVDFactors
+
+
+def _factors(rng, n_users=6, n_items=9, n_factors=4, biased=True):
+    """Random factors of a small model."""
+    return SVDFactors(pu=rng.normal(size=(n_users, n_factors)),
+                      qi=rng.normal(size=(n_items, n_factors)),
+                      bu=rng.normal(size=n_users),
+                      bi=rng.normal(size=n_items),
+                      global_mean=3.5,
+                      user_ids=np.arange(n_users) * 10,
+                      item_ids=np.arange(n_items) * 100,
+                      rating_scale=(0.5, 5.0), biased=biased)
+
+
+# user-002: estimates of SVD.predict
+
+@pytest.mark.parametrize('biased', [True, False])
+def test_score_matches_surprise_predict(biased):
+    rng = np.random.default_rng(int(biased))
+    ratings = pd.DataFrame({'userId': rng.integers(0, 15, 300),
+                            'movieId': rng.integers(0, 25, 300),
+                            'rating': rng.integers(1, 11, 300) / 2})
+    ratings = ratings.drop_duplicates(['userId', 'movieId'])
+    trainset = Dataset.load_from_df(
+        ratings, Reader(rating_scale=(0.5, 5.0))).build_full_trainset()
+    model = SVD(n_factors=5, n_epochs=5, biased=biased, random_state=0)
+    model.fit(trainset)
+    factors = SVDFactors.from_surprise(model)
+
+    # Raw ids 99 and 999 are unknown to the model
+    user_ids, item_ids = [0, 3, 14, 99], [0, 7, 24, 999]
+    est = factors.score(factors.user_index(user_ids),
+                        factors.item_index(item_ids))
+    expected = [[model.predict(user_id, item_id).est for item_id in item_ids]
+                for user_id in user_ids]
+    assert np.allclose(est, expected)
+
+
+# user-013: fold-in of a new user
+
+@pytest.mark.parametrize('biased', [True, False])
+@pytest.mark.parametrize('n_ratings', [1, 3, 12])
+def test_fold_in_matches_primal_ridge_solve(n_ratings, biased):
+    rng = np.random.default_rng(n_ratings)
+    factors = _factors(rng, n_items=12, biased=biased)
+    items = rng.choice(12, n_ratings, replace=False)
+    ratings = rng.integers(1, 11, n_ratings) / 2
+    reg = 0.1
+    bias, vector = factors.fold_in(items, ratings, reg=reg)
+
+    # Normal equations over [b_u, p_u], or p_u alone when unbiased
+    design = factors.qi[items]
+    residual = ratings - factors.global_mean
+    if biased:
+        design = np.hstack([np.ones((n_ratings, 1)), design])
+        residual = residual - factors.bi[items]
+    weights = np.linalg.solve(design.T @ design
+                              + reg * np.eye(design.shape[1]),
+                              design.T @ residual)
+    expected_bias, expected_vector = ((weights[0], weights[1:]) if biased
+                                      else (0.0, weights))
+    assert np.isclose(bias, expected_bias)
+    assert np.allclose(vector, expected_vector)
+
+
+def test_score_user_matches_score_of_added_user():
+    rng = np.random.default_rng(0)
+    factors = _factors(rng)
+    items = np.array([1, 4, 8])
+    ratings = np.array([4.0, 2.5, 5.0])
+    bias, vector = factors.fold_in(items, ratings)
+    added = factors.add_users([7], [items], [ratings])
+    item_inner = np.array([0, 3, -1, 8])
+    expected = added.score(added.user_index([7]), item_inner)[0]
+    assert np.allclose(factors.clip(factors.score_user(bias, vector,
+                                                       item_inner)),
+                       expected)
+
+
+# user-023: row overlays and partial_fit
+
+def test_row_overlay_matches_dense_array():
+    rng = np.random.default_rng(0)
+    base = rng.normal(size=(8, 3))
+    overlay = RowOverlay.over(base, [9, 2, 8], rng.normal(size=(3, 3)))
+    overlay = RowOverlay.over(overlay, [2, 5], rng.normal(size=(2, 3)))
+    dense = np.array(overlay)
+
+    assert overlay.shape == dense.shape == (10, 3)
+    assert np.array_equal(dense[:8][[0, 1, 3, 4, 6, 7]],
+                          base[[0, 1, 3, 4, 6, 7]])
+    for key in [0, 5, -1, slice(1, 9, 3), np.array([9, 2, 2, 0])]:
+        assert np.array_equal(overlay[key], dense[key])
+    vector = rng.normal(size=3)
+    assert np.allclose(overlay @ vector, dense @ vector)
+    with pytest.raises(IndexError):
+        overlay[np.array([10])]
+
+
+def test_updates_leave_the_base_factors_unchanged():
+    rng = np.random.default_rng(0)
+    factors = _factors(rng)
+    pu, qi = factors.pu.copy(), factors.qi.copy()
+    added = factors.add_users([7, 8], [np.array([1, 2]), np.array([3])],
+                              [np.array([4.0, 3.0]), np.array([1.0])])
+    fitted = added.partial_fit(added.user_index([7, 0]), [2, 5], [5.0, 1.0])
+
+    assert np.array_equal(factors.pu, pu) and np.array_equal(factors.qi, qi)
+    assert factors.user_index([7, 8]).tolist() == [-1, -1]
+    assert fitted.user_index([7, 8, 0]).tolist() == [6, 7, 0]
+    assert isinstance(fitted.pu, RowOverlay)
+    assert fitted.pu.base is factors.pu
+    assert fitted.pu.rows.tolist() == [0, 6, 7]
+    assert fitted.qi.rows.tolist() == [2, 5]
+
+
+def _sequential_sgd(factors, users, items, ratings, n_epochs, lr, reg):
+    """Reference: surprise's SGD, one rating at a time."""
+    pu, qi = np.array(factors.pu), np.array(factors.qi)
+    bu, bi = np.array(factors.bu), np.array(factors.bi)
+    for _ in range(n_epochs):
+        for u, i, rating in zip(users, items, ratings):
+            err = rating - (factors.global_mean + bu[u] + bi[i]
+                            + qi[i] @ pu[u])
+            bu[u] += lr * (err - reg * bu[u])
+            bi[i] += lr * (err - reg * bi[i])
+            pu[u], qi[i] = (pu[u] + lr * (err * qi[i] - reg * pu[u]),
+                            qi[i] + lr * (err * pu[u] - reg * qi[i]))
+    return pu, qi, bu, bi
+
+
+def test_partial_fit_of_single_ratings_is_sequential_sgd():
+    rng = np.random.default_rng(0)
+    factors = _factors(rng)
+    users = rng.integers(0, 6, 40)
+    items = rng.integers(0, 9, 40)
+    ratings = rng.integers(1, 11, 40) / 2
+    fitted = factors.partial_fit(users, items, ratings, n_epochs=3,
+                                 lr=0.01, reg=0.02, batch_size=1)
+    pu, qi, bu, bi = _sequential_sgd(factors, users, items, ratings,
+                                     n_epochs=3, lr=0.01, reg=0.02)
+    assert np.allclose(np.array(fitted.pu), pu)
+    assert np.allclose(np.array(fitted.qi), qi)
+    assert np.allclose(np.array(fitted.bu), bu)
+    assert np.allclose(np.array(fitted.bi), bi)
+
+
+def test_partial_fit_batches_reduce_the_error():
+    rng = np.random.default_rng(1)
+    factors = _factors(rng)
+    users = rng.integers(0, 6, 200)
+    items = rng.integers(0, 9, 200)
+    ratings = rng.integers(1, 11, 200) / 2
+
+    def error(model):
+        est = model.score(users, items)[np.arange(200), np.arange(200)]
+        return np.mean((est - ratings) ** 2)
+    fitted = factors.partial_fit(users, items, ratings, n_epochs=20)
+    assert error(fitted) < error(factors)
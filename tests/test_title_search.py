@@ -0,0 +1,112 @@
+"""
+
+    Tests of the title search.
+
+    Author: Explore Data Science Academy.
+
+    Description: Queries must match titles exactly, as prefixes, word by
+    word and, failing those, through misspelt words, in that order, the
+    most rated movies first within each level (user-024). The bounded
+    edit distance used for misspellings must agree with a plain dynamic
+    programme.
+
+"""
+
+# Script dependencies
+import numpy as np
+import pytest
+from utils.title_search import TitleIndex, _edit_distance
+
+TITLES = ['Matrix, The (1999)', 'Matrix Reloaded, The (2003)',
+          'Matrix Revolutions, The (2003)', 'Heat (1995)', 'Heat (1986)',
+          'Shawshank Redemption, The (1994)', 'Toy Story (1995)',
+          'Toy Story 2 (1999)', 'Amélie (Fabuleux destin d\'Amélie '
+          'Poulain, Le) (2001)', 'Heathers (1989)']
+COUNTS = np.array([90, 40, 30, 50, 5, 80, 70, 60, 20, 10])
+
+
+@pytest.fixture(scope='module')
+def index():
+    return TitleIndex(TITLES, COUNTS)
+
+
+def _titles(index, query, limit=20):
+    return [TITLES[row] for row in index.search(query, limit=limit)]
+
+
+def _osa_distance(first, second):
+    """Reference: edit distance with swaps of adjacent letters."""
+    d = np.zeros((len(first) + 1, len(second) + 1), dtype=int)
+    d[:, 0], d[0, :] = np.arange(len(first) + 1), np.arange(len(second) + 1)
+    for i in range(1, len(first) + 1):
+        for j in range(1, len(second) + 1):
+            d[i, j] = min(d[i - 1, j] + 1, d[i, j - 1] + 1,
+                          d[i - 1, j - 1] + (first[i - 1] != second[j - 1]))
+            if (i > 1 and j > 1 and first[i - 1] == second[j - 2]
+                    and first[i - 2] == second[j - 1]):
+                d[i, j] = min(d[i, j], d[i - 2, j - 2] + 1)
+    return d[-1, -1]
+
+
+# user-024: search levels
+
+def test_exact_and_prefix_matches(index):
+    assert _titles(index, 'the matrix')[0] == 'Matrix, The (1999)'
+    assert _titles(index, 'Matrix, The (1999)')[0] == 'Matrix, The (1999)'
+    assert _titles(index, 'the mat') == ['Matrix, The (1999)',
+                                         'Matrix Reloaded, The (2003)',
+                                         'Matrix Revolutions, The (2003)']
+    # Exact matches first, then the more rated of the prefix matches
+    assert _titles(index, 'heat') == ['Heat (1995)', 'Heat (1986)',
+                                      'Heathers (1989)']
+
+
+def test_year_restricts_matches(index):
+    assert _titles(index, 'heat 1986')[0] == 'Heat (1986)'
+    assert _titles(index, 'Heat (1986)')[0] == 'Heat (1986)'
+
+
+def test_words_in_any_order(index):
+    assert _titles(index, 'reloaded ma') == ['Matrix Reloaded, The (2003)']
+    assert _titles(index, 'story 1999') == ['Toy Story 2 (1999)']
+    assert _titles(index, 'amelie')[0].startswith('Amélie')
+
+
+@pytest.mark.parametrize('query, title', [
+    ('matirx', 'Matrix, The (1999)'),
+    ('shawshenk redemtion', 'Shawshank Redemption, The (1994)'),
+    ('toy stroy', 'Toy Story (1995)'),
+    ('revolutons', 'Matrix Revolutions, The (2003)'),
+])
+def test_misspelt_words(index, query, title):
+    assert _titles(index, query)[0] == title
+
+
+def test_unmatched_and_empty_queries(index):
+    assert _titles(index, 'qwxz') == []
+    # Words matching nothing, even misspelt, are ignored
+    assert _titles(index, 'toy qwxz') == ['Toy Story (1995)',
+                                          'Toy Story 2 (1999)']
+    assert index.search('', limit=3) == [0, 5, 6]
+    assert len(index.search('the', limit=2)) == 2
+
+
+def test_close_words_within_bound(index):
+    words = [index.words[position] for position in index.close_words('heet')]
+    assert words == ['heat']
+    assert index.close_words('xyzzy') == []
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_edit_distance_matches_dynamic_programme(seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(200):
+        first = ''.join(rng.choice(list('abcd'), rng.integers(1, 10)))
+        second = ''.join(rng.choice(list('abcd'), rng.integers(1, 10)))
+        expected = _osa_distance(first, second)
+        for bound in (1, 2):
+            distance = _edit_distance(first, second, bound)
+            if expected <= bound:
+                assert distance == expected
+            else:
+                assert distance > bound
@@ -0,0 +1,86 @@
+"""
+
+    Tests of the top-k helpers.
+
+    Author: Explore Data Science Academy.
+
+    Description: Every helper of `utils.topk` must return exactly what a
+    stable descending sort truncated to k entries returns. The scores are
+    drawn from a few distinct values so that ties are common, and include
+    -inf (masked movies); k ranges from 0 to beyond the number of scores.
+
+"""
+
+# Script dependencies
+import numpy as np
+import pytest
+from utils.topk import top_k, top_k_rows, merge_top_k
+
+
+def _scores(rng, shape, n_distinct):
+    """Random scores with repeated values and a few -inf ones."""
+    values = rng.integers(0, n_distinct, size=shape).astype(np.float64)
+    values[rng.random(shape) < 0.1] = -np.inf
+    return values
+
+
+def _sorted_top_k(values, k, ties=None):
+    """Reference: full stable descending sort, truncated."""
+    if ties is None:
+        return np.argsort(-values, kind='stable')[:k]
+    return np.lexsort((np.arange(len(values)), ties, -values))[:k]
+
+
+@pytest.mark.parametrize('n_distinct', [1, 3, 50])
+@pytest.mark.parametrize('k', [0, 1, 7, 40, 41, 100])
+def test_top_k_matches_stable_sort(k, n_distinct):
+    rng = np.random.default_rng(k * 100 + n_distinct)
+    values = _scores(rng, 40, n_distinct)
+    assert np.array_equal(top_k(values, k), _sorted_top_k(values, k))
+
+
+@pytest.mark.parametrize('k', [0, 1, 7, 40, 100])
+def test_top_k_breaks_ties_on_key(k):
+    rng = np.random.default_rng(k)
+    values = _scores(rng, 40, 3)
+    ties = rng.permutation(40)
+    assert np.array_equal(top_k(values, k, ties=ties),
+                          _sorted_top_k(values, k, ties))
+
+
+def test_top_k_keeps_inf_scores_last():
+    values = np.array([-np.inf, 1.0, -np.inf, 2.0])
+    assert top_k(values, 4).tolist() == [3, 1, 0, 2]
+    assert top_k(values, -1).tolist() == []
+    assert top_k(np.array([]), 3).tolist() == []
+
+
+@pytest.mark.parametrize('n_distinct', [1, 3, 50])
+@pytest.mark.parametrize('k', [0, 1, 7, 30, 31, 100])
+def test_top_k_rows_matches_stable_sort(k, n_distinct):
+    rng = np.random.default_rng(k * 100 + n_distinct)
+    matrix = _scores(rng, (12, 30), n_distinct)
+    columns, scores = top_k_rows(matrix, k)
+    expected = np.argsort(-matrix, axis=1, kind='stable')[:, :k]
+    assert np.array_equal(columns, expected)
+    assert np.array_equal(scores, np.take_along_axis(matrix, expected,
+                                                     axis=1))
+
+
+@pytest.mark.parametrize('block_rows', [1, 7, 64])
+@pytest.mark.parametrize('k', [0, 1, 7, 50, 100])
+def test_merge_top_k_matches_stable_sort(k, block_rows):
+    rng = np.random.default_rng(k * 100 + block_rows)
+    matrix = _scores(rng, (50, 4), 3)
+    blocks = (matrix[start:start + block_rows]
+              for start in range(0, len(matrix), block_rows))
+    merged = merge_top_k(blocks, k)
+    assert len(merged) == matrix.shape[1]
+    for column, (rows, scores) in enumerate(merged):
+        expected = _sorted_top_k(matrix[:, column], k)
+        assert np.array_equal(rows, expected)
+        assert np.array_equal(scores, matrix[expected, column])
+
+
+def test_merge_top_k_of_no_blocks():
+    assert merge_top_k(iter([]), 5) == []
@@ -0,0 +1,214 @@
+"""
+
+    Shared movie catalogue index.
+
+    Author: Explore Data Science Academy.
+
+    Description: Hash-based lookups between movie titles, MovieLens movie
+    ids and catalogue row positions. The catalogue is built once per
+    process (see `utils.registry`) and used by every recommender, so that
+    resolving the app user's favourite movies is a dictionary lookup
+    rather than a scan over every title in the catalogue.
+
+    When serving from a shared snapshot (see `utils.shared_store`), the
+    catalogue is instead a set of memory-mapped arrays searched by
+    bisection, so worker processes do not each hold the titles and
+    lookup tables as Python objects.
+
+"""
+
+# Script dependencies
+import bisect
+import numpy as np
+from utils.registry import registry
+from utils.data_store import MOVIES_PATH, encode_strings, load_movies
+from utils.shared_store import shared_resource
+
+
+class MovieCatalogue:
+    """Row-aligned arrays of movie attributes plus lookup tables.
+
+    Rows are positions within the movies file after dropping incomplete
+    records, and are the row numbers used by every precomputed index.
+
+    Parameters
+    ----------
+    movies : Pandas Dataframe
+        Movie records with `movieId`, `title` and `genres` columns.
+
+    """
+
+    def __init__(self, movies):
+        movies = movies.dropna().reset_index(drop=True)
+        self.movies = movies
+        self.titles = movies['title'].to_numpy()
+        self.movie_ids = movies['movieId'].to_numpy()
+        self.genres = movies['genres'].astype(str).to_numpy()
+        self._id_rows = {movie_id: row
+                         for row, movie_id in enumerate(self.movie_ids)}
+        # A handful of titles (e.g. 'Aladdin (1992)') appear more than once.
+        # Lookups by title resolve to the first row, which is also the
+        # entry with the lowest movieId; every row is kept in `_title_rows`.
+        self._title_rows = {}
+        for row, title in enumerate(self.titles):
+            self._title_rows.setdefault(title, []).append(row)
+
+    def __len__(self):
+        return len(self.titles)
+
+    def row_of_title(self, title):
+        """Catalogue row of a title, or None if the title is unknown."""
+        rows = self._title_rows.get(title)
+        return rows[0] if rows else None
+
+    def rows_of_title(self, title):
+        """Every catalogue row carrying a (possibly duplicated) title."""
+        return list(self._title_rows.get(title, []))
+
+    def row_of_movie_id(self, movie_id):
+        """Catalogue row of a movieId, or None if the id is unknown."""
+        return self._id_rows.get(movie_id)
+
+    def rows_of_titles(self, titles):
+        """Resolve a list of titles to catalogue rows.
+
+        Parameters
+        ----------
+        titles : list (str)
+            Movie titles, e.g. the favourites chosen by the app user.
+
+        Returns
+        -------
+        list (int)
+            Rows of the known titles, in the given order. Unknown titles
+            are skipped and repeated titles only appear once.
+
+        """
+        rows = []
+        for title in titles:
+            row = self.row_of_title(title)
+            if row is not None and row not in rows:
+                rows.append(row)
+        return rows
+
+    def titles_of(self, rows):
+        """Titles of the given catalogue rows."""
+        return self.titles[np.asarray(rows, dtype=np.int64)].tolist()
+
+    def movie_ids_of(self, rows):
+        """movieIds of the given catalogue rows."""
+        return self.movie_ids[np.asarray(rows, dtype=np.int64)].tolist()
+
+
+class _Strings:
+    """Read-only sequence of strings stored as UTF-8 bytes plus offsets."""
+
+    def __init__(self, data, offsets):
+        # Memoryviews slice far faster than (memory-mapped) arrays
+        self.data = memoryview(np.ascontiguousarray(data))
+        self.offsets = memoryview(np.ascontiguousarray(offsets))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def encoded(self, row):
+        return self.data[self.offsets[row]:self.offsets[row + 1]].tobytes()
+
+    def __getitem__(self, row):
+        return self.encoded(row).decode('utf-8')
+
+    def __iter__(self):
+        return (self[row] for row in range(len(self)))
+
+
+class SharedCatalogue(MovieCatalogue):
+    """Catalogue over flat arrays, e.g. memory-mapped from a snapshot.
+
+    Titles are found by bisection over the rows sorted by title, and
+    movieIds by bisection over the sorted ids, giving the same results as
+    `MovieCatalogue` without any per-process lookup tables.
+
+    Parameters
+    ----------
+    movie_ids : numpy.ndarray
+        movieId of every row.
+    title_data, title_offsets : numpy.ndarray
+        Titles, see `utils.data_store.encode_strings`.
+    genre_data, genre_offsets : numpy.ndarray
+        '|'-separated genres, see `utils.data_store.encode_strings`.
+    title_order : numpy.ndarray
+        Rows sorted by (UTF-8 encoded title, row).
+    id_order : numpy.ndarray
+        Rows sorted by (movieId, row).
+
+    """
+
+    def __init__(self, movie_ids, title_data, title_offsets, genre_data,
+                 genre_offsets, title_order, id_order):
+        self.movie_ids = movie_ids
+        self.titles = _Strings(title_data, title_offsets)
+        self.genres = _Strings(genre_data, genre_offsets)
+        self.title_order = title_order
+        self.id_order = id_order
+        self.sorted_ids = movie_ids[id_order]
+
+    @classmethod
+    def arrays_of(cls, catalogue):
+        """Arrays of a `MovieCatalogue`, as taken by the constructor."""
+        title_data, title_offsets = encode_strings(catalogue.titles)
+        genre_data, genre_offsets = encode_strings(catalogue.genres)
+        encoded = [title.encode('utf-8') for title in catalogue.titles]
+        return {'movie_ids': catalogue.movie_ids,
+                'title_data': title_data, 'title_offsets': title_offsets,
+                'genre_data': genre_data, 'genre_offsets': genre_offsets,
+                'title_order': np.array(sorted(range(len(encoded)),
+                                               key=encoded.__getitem__),
+                                        dtype=np.int64),
+                'id_order': np.argsort(catalogue.movie_ids, kind='stable')}
+
+    def rows_of_title(self, title):
+        key = title.encode('utf-8')
+        start = bisect.bisect_left(self.title_order, key,
+                                   key=self.titles.encoded)
+        stop = bisect.bisect_right(self.title_order, key, lo=start,
+                                   key=self.titles.encoded)
+        return [int(row) for row in self.title_order[start:stop]]
+
+    def row_of_title(self, title):
+        rows = self.rows_of_title(title)
+        return rows[0] if rows else None
+
+    def row_of_movie_id(self, movie_id):
+        position = np.searchsorted(self.sorted_ids, movie_id)
+        if (position < len(self.sorted_ids)
+                and self.sorted_ids[position] == movie_id):
+            return int(self.id_order[position])
+        return None
+
+    def titles_of(self, rows):
+        return [self.titles[row] for row in rows]
+
+
+def get_catalogue(path_to_movies=MOVIES_PATH):
+    """Movie catalogue shared by every recommender in the process.
+
+    Parameters
+    ----------
+    path_to_movies : str
+        Path to the movie database stored in .csv format.
+
+    Returns
+    -------
+    MovieCatalogue
+        Catalogue index, rebuilt whenever the movies file changes, or a
+        `SharedCatalogue` when serving from a shared snapshot.
+
+    """
+    shared = shared_resource('catalogue', [path_to_movies], SharedCatalogue)
+    if shared is not None:
+        return shared
+
+    def load():
+        return MovieCatalogue(load_movies(path_to_movies))
+    return registry.get(('catalogue', path_to_movies), load,
+                        [path_to_movies])
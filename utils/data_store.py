@@ -0,0 +1,371 @@
+"""
+
+    Columnar binary cache of the movie and rating data.
+
+    Author: Explore Data Science Academy.
+
+    Description: Parsing the .csv files is by far the slowest part of
+    loading the data, so the first time a file is read it is converted
+    into one compact NumPy array per column:
+
+        int32    ids
+        float32  ratings
+        int64    timestamps
+        category codes plus a list of categories for genres
+        UTF-8 bytes plus offsets for titles
+
+    The arrays live in `<data dir>/.cache/<file>-<checksum>/`, keyed by the
+    SHA-1 of the source file, so editing a .csv transparently triggers a
+    fresh conversion. Subsequent loads read the arrays back instead of
+    parsing text, and the resulting DataFrames are shared by every module
+    through `utils.registry`. The shared frames must be treated as read-only;
+    take a `.copy()` before adding or modifying columns.
+
+    Files with only numeric columns, such as the ratings, are converted
+    chunk by chunk (see `utils.ingest`), so files larger than memory can
+    be cached. `rating_columns` gives direct access to the memory-mapped
+    rating arrays, for passes that should not materialise a DataFrame.
+
+"""
+
+# Script dependencies
+import os
+import json
+import errno
+import logging
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+from utils.registry import registry
+
+logger = logging.getLogger(__name__)
+
+# Location of the data files. Can be pointed elsewhere (e.g. at a larger
+# MovieLens download) through the RECOMMENDER_DATA_DIR environment variable.
+DATA_DIR = os.environ.get('RECOMMENDER_DATA_DIR', 'resources/data')
+MOVIES_PATH = os.path.join(DATA_DIR, 'movies.csv')
+RATINGS_PATH = os.path.join(DATA_DIR, 'ratings.csv')
+
+MOVIES_SCHEMA = {'movieId': 'int32', 'title': 'str', 'genres': 'category'}
+RATINGS_SCHEMA = {'userId': 'int32', 'movieId': 'int32',
+                  'rating': 'float32', 'timestamp': 'int64'}
+
+# Bump whenever the on-disk layout below changes
+CACHE_VERSION = 1
+
+
+def file_checksum(path, block_size=1 << 20):
+    """SHA-1 hex digest of a file's contents."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_checksum(path):
+    """`file_checksum` of a file, recomputed only when the file changes,
+    or None if there is no such file."""
+    def load():
+        try:
+            return file_checksum(path)
+        except FileNotFoundError:
+            return None
+    return registry.get(('checksum', path), load, [path])
+
+
+def cache_dir(path):
+    """Directory holding the columnar cache of a .csv file."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(os.path.dirname(path), '.cache',
+                        f'{stem}-{file_checksum(path)[:16]}')
+
+
+def encode_strings(values):
+    """Strings as one array of UTF-8 bytes plus the offset of each string
+    within it (of length `len(values) + 1`)."""
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def _write_strings(directory, name, values):
+    blob, offsets = encode_strings(values)
+    np.save(os.path.join(directory, f'{name}.bytes.npy'), blob)
+    np.save(os.path.join(directory, f'{name}.offsets.npy'), offsets)
+
+
+def _read_strings(directory, name):
+    blob = np.load(os.path.join(directory, f'{name}.bytes.npy'),
+                   mmap_mode='r').tobytes()
+    offsets = np.load(os.path.join(directory, f'{name}.offsets.npy'))
+    return [blob[start:stop].decode('utf-8')
+            for start, stop in zip(offsets[:-1], offsets[1:])]
+
+
+def write_columns(frame, schema, directory):
+    """Store the columns of a DataFrame as NumPy arrays.
+
+    Parameters
+    ----------
+    frame : Pandas Dataframe
+        Data to store.
+    schema : dict
+        Column name to storage type: a NumPy dtype, 'str' or 'category'.
+    directory : str
+        Directory to write the arrays and `meta.json` into.
+
+    """
+    os.makedirs(directory, exist_ok=True)
+    meta = {'version': CACHE_VERSION, 'rows': len(frame), 'columns': {}}
+    for column, kind in schema.items():
+        values = frame[column]
+        if kind == 'str':
+            _write_strings(directory, column, values.astype(str))
+            meta['columns'][column] = {'kind': 'str'}
+        elif kind == 'category':
+            values = values.astype('category')
+            codes = values.cat.codes.to_numpy().astype(np.int32)
+            np.save(os.path.join(directory, f'{column}.npy'), codes)
+            meta['columns'][column] = {
+                'kind': 'category',
+                'categories': values.cat.categories.tolist()}
+        else:
+            np.save(os.path.join(directory, f'{column}.npy'),
+                    values.to_numpy().astype(kind))
+            meta['columns'][column] = {'kind': kind}
+    with open(os.path.join(directory, 'meta.json'), 'w') as meta_file:
+        json.dump(meta, meta_file)
+
+
+def stream_columns(path, schema, directory, chunksize=None, verbose=True):
+    """Store the numeric columns of a .csv file as NumPy arrays, parsing
+    the file one chunk at a time.
+
+    Each chunk is appended to a raw file per column; once the number of
+    rows is known, the raw files are copied block by block into .npy
+    arrays. Memory use is bounded by the chunk size.
+
+    Parameters
+    ----------
+    path : str
+        Path to the .csv file.
+    schema : dict
+        Column name to NumPy dtype.
+    directory : str
+        Directory to write the arrays and `meta.json` into.
+    chunksize : int, optional
+        Rows per chunk. Defaults to `utils.ingest.CHUNK_ROWS`.
+    verbose : bool
+        Report progress.
+
+    """
+    from utils.ingest import CHUNK_ROWS, blocks, read_csv_chunks
+    chunksize = chunksize or CHUNK_ROWS
+    os.makedirs(directory, exist_ok=True)
+    parts = {column: os.path.join(directory, f'{column}.part')
+             for column in schema}
+    files = {column: open(part, 'wb') for column, part in parts.items()}
+    rows = 0
+    try:
+        for chunk in read_csv_chunks(path, schema, chunksize, verbose):
+            for column, kind in schema.items():
+                files[column].write(
+                    chunk[column].to_numpy().astype(kind, copy=False)
+                    .tobytes())
+            rows += len(chunk)
+    finally:
+        for part_file in files.values():
+            part_file.close()
+
+    meta = {'version': CACHE_VERSION, 'rows': rows, 'columns': {}}
+    for column, kind in schema.items():
+        target = os.path.join(directory, f'{column}.npy')
+        if rows == 0:
+            np.save(target, np.empty(0, dtype=kind))
+        else:
+            raw = np.memmap(parts[column], dtype=kind, mode='r',
+                            shape=(rows,))
+            array = np.lib.format.open_memmap(target, mode='w+', dtype=kind,
+                                              shape=(rows,))
+            for block in blocks(rows, chunksize):
+                array[block] = raw[block]
+            array.flush()
+            del raw, array
+        os.remove(parts[column])
+        meta['columns'][column] = {'kind': kind}
+    with open(os.path.join(directory, 'meta.json'), 'w') as meta_file:
+        json.dump(meta, meta_file)
+
+
+def read_arrays(directory):
+    """Memory-map the numeric columns stored in a cache directory.
+
+    Unlike `read_columns`, no DataFrame is built, so the arrays are never
+    copied into memory.
+
+    Parameters
+    ----------
+    directory : str
+        Directory holding the arrays and `meta.json`.
+
+    Returns
+    -------
+    dict
+        Column name to read-only memory-mapped array.
+
+    """
+    with open(os.path.join(directory, 'meta.json')) as meta_file:
+        meta = json.load(meta_file)
+    if meta.get('version') != CACHE_VERSION:
+        raise ValueError(f'Unsupported cache version in: {directory}')
+    return {column: np.load(os.path.join(directory, f'{column}.npy'),
+                            mmap_mode='r')
+            for column, info in meta['columns'].items()
+            if info['kind'] not in ('str', 'category')}
+
+
+def read_columns(directory):
+    """Load a DataFrame stored by `write_columns`.
+
+    The arrays are memory-mapped, but building the DataFrame copies them
+    into memory; use `rating_columns` to scan the ratings without a copy.
+
+    Parameters
+    ----------
+    directory : str
+        Directory holding the arrays and `meta.json`.
+
+    Returns
+    -------
+    Pandas Dataframe
+        The stored data.
+
+    """
+    with open(os.path.join(directory, 'meta.json')) as meta_file:
+        meta = json.load(meta_file)
+    if meta.get('version') != CACHE_VERSION:
+        raise ValueError(f'Unsupported cache version in: {directory}')
+    columns = {}
+    for column, info in meta['columns'].items():
+        if info['kind'] == 'str':
+            columns[column] = _read_strings(directory, column)
+        elif info['kind'] == 'category':
+            codes = np.load(os.path.join(directory, f'{column}.npy'),
+                            mmap_mode='r')
+            columns[column] = pd.Categorical.from_codes(
+                codes, categories=info['categories'])
+        else:
+            columns[column] = np.load(os.path.join(directory, f'{column}.npy'),
+                                      mmap_mode='r')
+    return pd.DataFrame(columns)
+
+
+def convert_csv(path, schema):
+    """Convert a .csv file into its columnar cache, if not done already.
+
+    Parameters
+    ----------
+    path : str
+        Path to the .csv file.
+    schema : dict
+        Column name to storage type, see `write_columns`.
+
+    Returns
+    -------
+    str
+        Directory holding the cached columns.
+
+    """
+    directory = cache_dir(path)
+    if os.path.exists(os.path.join(directory, 'meta.json')):
+        return directory
+    # Build in a scratch directory and move it into place in one step,
+    # so a concurrent reader never sees a half-written cache.
+    parent = os.path.dirname(directory)
+    os.makedirs(parent, exist_ok=True)
+    scratch = tempfile.mkdtemp(dir=parent)
+    try:
+        if all(kind not in ('str', 'category') for kind in schema.values()):
+            stream_columns(path, schema, scratch)
+        else:
+            frame = pd.read_csv(path, usecols=list(schema))
+            if 'title' in frame:
+                frame = frame.dropna().reset_index(drop=True)
+            write_columns(frame, schema, scratch)
+        os.replace(scratch, directory)
+    except OSError as error:
+        shutil.rmtree(scratch, ignore_errors=True)
+        if error.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+            raise
+        # Another process finished the same conversion first
+        logger.info('%s was already converted into %s', path, directory)
+    except Exception:
+        shutil.rmtree(scratch, ignore_errors=True)
+        raise
+    return directory
+
+
+def load_movies(path_to_movies=MOVIES_PATH):
+    """Movie records shared by every module in the process.
+
+    Incomplete records are dropped and rows are numbered 0..n-1; these
+    row numbers are the catalogue rows used by every precomputed index.
+
+    Parameters
+    ----------
+    path_to_movies : str
+        Path to the movies database stored in .csv format.
+
+    Returns
+    -------
+    Pandas Dataframe
+        Read-only movieId, title and genres columns.
+
+    """
+    def load():
+        return read_columns(convert_csv(path_to_movies, MOVIES_SCHEMA))
+    return registry.get(('movies', path_to_movies), load, [path_to_movies])
+
+
+def load_ratings(path_to_ratings=RATINGS_PATH):
+    """Rating records shared by every module in the process.
+
+    Parameters
+    ----------
+    path_to_ratings : str
+        Path to the ratings stored in .csv format.
+
+    Returns
+    -------
+    Pandas Dataframe
+        Read-only userId, movieId, rating and timestamp columns.
+
+    """
+    def load():
+        return read_columns(convert_csv(path_to_ratings, RATINGS_SCHEMA))
+    return registry.get(('ratings', path_to_ratings), load,
+                        [path_to_ratings])
+
+
+def rating_columns(path_to_ratings=RATINGS_PATH):
+    """Memory-mapped rating columns shared by every module in the process.
+
+    Parameters
+    ----------
+    path_to_ratings : str
+        Path to the ratings stored in .csv format.
+
+    Returns
+    -------
+    dict
+        Read-only userId, movieId, rating and timestamp arrays.
+
+    """
+    def load():
+        return read_arrays(convert_csv(path_to_ratings, RATINGS_SCHEMA))
+    return registry.get(('rating_columns', path_to_ratings), load,
+                        [path_to_ratings])
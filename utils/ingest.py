@@ -0,0 +1,277 @@
+"""
+
+    Streaming ingestion of rating data in bounded memory.
+
+    Author: Explore Data Science Academy.
+
+    Description: A single `pd.read_csv` of the full MovieLens ratings file
+    (25M rows) needs several GB for the parsed frame alone, before any
+    index is built from it. Everything here works through the data in
+    fixed-size blocks instead:
+
+    * `read_csv_chunks` parses a .csv file chunk by chunk, straight into
+      int32/float32 columns, reporting progress as it goes. It is used by
+      `utils.data_store` to build the columnar cache of the ratings.
+    * `build_csr`, `item_statistics` and `build_trainset` then make
+      passes over the memory-mapped cache columns (see
+      `utils.data_store.rating_columns`) one block at a time, so besides
+      their outputs they only ever hold one block in memory.
+
+    Blocks default to one million rows, which keeps each block's
+    temporaries to a few tens of MB.
+
+"""
+
+# Script dependencies
+import os
+import time
+import numpy as np
+import pandas as pd
+from collections import defaultdict
+
+# Rows per chunk of .csv parsing and per block of an array pass
+CHUNK_ROWS = 1_000_000
+
+
+class Progress:
+    """Print the progress of a long pass, at most every `interval` seconds.
+
+    Parameters
+    ----------
+    label : str
+        Name of the pass, e.g. the file being read.
+    interval : float
+        Minimum number of seconds between two reports.
+    verbose : bool
+        Report at all.
+
+    """
+
+    def __init__(self, label, interval=5.0, verbose=True):
+        self.label = label
+        self.interval = interval
+        self.verbose = verbose
+        self.rows = 0
+        self.start = self.last = time.perf_counter()
+
+    def update(self, rows, fraction=None):
+        """Record `rows` more rows; `fraction` is the share done so far."""
+        self.rows += rows
+        now = time.perf_counter()
+        if self.verbose and now - self.last >= self.interval:
+            self.last = now
+            done = f' ({fraction:.0%})' if fraction is not None else ''
+            print(f'{self.label}: {self.rows:,} rows{done} '
+                  f'in {now - self.start:.1f}s')
+
+    def done(self):
+        """Report the totals of the pass."""
+        if self.verbose:
+            print(f'{self.label}: {self.rows:,} rows '
+                  f'in {time.perf_counter() - self.start:.1f}s')
+
+
+def read_csv_chunks(path, schema, chunksize=CHUNK_ROWS, verbose=True):
+    """Parse a .csv file chunk by chunk into compact dtypes.
+
+    Parameters
+    ----------
+    path : str
+        Path to the .csv file.
+    schema : dict
+        Column name to storage type. Numeric columns are parsed straight
+        into that dtype; 'str' and 'category' columns are left to pandas.
+    chunksize : int
+        Rows per chunk.
+    verbose : bool
+        Report progress.
+
+    Yields
+    ------
+    Pandas Dataframe
+        The next `chunksize` rows of the schema's columns.
+
+    """
+    dtypes = {column: kind for column, kind in schema.items()
+              if kind not in ('str', 'category')}
+    size = max(os.path.getsize(path), 1)
+    progress = Progress(os.path.basename(path), verbose=verbose)
+    with open(path, 'rb') as source:
+        for chunk in pd.read_csv(source, usecols=list(schema), dtype=dtypes,
+                                 chunksize=chunksize):
+            progress.update(len(chunk), min(source.tell() / size, 1.0))
+            yield chunk
+    progress.done()
+
+
+def blocks(n_rows, block_rows=CHUNK_ROWS):
+    """Consecutive slices covering `n_rows` rows."""
+    for start in range(0, n_rows, block_rows):
+        yield slice(start, min(start + block_rows, n_rows))
+
+
+def _join_rows(movie_ids, sorted_ids, order):
+    """Catalogue rows of movie ids, plus a mask of the known ones."""
+    positions = np.minimum(np.searchsorted(sorted_ids, movie_ids),
+                           len(sorted_ids) - 1)
+    known = sorted_ids[positions] == movie_ids
+    return order[positions], known
+
+
+def build_csr(user_ids, movie_ids, ratings, catalogue,
+              block_rows=CHUNK_ROWS):
+    """Group ratings by user, one block at a time.
+
+    A counting sort: one pass finds the users, one counts their ratings
+    and one scatters each block's ratings into place. Within a user,
+    ratings keep their order in the file. Ratings of movies missing from
+    the catalogue are dropped.
+
+    Parameters
+    ----------
+    user_ids, movie_ids, ratings : array-like
+        Columns of the ratings, e.g. memory-mapped cache columns.
+    catalogue : utils.catalogue.MovieCatalogue
+        Catalogue whose rows the ratings are joined to.
+    block_rows : int
+        Rows per block.
+
+    Returns
+    -------
+    tuple (numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        Sorted unique user ids, index pointer, and the int32 catalogue
+        rows and float32 values of the ratings, in CSR layout.
+
+    """
+    order = np.argsort(catalogue.movie_ids, kind='stable')
+    sorted_ids = catalogue.movie_ids[order]
+    n_rows = len(ratings)
+
+    # Pass 1: users with at least one rating of a known movie
+    seen = []
+    for block in blocks(n_rows, block_rows):
+        _, known = _join_rows(np.asarray(movie_ids[block]), sorted_ids, order)
+        seen.append(np.unique(np.asarray(user_ids[block])[known]))
+    users = np.unique(np.concatenate(seen)) if seen else np.array([], int)
+
+    # Pass 2: number of ratings per user
+    counts = np.zeros(len(users), dtype=np.int64)
+    for block in blocks(n_rows, block_rows):
+        _, known = _join_rows(np.asarray(movie_ids[block]), sorted_ids, order)
+        positions = np.searchsorted(users, np.asarray(user_ids[block])[known])
+        counts += np.bincount(positions, minlength=len(users))
+    indptr = np.zeros(len(users) + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+
+    # Pass 3: scatter every block's ratings after those already placed
+    item_rows = np.empty(indptr[-1], dtype=np.int32)
+    values = np.empty(indptr[-1], dtype=np.float32)
+    cursor = indptr[:-1].copy()
+    for block in blocks(n_rows, block_rows):
+        rows, known = _join_rows(np.asarray(movie_ids[block]), sorted_ids,
+                                 order)
+        positions = np.searchsorted(users, np.asarray(user_ids[block])[known])
+        by_user = np.argsort(positions, kind='stable')
+        grouped = positions[by_user]
+        # Rank of each rating among the block's ratings of the same user
+        rank = np.arange(len(grouped)) - np.searchsorted(grouped, grouped)
+        destination = cursor[grouped] + rank
+        item_rows[destination] = rows[known][by_user]
+        values[destination] = np.asarray(ratings[block])[known][by_user]
+        cursor += np.bincount(positions, minlength=len(users))
+    return users, indptr, item_rows, values
+
+
+def item_statistics(movie_ids, ratings, catalogue, block_rows=CHUNK_ROWS):
+    """Number of ratings and mean rating of every catalogue movie.
+
+    Parameters
+    ----------
+    movie_ids, ratings : array-like
+        Columns of the ratings, e.g. memory-mapped cache columns.
+    catalogue : utils.catalogue.MovieCatalogue
+        Catalogue whose rows the statistics are indexed by.
+    block_rows : int
+        Rows per block.
+
+    Returns
+    -------
+    tuple (numpy.ndarray, numpy.ndarray)
+        Rating count and mean rating (0 if unrated) per catalogue row.
+
+    """
+    order = np.argsort(catalogue.movie_ids, kind='stable')
+    sorted_ids = catalogue.movie_ids[order]
+    counts = np.zeros(len(catalogue), dtype=np.int64)
+    sums = np.zeros(len(catalogue))
+    for block in blocks(len(ratings), block_rows):
+        rows, known = _join_rows(np.asarray(movie_ids[block]), sorted_ids,
+                                 order)
+        counts += np.bincount(rows[known], minlength=len(catalogue))
+        sums += np.bincount(rows[known],
+                            weights=np.asarray(ratings[block])[known],
+                            minlength=len(catalogue))
+    means = np.divide(sums, counts, out=np.zeros(len(catalogue)),
+                      where=counts > 0)
+    return counts, means
+
+
+def build_trainset(user_ids, movie_ids, ratings, rating_scale=None,
+                   block_rows=CHUNK_ROWS, verbose=True):
+    """Build a surprise trainset directly from rating columns.
+
+    Equivalent to `Dataset.load_from_df(...).build_full_trainset()`, with
+    inner ids numbered in order of first appearance, but without the
+    intermediate DataFrame and list of raw rating tuples.
+
+    Parameters
+    ----------
+    user_ids, movie_ids, ratings : array-like
+        Columns of the ratings, e.g. memory-mapped cache columns.
+    rating_scale : tuple (float, float), optional
+        Rating scale of the trainset. Defaults to the lowest and highest
+        rating in the data.
+    block_rows : int
+        Rows per block.
+    verbose : bool
+        Report progress.
+
+    Returns
+    -------
+    surprise.Trainset
+        Trainset containing every rating.
+
+    """
+    from surprise import Trainset
+    raw2inner_users, raw2inner_items = {}, {}
+    ur, ir = defaultdict(list), defaultdict(list)
+    lowest, highest = np.inf, -np.inf
+    progress = Progress('trainset', verbose=verbose)
+
+    def inner_ids(raw, mapping):
+        # Number unseen ids in order of their first appearance
+        uniques, first, inverse = np.unique(raw, return_index=True,
+                                            return_inverse=True)
+        for position in np.argsort(first, kind='stable'):
+            mapping.setdefault(uniques[position].item(), len(mapping))
+        return np.array([mapping[raw_id] for raw_id in uniques.tolist()],
+                        dtype=np.int64)[inverse]
+
+    for block in blocks(len(ratings), block_rows):
+        values = np.asarray(ratings[block], dtype=np.float64)
+        users = inner_ids(np.asarray(user_ids[block]), raw2inner_users)
+        items = inner_ids(np.asarray(movie_ids[block]), raw2inner_items)
+        for u, i, r in zip(users.tolist(), items.tolist(), values.tolist()):
+            ur[u].append((i, r))
+            ir[i].append((u, r))
+        if len(values):
+            lowest = min(lowest, values.min())
+            highest = max(highest, values.max())
+        progress.update(len(values), block.stop / max(len(ratings), 1))
+    progress.done()
+    if rating_scale is None:
+        rating_scale = (lowest, highest)
+    return Trainset(ur, ir, len(raw2inner_users), len(raw2inner_items),
+                    len(ratings), rating_scale, raw2inner_users,
+                    raw2inner_items)
+
@@ -0,0 +1,296 @@
+"""
+
+    Incremental rating ingestion with online model updates.
+
+    Author: Explore Data Science Academy.
+
+    Description: New ratings are appended to a log (a SQLite database,
+    standing in for a production rating store) rather than to
+    `ratings.csv`. Every serving process polls the log and layers the
+    ratings it has not seen yet over the models built from the ratings
+    file, without a retrain or restart:
+
+    * the user -> ratings index gains the new ratings, a newer rating of
+      a movie replacing the user's older one;
+    * the popularity table's counts, Bayesian averages and top lists of
+      the rated movies are updated;
+    * the SVD factors of the rating users and rated movies take a few SGD
+      steps over the new ratings, users new to the model being folded in
+      first. Only those rows are held in memory; the others are shared
+      with the (memory-mapped) base model. Movies unknown to the model
+      are left to the popularity table.
+
+    Polling is a `stat` of the log file, so new ratings are picked up on
+    the first request after they are written. Each process replays the
+    same ratings in the same order from the same models, so every worker
+    ends up with the same updated state. The log is replayed over new
+    models too, e.g. after a new bundle generation is published.
+
+"""
+
+# Script dependencies
+import os
+import time
+import sqlite3
+import threading
+import numpy as np
+from utils.registry import registry
+from utils.data_store import DATA_DIR
+
+# Can be pointed elsewhere through the RECOMMENDER_RATING_LOG environment
+# variable.
+LOG_PATH = os.environ.get('RECOMMENDER_RATING_LOG',
+                          os.path.join(DATA_DIR, 'new_ratings.db'))
+# Valid ratings: half stars from 0.5 to 5, as in MovieLens
+RATING_SCALE = (0.5, 5.0)
+# SGD passes over each batch of new ratings
+SGD_EPOCHS = 10
+
+
+class RatingLog:
+    """Append-only log of ratings.
+
+    Parameters
+    ----------
+    path : str
+        Path to the SQLite database, created on the first append.
+
+    """
+
+    def __init__(self, path=LOG_PATH):
+        self.path = path
+
+    def _connect(self):
+        # One short-lived connection per call, so the log can be used from
+        # any thread or (forked) process
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute('CREATE TABLE IF NOT EXISTS ratings ('
+                           'seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                           'userId INTEGER NOT NULL, '
+                           'movieId INTEGER NOT NULL, '
+                           'rating REAL NOT NULL, '
+                           'timestamp INTEGER NOT NULL)')
+        return connection
+
+    def append(self, records):
+        """Append ratings to the log.
+
+        Parameters
+        ----------
+        records : list (tuple)
+            (userId, movieId, rating) of every new rating.
+
+        Returns
+        -------
+        int
+            Sequence number of the last appended rating.
+
+        """
+        lower_bound, higher_bound = RATING_SCALE
+        rows = []
+        for user_id, movie_id, rating in records:
+            if not lower_bound <= rating <= higher_bound or rating * 2 % 1:
+                raise ValueError(f'Invalid rating: {rating}')
+            rows.append((int(user_id), int(movie_id), float(rating),
+                         int(time.time())))
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(
+                    'INSERT INTO ratings (userId, movieId, rating, timestamp) '
+                    'VALUES (?, ?, ?, ?)', rows)
+            return connection.execute(
+                'SELECT COALESCE(MAX(seq), 0) FROM ratings').fetchone()[0]
+        finally:
+            connection.close()
+
+    def read(self, after=0):
+        """Ratings appended after a sequence number.
+
+        Returns
+        -------
+        tuple (numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray)
+            Sequence numbers, user ids, movie ids and ratings, oldest
+            first.
+
+        """
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                'SELECT seq, userId, movieId, rating FROM ratings '
+                'WHERE seq > ? ORDER BY seq', (after,)).fetchall()
+        finally:
+            connection.close()
+        columns = np.array(rows, dtype=np.float64).reshape(-1, 4).T
+        return (columns[0].astype(np.int64), columns[1].astype(np.int64),
+                columns[2].astype(np.int64), columns[3].astype(np.float32))
+
+
+class OnlineUpdates:
+    """Ratings read from the log by this process, and the models with
+    those ratings applied.
+
+    Parameters
+    ----------
+    log_path : str
+        Path to the rating log.
+
+    """
+
+    def __init__(self, log_path=LOG_PATH):
+        self.log = RatingLog(log_path)
+        self.seq = 0
+        self.user_ids = np.empty(0, dtype=np.int64)
+        self.movie_ids = np.empty(0, dtype=np.int64)
+        self.ratings = np.empty(0, dtype=np.float32)
+        self._stamp = None
+        self._lock = threading.Lock()
+        # Kind -> base model, sequence number, state and updated model
+        self._overlays = {}
+
+    def poll(self):
+        """Read the ratings appended since the last poll, if any.
+
+        Returns
+        -------
+        int
+            Sequence number of the last rating read, 0 if none.
+
+        """
+        try:
+            stat = os.stat(self.log.path)
+        except FileNotFoundError:
+            return self.seq
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp != self._stamp:
+            with self._lock:
+                if stamp != self._stamp:
+                    seqs, users, movies, ratings = self.log.read(self.seq)
+                    if len(seqs):
+                        self.user_ids = np.append(self.user_ids, users)
+                        self.movie_ids = np.append(self.movie_ids, movies)
+                        self.ratings = np.append(self.ratings, ratings)
+                        self.seq = int(seqs[-1])
+                    self._stamp = stamp
+        return self.seq
+
+    def _overlay(self, kind, base, update):
+        """Updated version of a base model, recomputed only when new
+        ratings arrive.
+
+        `update(state, start)` applies the ratings from position `start`
+        on, given the state left by its previous call (None at first),
+        and returns the new (state, updated model). Other threads may
+        still be serving the previous model, so `update` must leave it and
+        its state untouched and build new ones; they replace the previous
+        ones in a single assignment.
+        """
+        seq = self.poll()
+        if seq == 0:
+            return base
+        with self._lock:
+            entry = self._overlays.get(kind)
+            if entry is not None and entry[0] is base and entry[1] == seq:
+                return entry[3]
+            if entry is not None and entry[0] is base:
+                state, start = entry[2], entry[2][0]
+            else:
+                state, start = None, 0
+            state, value = update(state, start)
+            self._overlays[kind] = (base, seq, state, value)
+            return value
+
+    def ratings_index(self, base, catalogue):
+        """`utils.ratings_index.RatingsOverlay` of the logged ratings over
+        a ratings index, or the index itself if there are none."""
+        from utils.ratings_index import RatingsOverlay
+
+        def update(state, start):
+            rows = [catalogue.row_of_movie_id(movie_id)
+                    for movie_id in self.movie_ids]
+            known = [i for i, row in enumerate(rows) if row is not None]
+            if not known:
+                return (len(self.ratings),), base
+            return (len(self.ratings),), RatingsOverlay(
+                base, self.user_ids[known],
+                np.array([rows[i] for i in known], dtype=np.int64),
+                self.ratings[known])
+        return self._overlay('ratings_index', base, update)
+
+    def popularity(self, base, ratings_index, catalogue):
+        """Popularity table with the logged ratings counted.
+
+        Parameters
+        ----------
+        base : utils.popularity.PopularityTable
+            Table built from the ratings file.
+        ratings_index : utils.ratings_index.RatingsIndex
+            Index of the ratings file, to find the ratings replaced by
+            newer ones.
+        catalogue : utils.catalogue.MovieCatalogue
+            Catalogue the table is indexed by.
+
+        """
+        from utils.popularity import release_years
+
+        def update(state, start):
+            # Latest rating of every (user, movie) seen so far
+            latest = dict(state[1]) if state else {}
+            deltas = dict(state[2]) if state else {}
+            for user_id, movie_id, rating in zip(
+                    self.user_ids[start:], self.movie_ids[start:],
+                    self.ratings[start:]):
+                row = catalogue.row_of_movie_id(movie_id)
+                if row is None:
+                    continue
+                key = (int(user_id), row)
+                if key not in latest:
+                    rows, values, _ = ratings_index.gather([user_id])
+                    previous = values[rows == row]
+                    latest[key] = float(previous[0]) if len(previous) \
+                        else None
+                count, total = deltas.get(row, (0, 0.0))
+                if latest[key] is None:
+                    deltas[row] = (count + 1, total + float(rating))
+                else:
+                    deltas[row] = (count, total + float(rating) - latest[key])
+                latest[key] = float(rating)
+            state = (len(self.ratings), latest, deltas)
+            if not deltas:
+                return state, base
+            rows = np.array(sorted(deltas), dtype=np.int64)
+            return state, base.updated(
+                rows, np.array([deltas[row][0] for row in rows]),
+                np.array([deltas[row][1] for row in rows]),
+                [catalogue.genres[row] for row in rows],
+                release_years(catalogue.titles_of(rows)))
+        return self._overlay('popularity', base, update)
+
+    def factors(self, base):
+        """SVD factors after SGD steps over the logged ratings; see
+        `recommenders.svd_scoring.SVDFactors.partial_fit`."""
+
+        def update(state, start):
+            # Only the touched rows are copied, see `SVDFactors._updated`
+            factors = state[1] if state else base
+            users, movies = self.user_ids[start:], self.movie_ids[start:]
+            ratings = self.ratings[start:]
+            items = factors.item_index(movies)
+            known = items >= 0
+            # Users new to the model are folded in from their first batch
+            new = [user_id for user_id in np.unique(users[known])
+                   if factors.user_index([user_id])[0] < 0]
+            mine = [known & (users == user_id) for user_id in new]
+            factors = factors.add_users(new, [items[m] for m in mine],
+                                        [ratings[m] for m in mine])
+            factors = factors.partial_fit(factors.user_index(users[known]),
+                                          items[known], ratings[known],
+                                          n_epochs=SGD_EPOCHS)
+            return (len(self.ratings), factors), factors
+        return self._overlay('factors', base, update)
+
+
+def get_online_updates(log_path=LOG_PATH):
+    """Online updates shared by every module in the process."""
+    return registry.get(('online_updates', log_path),
+                        lambda: OnlineUpdates(log_path))
@@ -0,0 +1,383 @@
+"""
+
+    Precomputed popularity statistics for cold-start and fallbacks.
+
+    Author: Explore Data Science Academy.
+
+    Description: When a recommender cannot use the app user's favourite
+    movies (unknown titles, movies the model never saw, too few similar
+    movies) it falls back to well-rated movies, preferably of the same
+    genres as the favourites. This module precomputes, from the ratings:
+
+    * the number of ratings and the Bayesian-averaged rating of every
+      movie, i.e. its mean rating shrunk towards the global mean by
+      `prior` pseudo-ratings, so a movie with two 5-star ratings does not
+      outrank one with hundreds of 4.5-star ratings;
+    * the top `TOP_K` movies overall, per genre and per release year.
+
+    The table is a few hundred KB, stored next to the models and rebuilt
+    whenever the movie or rating files change. Fallbacks then only merge
+    a few fixed-length lists, whatever the size of the catalogue.
+
+    The table can be (re)built from the root of the repository with:
+
+        python -m utils.popularity
+
+"""
+
+# Script dependencies
+import os
+import re
+import json
+import time
+import numpy as np
+from utils.registry import registry
+from utils.catalogue import get_catalogue
+from utils.data_store import (MOVIES_PATH, RATINGS_PATH, file_checksum,
+                              rating_columns)
+from utils.ingest import item_statistics
+from utils.ratings_index import get_ratings_index
+from utils.shared_store import shared_resource
+from utils.online_updates import get_online_updates
+from utils.topk import top_k
+
+# Can be pointed elsewhere through the RECOMMENDER_POPULARITY_DIR
+# environment variable.
+POPULARITY_DIR = os.environ.get('RECOMMENDER_POPULARITY_DIR',
+                                'resources/models/popularity')
+# Length of every precomputed top list
+TOP_K = 100
+# Bump whenever the stored table changes
+POPULARITY_VERSION = 2
+
+_year = re.compile(r'\((\d{4})\)\s*$')
+
+
+def release_years(titles):
+    """Release year of every title, 0 when the title carries none."""
+    years = []
+    for title in titles:
+        match = _year.search(title)
+        years.append(int(match.group(1)) if match else 0)
+    return np.array(years, dtype=np.int32)
+
+
+def _top_rows(rows, scores, k):
+    """The k best of some rows, ties broken on row position."""
+    return rows[top_k(scores[rows], k, ties=rows)]
+
+
+def _padded(lists, k):
+    """Stack lists of rows into a (len(lists) x k) array padded with -1."""
+    table = np.full((len(lists), k), -1, dtype=np.int32)
+    for i, rows in enumerate(lists):
+        table[i, :len(rows)] = rows
+    return table
+
+
+def build_popularity(counts, means, genres, years, prior=None, k=TOP_K):
+    """Compute the popularity table from per-movie rating statistics.
+
+    Parameters
+    ----------
+    counts : numpy.ndarray
+        Number of ratings of every catalogue movie.
+    means : numpy.ndarray
+        Mean rating of every catalogue movie (ignored when unrated).
+    genres : array-like (str)
+        '|'-separated genres of every catalogue movie.
+    years : numpy.ndarray
+        Release year of every catalogue movie, 0 if unknown.
+    prior : float, optional
+        Weight, in ratings, of the global mean in the Bayesian average.
+        Defaults to the mean number of ratings of a rated movie.
+    k : int
+        Length of every top list.
+
+    Returns
+    -------
+    dict
+        Arrays of the table: `counts`, `bayesian`, `top`, `genre_names`,
+        `genre_top`, `year_values` and `year_top`, plus the `prior` and
+        `global_mean` of the Bayesian average.
+
+    """
+    rated = counts > 0
+    global_mean = (np.sum(means * counts) / max(counts.sum(), 1))
+    if prior is None:
+        prior = float(counts[rated].mean()) if rated.any() else 1.0
+    bayesian = (prior * global_mean + means * counts) / (prior + counts)
+    rated_rows = np.flatnonzero(rated)
+
+    # Genre -> rated rows, in one pass over the catalogue
+    by_genre = {}
+    for row in rated_rows:
+        for genre in genres[row].split('|'):
+            by_genre.setdefault(genre, []).append(row)
+    by_genre.pop('(no genres listed)', None)
+    genre_names = sorted(by_genre)
+
+    year_values = np.unique(years[rated_rows])
+    year_values = year_values[year_values > 0]
+    year_of_row = years[rated_rows]
+    return {
+        'prior': np.float64(prior),
+        'global_mean': np.float64(global_mean),
+        'counts': counts.astype(np.int64),
+        'bayesian': bayesian.astype(np.float32),
+        'top': _top_rows(rated_rows, bayesian, k).astype(np.int32),
+        'genre_names': np.array(genre_names),
+        'genre_top': _padded([_top_rows(np.array(by_genre[genre]),
+                                        bayesian, k)
+                              for genre in genre_names], k),
+        'year_values': year_values,
+        'year_top': _padded([_top_rows(rated_rows[year_of_row == year],
+                                       bayesian, k)
+                             for year in year_values], k),
+    }
+
+
+class PopularityTable:
+    """Lookups over a popularity table.
+
+    Parameters
+    ----------
+    arrays : dict
+        Arrays returned by `build_popularity`.
+
+    """
+
+    def __init__(self, arrays):
+        self.prior = float(arrays['prior'])
+        self.global_mean = float(arrays['global_mean'])
+        self.counts = arrays['counts']
+        self.bayesian = arrays['bayesian']
+        self.top = arrays['top']
+        self.genre_top = arrays['genre_top']
+        self.year_top = arrays['year_top']
+        self.genre_names = arrays['genre_names']
+        self.year_values = arrays['year_values']
+        self._genre_index = {str(genre): i for i, genre
+                             in enumerate(self.genre_names)}
+        self._year_index = {int(year): i for i, year
+                            in enumerate(self.year_values)}
+
+    def top_rows(self, top_n=10, genres=None, year=None, exclude=()):
+        """Best-rated movies, optionally restricted to genres or a year.
+
+        Parameters
+        ----------
+        top_n : int
+            Number of movies to return.
+        genres : list (str), optional
+            Genres whose top lists are merged. Unknown genres are skipped;
+            if none is known the overall list is used.
+        year : int, optional
+            Release year whose top list is used instead.
+        exclude : list (int)
+            Catalogue rows never returned.
+
+        Returns
+        -------
+        numpy.ndarray
+            Up to `top_n` catalogue rows, best Bayesian average first.
+
+        """
+        lists = []
+        if year is not None and year in self._year_index:
+            lists.append(self.year_top[self._year_index[year]])
+        elif genres:
+            lists = [self.genre_top[self._genre_index[genre]]
+                     for genre in genres if genre in self._genre_index]
+        if not lists:
+            lists = [self.top]
+        rows = np.unique(np.concatenate(lists))
+        rows = rows[(rows >= 0) & ~np.isin(rows, list(exclude))]
+        return _top_rows(rows, self.bayesian, top_n)
+
+    def updated(self, rows, count_delta, sum_delta, genres, years):
+        """Copy of the table after some ratings were added or changed.
+
+        Only the lists of the genres and year of the changed movies are
+        re-ranked, and a changed movie can only enter those lists or move
+        within them, so a movie pushed out of a list by a drop in rating
+        is not replaced by the next one until the table is rebuilt.
+
+        Parameters
+        ----------
+        rows : numpy.ndarray
+            Catalogue rows of the changed movies, without repeats.
+        count_delta : numpy.ndarray
+            Change of each movie's number of ratings.
+        sum_delta : numpy.ndarray
+            Change of the sum of each movie's ratings.
+        genres : list (str)
+            '|'-separated genres of each changed movie.
+        years : numpy.ndarray
+            Release year of each changed movie, 0 if unknown.
+
+        Returns
+        -------
+        PopularityTable
+            The updated table; this one is left unchanged.
+
+        """
+        counts = np.array(self.counts)
+        bayesian = np.array(self.bayesian)
+        # Undo the shrinkage to recover the sums of ratings
+        sums = (bayesian[rows] * (self.prior + counts[rows])
+                - self.prior * self.global_mean)
+        counts[rows] += count_delta
+        bayesian[rows] = ((self.prior * self.global_mean + sums + sum_delta)
+                          / (self.prior + counts[rows]))
+        rated = rows[counts[rows] > 0]
+        # `top` only holds the movies rated so far, the padded lists hold k
+        k = self.genre_top.shape[1]
+
+        def merged(current, changed):
+            candidates = np.union1d(current[current >= 0], changed)
+            candidates = candidates[counts[candidates] > 0]
+            top = np.full(len(current), -1, dtype=np.int32)
+            best = _top_rows(candidates, bayesian, len(current))
+            top[:len(best)] = best
+            return top
+
+        genre_top = np.array(self.genre_top)
+        for genre, i in self._genre_index.items():
+            changed = [row for row, names in zip(rows, genres)
+                       if genre in names.split('|')]
+            if changed:
+                genre_top[i] = merged(genre_top[i], changed)
+        year_top = np.array(self.year_top)
+        for year in np.unique(years):
+            if int(year) in self._year_index:
+                i = self._year_index[int(year)]
+                year_top[i] = merged(year_top[i], rows[years == year])
+        top = _top_rows(np.union1d(self.top, rated), bayesian, k)
+        return PopularityTable({
+            'prior': self.prior, 'global_mean': self.global_mean,
+            'counts': counts, 'bayesian': bayesian,
+            'top': top.astype(np.int32), 'genre_names': self.genre_names,
+            'genre_top': genre_top, 'year_values': self.year_values,
+            'year_top': year_top})
+
+
+def _manifest(path_to_ratings, path_to_movies):
+    return {'version': POPULARITY_VERSION,
+            'sources': {os.path.basename(path): file_checksum(path)
+                        for path in (path_to_ratings, path_to_movies)}}
+
+
+def build_table(path_to_ratings=RATINGS_PATH, path_to_movies=MOVIES_PATH,
+                popularity_dir=POPULARITY_DIR):
+    """Compute the popularity table of the data files and save it.
+
+    Returns
+    -------
+    dict
+        Arrays of the table, see `build_popularity`.
+
+    """
+    start = time.perf_counter()
+    catalogue = get_catalogue(path_to_movies)
+    columns = rating_columns(path_to_ratings)
+    counts, means = item_statistics(columns['movieId'], columns['rating'],
+                                    catalogue)
+    arrays = build_popularity(counts, means, catalogue.genres,
+                              release_years(catalogue.titles))
+    os.makedirs(popularity_dir, exist_ok=True)
+    np.savez(os.path.join(popularity_dir, 'popularity.npz'), **arrays)
+    with open(os.path.join(popularity_dir, 'manifest.json'), 'w') as manifest:
+        json.dump(_manifest(path_to_ratings, path_to_movies), manifest,
+                  indent=2)
+    print(f"Built popularity statistics for {len(counts)} movies in "
+          f"{time.perf_counter() - start:.1f}s. Saved to: {popularity_dir}")
+    return arrays
+
+
+def get_popularity(path_to_ratings=RATINGS_PATH, path_to_movies=MOVIES_PATH,
+                   popularity_dir=POPULARITY_DIR, live=True):
+    """Popularity table shared by the whole process, built first if it is
+    missing or was built from different data files.
+
+    Parameters
+    ----------
+    path_to_ratings : str
+        Path to the ratings stored in .csv format.
+    path_to_movies : str
+        Path to the movie database stored in .csv format.
+    popularity_dir : str
+        Directory in which the table is stored.
+    live : bool
+        Count the ratings logged since the file was written (see
+        `utils.online_updates`).
+
+    Returns
+    -------
+    PopularityTable
+        The table, memory-mapped from the shared snapshot when serving
+        from one.
+
+    """
+    table = shared_resource('popularity', [path_to_ratings, path_to_movies],
+                            lambda **arrays: PopularityTable(arrays))
+    if table is None:
+        table = _load_table(path_to_ratings, path_to_movies, popularity_dir)
+    if live:
+        table = get_online_updates().popularity(
+            table, get_ratings_index(path_to_ratings, path_to_movies,
+                                     live=False),
+            get_catalogue(path_to_movies))
+    return table
+
+
+def _load_table(path_to_ratings, path_to_movies, popularity_dir):
+    """Stored table of the data files, rebuilt when they changed."""
+    def load():
+        try:
+            with open(os.path.join(popularity_dir, 'manifest.json')) as stored:
+                stale = json.load(stored) != _manifest(path_to_ratings,
+                                                       path_to_movies)
+        except FileNotFoundError:
+            stale = True
+        if stale:
+            arrays = build_table(path_to_ratings, path_to_movies,
+                                 popularity_dir)
+        else:
+            with np.load(os.path.join(popularity_dir,
+                                      'popularity.npz')) as stored:
+                arrays = dict(stored)
+        return PopularityTable(arrays)
+    return registry.get(('popularity', path_to_ratings, path_to_movies),
+                        load, [path_to_ratings, path_to_movies])
+
+
+def fallback_rows(seed_rows=(), top_n=10, exclude=(),
+                  path_to_ratings=RATINGS_PATH, path_to_movies=MOVIES_PATH):
+    """Best-rated movies sharing a genre with some seed movies.
+
+    Parameters
+    ----------
+    seed_rows : list (int)
+        Catalogue rows of the seed movies, e.g. the app user's favourites.
+        Without seeds, the best-rated movies overall are returned.
+    top_n : int
+        Number of movies to return.
+    exclude : list (int)
+        Catalogue rows never returned, besides the seeds themselves.
+
+    Returns
+    -------
+    numpy.ndarray
+        Up to `top_n` catalogue rows, best first.
+
+    """
+    catalogue = get_catalogue(path_to_movies)
+    genres = sorted({genre for row in seed_rows
+                     for genre in catalogue.genres[row].split('|')})
+    return get_popularity(path_to_ratings, path_to_movies).top_rows(
+        top_n, genres=genres, exclude=list(seed_rows) + list(exclude))
+
+
+if __name__ == '__main__':
+    build_table()
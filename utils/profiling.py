@@ -0,0 +1,303 @@
+"""
+
+    Request-level profiling of the recommenders.
+
+    Author: Explore Data Science Academy.
+
+    Description: A recommendation is made of several stages (title lookup,
+    user prediction, rating gather, merge, sort, ...). Wrapping a request
+    in `profile` records how long each stage wrapped in `span` took, and
+    optionally its memory use (via `tracemalloc`): the peak memory it
+    allocated on top of what was in use when it started, and the net
+    number of memory blocks it left allocated. Functions decorated with
+    `instrument` are recorded as spans too. Stages run in other threads
+    are recorded when submitted through `contextvars.copy_context().run`.
+
+    Tracing memory slows every allocation down and is process-wide, so it
+    is opt-in per process: set RECOMMENDER_TRACE_MEMORY=1 to start it on
+    import. Peaks are then measured for the whole process, so stages of
+    overlapping requests count each other's allocations.
+
+    Outside of a profiled request `span` does nothing beyond one context
+    variable lookup, so the instrumentation can stay in the hot path.
+    Setting RECOMMENDER_PROFILE=1 profiles every instrumented call that is
+    not already inside a request.
+
+    Every finished request is
+
+    * logged as one JSON record on the `utils.profiling` logger, and
+    * added to process-wide per-stage histograms, which `prometheus_text`
+      renders in the Prometheus text exposition format.
+
+    Requests profiled in another process (e.g. a worker of a process
+    pool) can be recorded with `observe=False` and their `as_dict` sent
+    back to the parent, which adds them to its own metrics with
+    `observe`.
+
+"""
+
+# Script dependencies
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import functools
+import contextvars
+import tracemalloc
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Profile every instrumented call, not only explicitly profiled requests
+ENABLED = os.environ.get('RECOMMENDER_PROFILE', '0') == '1'
+# Trace memory allocations for the life of the process
+TRACE_MEMORY = os.environ.get('RECOMMENDER_TRACE_MEMORY', '0') == '1'
+# Upper bounds (in seconds) of the stage latency histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+           0.5, 1.0, 2.5, 5.0)
+
+# Profile of the request running in the current thread or task
+_current = contextvars.ContextVar('profile', default=None)
+# Record of the innermost stage running in the current thread or task
+_stage = contextvars.ContextVar('stage', default=None)
+
+if TRACE_MEMORY and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+
+class RequestProfile:
+    """Stages recorded during one request.
+
+    Parameters
+    ----------
+    name : str
+        Name of the request, e.g. the recommender used.
+    trace_memory : bool
+        Record the memory allocated by every stage, if the process traces
+        memory.
+
+    """
+
+    def __init__(self, name, trace_memory=False):
+        self.name = name
+        self.trace_memory = trace_memory
+        self.spans = []
+
+    def as_dict(self):
+        """The request and its stages as plain, JSON-serialisable data."""
+        return {'request': self.name, 'spans': list(self.spans)}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a finished profile from `as_dict` data."""
+        request = cls(data['request'])
+        request.spans = list(data['spans'])
+        return request
+
+    def table(self):
+        """Format the stages as a plain-text table, nested stages indented.
+
+        Returns
+        -------
+        str
+            One line per stage with its time, and its memory use when
+            memory was traced.
+
+        """
+        lines = []
+        for record in self.spans:
+            name = '  ' * record['depth'] + record['stage']
+            line = f"{name:<40}{record['seconds'] * 1000:10.2f} ms"
+            if 'peak_bytes' in record:
+                line += (f"{record['peak_bytes'] / 1024:12.1f} KiB peak"
+                         f"{record['allocated_blocks']:8d} blocks")
+            lines.append(line)
+        return '\n'.join(lines)
+
+
+class StageMetrics:
+    """Process-wide latency histograms and peak memory per stage."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def observe(self, profile):
+        """Add every stage of a finished request."""
+        with self._lock:
+            for record in profile.spans:
+                key = (profile.name, record['stage'])
+                stage = self._stages.setdefault(key, {
+                    'buckets': [0] * len(self.buckets), 'count': 0,
+                    'seconds': 0.0, 'peak_bytes': 0})
+                stage['count'] += 1
+                stage['seconds'] += record['seconds']
+                stage['peak_bytes'] = max(stage['peak_bytes'],
+                                          record.get('peak_bytes', 0))
+                for i, bound in enumerate(self.buckets):
+                    if record['seconds'] <= bound:
+                        stage['buckets'][i] += 1
+
+    def clear(self):
+        with self._lock:
+            self._stages.clear()
+
+    def prometheus_text(self):
+        """Render the metrics in the Prometheus text exposition format."""
+        lines = [
+            '# HELP recommender_stage_seconds Time spent per request stage.',
+            '# TYPE recommender_stage_seconds histogram']
+        with self._lock:
+            stages = sorted(self._stages.items())
+            for (request, name), stage in stages:
+                labels = f'request="{request}",stage="{name}"'
+                for bound, count in zip(self.buckets, stage['buckets']):
+                    lines.append(f'recommender_stage_seconds_bucket'
+                                 f'{{{labels},le="{bound}"}} {count}')
+                lines.append(f'recommender_stage_seconds_bucket'
+                             f'{{{labels},le="+Inf"}} {stage["count"]}')
+                lines.append(f'recommender_stage_seconds_sum{{{labels}}} '
+                             f'{stage["seconds"]:.6f}')
+                lines.append(f'recommender_stage_seconds_count{{{labels}}} '
+                             f'{stage["count"]}')
+            lines += [
+                '# HELP recommender_stage_peak_bytes Largest peak memory '
+                'allocated by a request stage, while memory was traced.',
+                '# TYPE recommender_stage_peak_bytes gauge']
+            for (request, name), stage in stages:
+                lines.append(f'recommender_stage_peak_bytes'
+                             f'{{request="{request}",stage="{name}"}} '
+                             f'{stage["peak_bytes"]}')
+        return '\n'.join(lines) + '\n'
+
+
+# Metrics shared by the whole process
+metrics = StageMetrics()
+
+
+def prometheus_text():
+    """Process-wide stage metrics in the Prometheus text format."""
+    return metrics.prometheus_text()
+
+
+def observe(data):
+    """Log a request profiled in another process and add it to this
+    process's metrics.
+
+    Parameters
+    ----------
+    data : dict
+        The request's `RequestProfile.as_dict`.
+
+    """
+    metrics.observe(RequestProfile.from_dict(data))
+    logger.info(json.dumps(data))
+
+
+@contextmanager
+def span(name):
+    """Record a stage of the current request, if one is being profiled.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage, e.g. 'title lookup'.
+
+    """
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    tracing = profile.trace_memory and tracemalloc.is_tracing()
+    parent = _stage.get()
+    record = {'stage': name,
+              'depth': 0 if parent is None else parent['depth'] + 1}
+    profile.spans.append(record)
+    token = _stage.set(record)
+    if tracing:
+        # tracemalloc keeps a single peak, so the peak reached so far is
+        # handed to the enclosing stage before it is reset for this one
+        start_bytes, peak = tracemalloc.get_traced_memory()
+        if parent is not None and '_peak' in parent:
+            parent['_peak'] = max(parent['_peak'], peak)
+        tracemalloc.reset_peak()
+        record['_peak'] = start_bytes
+        start_blocks = sys.getallocatedblocks()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        _stage.reset(token)
+        if tracing:
+            peak = max(record.pop('_peak'),
+                       tracemalloc.get_traced_memory()[1])
+            if parent is not None and '_peak' in parent:
+                parent['_peak'] = max(parent['_peak'], peak)
+            record['peak_bytes'] = peak - start_bytes
+            record['allocated_blocks'] = (sys.getallocatedblocks()
+                                          - start_blocks)
+
+
+@contextmanager
+def profile(name, enabled=True, trace_memory=False, observe=True):
+    """Profile one request.
+
+    Parameters
+    ----------
+    name : str
+        Name of the request; also recorded as its outermost stage.
+    enabled : bool
+        Profile at all. When False, yields None and records nothing.
+    trace_memory : bool
+        Also record the memory use of every stage, when the process traces
+        memory (see RECOMMENDER_TRACE_MEMORY).
+    observe : bool
+        Log the finished request and add it to this process's metrics.
+        Disable when it is sent to another process instead.
+
+    Yields
+    ------
+    RequestProfile or None
+        The profile, complete once the block exits.
+
+    """
+    if not enabled:
+        yield None
+        return
+    request = RequestProfile(name, trace_memory)
+    token = _current.set(request)
+    try:
+        with span(name):
+            yield request
+    finally:
+        _current.reset(token)
+        if observe:
+            metrics.observe(request)
+            logger.info(json.dumps(request.as_dict()))
+
+
+def instrument(name=None):
+    """Decorator recording every call of a function as a stage.
+
+    Parameters
+    ----------
+    name : str, optional
+        Stage name. Defaults to the function's name.
+
+    """
+    def decorator(function):
+        stage = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None and ENABLED:
+                with profile(stage):
+                    return function(*args, **kwargs)
+            with span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,211 @@
+"""
+
+    User -> ratings index in compressed sparse row (CSR) layout.
+
+    Author: Explore Data Science Academy.
+
+    Description: Ratings are grouped by user once, so that gathering every
+    rating of a set of users is a handful of array slices rather than a
+    boolean scan of the whole ratings table per user. Each rating is
+    stored against the catalogue row of its movie (see `utils.catalogue`),
+    i.e. the ratings are pre-joined with the movie table and titles can be
+    looked up directly. The index is built block by block from the
+    memory-mapped rating columns (see `utils.ingest`), so it can be built
+    for rating files larger than memory.
+
+"""
+
+# Script dependencies
+import numpy as np
+from utils.registry import registry
+from utils.catalogue import get_catalogue
+from utils.data_store import MOVIES_PATH, RATINGS_PATH, rating_columns
+from utils.ingest import build_csr
+from utils.shared_store import shared_resource
+from utils.online_updates import get_online_updates
+
+
+class RatingsIndex:
+    """Ratings grouped by user.
+
+    The ratings of the i-th user in `user_ids` are found at positions
+    `indptr[i]:indptr[i + 1]` of `item_rows` and `ratings`.
+
+    Parameters
+    ----------
+    user_ids : array-like
+        Raw user id of every rating.
+    item_rows : array-like
+        Catalogue row of the movie of every rating.
+    ratings : array-like
+        Rating values.
+
+    """
+
+    def __init__(self, user_ids, item_rows, ratings):
+        user_ids = np.asarray(user_ids)
+        order = np.argsort(user_ids, kind='stable')
+        self.user_ids, counts = np.unique(user_ids[order], return_counts=True)
+        self.indptr = np.zeros(len(self.user_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.indptr[1:])
+        self.item_rows = np.asarray(item_rows, dtype=np.int32)[order]
+        self.ratings = np.asarray(ratings, dtype=np.float32)[order]
+
+    @classmethod
+    def from_csr(cls, user_ids, indptr, item_rows, ratings):
+        """Wrap arrays which are already in CSR layout, without copying.
+
+        Parameters
+        ----------
+        user_ids : numpy.ndarray
+            Sorted unique raw user ids.
+        indptr : numpy.ndarray
+            Offsets of each user's ratings, of length `len(user_ids) + 1`.
+        item_rows : numpy.ndarray
+            Catalogue row of the movie of every rating, grouped by user.
+        ratings : numpy.ndarray
+            Rating values, grouped by user.
+
+        """
+        index = cls.__new__(cls)
+        index.user_ids, index.indptr = user_ids, indptr
+        index.item_rows, index.ratings = item_rows, ratings
+        return index
+
+    def __len__(self):
+        return len(self.ratings)
+
+    def user_positions(self, raw_ids):
+        """Positions of raw user ids within `user_ids`, -1 if unknown."""
+        raw_ids = np.asarray(raw_ids)
+        if not len(self.user_ids):
+            return np.full(raw_ids.shape, -1, dtype=np.int64)
+        positions = np.searchsorted(self.user_ids, raw_ids)
+        positions = np.minimum(positions, len(self.user_ids) - 1)
+        return np.where(self.user_ids[positions] == raw_ids, positions, -1)
+
+    def gather(self, raw_ids):
+        """Every rating of the given users, as one contiguous selection.
+
+        Parameters
+        ----------
+        raw_ids : array-like
+            Raw ids of the users. Unknown users are skipped.
+
+        Returns
+        -------
+        tuple (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+            Catalogue rows and values of the ratings, plus the position
+            within `raw_ids` of the user who gave each rating.
+
+        """
+        positions = self.user_positions(raw_ids)
+        owners = np.flatnonzero(positions >= 0)
+        starts = self.indptr[positions[owners]]
+        lengths = self.indptr[positions[owners] + 1] - starts
+        # Offsets of every selected rating: each user's start repeated over
+        # its ratings plus a running 0..length-1 counter within the user
+        ends = np.cumsum(lengths)
+        within = np.arange(ends[-1] if len(ends) else 0) \
+            - np.repeat(ends - lengths, lengths)
+        selected = np.repeat(starts, lengths) + within
+        return (self.item_rows[selected], self.ratings[selected],
+                np.repeat(owners, lengths))
+
+
+class RatingsOverlay:
+    """Ratings index with newer ratings layered over a base index.
+
+    A newer rating of a movie by the same user replaces the older one.
+
+    Parameters
+    ----------
+    base : RatingsIndex
+        The index built from the ratings file.
+    user_ids : numpy.ndarray
+        Raw user id of every newer rating, oldest first.
+    item_rows : numpy.ndarray
+        Catalogue row of the movie of every newer rating.
+    ratings : numpy.ndarray
+        Values of the newer ratings.
+
+    """
+
+    def __init__(self, base, user_ids, item_rows, ratings):
+        self.base = base
+        self.delta = RatingsIndex(user_ids, item_rows, ratings)
+
+    def __len__(self):
+        return len(self.base) + len(self.delta)
+
+    def gather(self, raw_ids):
+        """Every rating of the given users; see `RatingsIndex.gather`."""
+        gathered = [self.base.gather(raw_ids), self.delta.gather(raw_ids)]
+        item_rows, ratings, owners = (np.concatenate(parts)
+                                      for parts in zip(*gathered))
+        # Keep the last rating of each (user, movie): reversed, the first
+        # occurrence of each pair is the newest
+        pairs = owners.astype(np.int64) * (int(item_rows.max(initial=0)) + 1) \
+            + item_rows
+        _, last = np.unique(pairs[::-1], return_index=True)
+        keep = np.sort(len(pairs) - 1 - last)
+        return item_rows[keep], ratings[keep], owners[keep]
+
+
+def build_ratings_index(ratings, catalogue):
+    """Build a `RatingsIndex`, dropping ratings of unknown movies.
+
+    Parameters
+    ----------
+    ratings : Pandas Dataframe or dict
+        Ratings with `userId`, `movieId` and `rating` columns, e.g. the
+        memory-mapped arrays of `utils.data_store.rating_columns`.
+    catalogue : utils.catalogue.MovieCatalogue
+        Catalogue whose rows the ratings are joined to.
+
+    Returns
+    -------
+    RatingsIndex
+        The grouped ratings.
+
+    """
+    return RatingsIndex.from_csr(*build_csr(
+        np.asarray(ratings['userId']), np.asarray(ratings['movieId']),
+        np.asarray(ratings['rating']), catalogue))
+
+
+def get_ratings_index(path_to_ratings=RATINGS_PATH,
+                      path_to_movies=MOVIES_PATH, live=True):
+    """Ratings index shared by every module in the process.
+
+    Parameters
+    ----------
+    path_to_ratings : str
+        Path to the ratings stored in .csv format.
+    path_to_movies : str
+        Path to the movie database stored in .csv format.
+    live : bool
+        Include the ratings logged since the file was written (see
+        `utils.online_updates`).
+
+    Returns
+    -------
+    RatingsIndex or RatingsOverlay
+        Index rebuilt whenever either file changes, or memory-mapped from
+        the shared snapshot when serving from one.
+
+    """
+    index = shared_resource('ratings_index',
+                            [path_to_ratings, path_to_movies],
+                            RatingsIndex.from_csr)
+    if index is None:
+        def load():
+            return build_ratings_index(rating_columns(path_to_ratings),
+                                       get_catalogue(path_to_movies))
+        index = registry.get(
+            ('ratings_index', path_to_ratings, path_to_movies), load,
+            [path_to_ratings, path_to_movies])
+    if live:
+        index = get_online_updates().ratings_index(
+            index, get_catalogue(path_to_movies))
+    return index
@@ -0,0 +1,130 @@
+"""
+
+    Process-wide registry of expensive, file-backed resources.
+
+    Author: Explore Data Science Academy.
+
+    Description: Trained models and the data derived from the ratings
+    are costly to build, so they are loaded lazily on first use and then
+    shared by every recommender (and every Streamlit session) within the
+    process. Each cached entry remembers the modification time and size
+    of the files it was built from, and is rebuilt automatically the next
+    time it is requested after any of those files changes on disk.
+    Entries can also be dropped explicitly with `registry.invalidate`.
+
+"""
+
+# Script dependencies
+import os
+import pickle
+import threading
+import pandas as pd
+
+
+class ResourceRegistry:
+    """Thread-safe, lazily populated cache keyed on resource name."""
+
+    def __init__(self):
+        self._entries = {}
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _key_lock(self, key):
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    @staticmethod
+    def _stamp(paths):
+        stamp = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                stamp.append((path, stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                stamp.append((path, None, None))
+        return tuple(stamp)
+
+    def get(self, key, loader, paths=()):
+        """Return a cached resource, loading it on first use or whenever
+        one of its source files has changed.
+
+        Parameters
+        ----------
+        key : hashable
+            Name under which the resource is cached.
+        loader : callable
+            Zero-argument function which builds the resource.
+        paths : list (str)
+            Files the resource is built from.
+
+        Returns
+        -------
+        object
+            The cached resource.
+
+        """
+        stamp = self._stamp(paths)
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] == stamp:
+            return entry[0]
+        # Only one thread builds a given resource; others wait for it
+        with self._key_lock(key):
+            entry = self._entries.get(key)
+            if entry is None or entry[1] != stamp:
+                entry = (loader(), stamp)
+                self._entries[key] = entry
+        return entry[0]
+
+    def invalidate(self, key=None):
+        """Drop one cached resource, or every resource if no key is given."""
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+
+# Single registry shared by the whole process
+registry = ResourceRegistry()
+
+
+def get_model(path_to_model):
+    """Load a pickled model.
+
+    Parameters
+    ----------
+    path_to_model : str
+        Path to the pickled model.
+
+    Returns
+    -------
+    object
+        The unpickled model.
+
+    """
+    def load():
+        with open(path_to_model, 'rb') as model_file:
+            return pickle.load(model_file)
+    return registry.get(('model', path_to_model), load, [path_to_model])
+
+
+def get_user_ids(path_to_ratings):
+    """Raw ids of the users in a ratings file, in trainset order.
+
+    Parameters
+    ----------
+    path_to_ratings : str
+        Path to the ratings stored in .csv format.
+
+    Returns
+    -------
+    numpy.ndarray
+        User IDs of every user in the ratings data.
+
+    """
+    def load():
+        from utils.data_store import rating_columns
+        # Surprise numbers users in order of their first rating, so there
+        # is no need to build a trainset just to list them
+        return pd.unique(rating_columns(path_to_ratings)['userId'])
+    return registry.get(('user_ids', path_to_ratings), load,
+                        [path_to_ratings])
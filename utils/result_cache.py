@@ -0,0 +1,94 @@
+"""
+
+    Bounded, time-limited memoisation of recommendation results.
+
+    Author: Explore Data Science Academy.
+
+    Description: A small thread-safe LRU cache whose entries also expire
+    after a fixed time-to-live. The Streamlit app keeps a single instance
+    per process so that repeated and popular queries - the same three
+    movies, algorithm and number of results - are answered instantly and
+    shared across user sessions.
+
+"""
+
+# Script dependencies
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Least-recently-used cache with a per-entry time-to-live.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of entries kept; the least recently used entry is
+        evicted first.
+    ttl : float
+        Seconds after which an entry is considered stale and recomputed.
+
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Return the cached value of `key`, or `default` if it is missing
+        or has expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[1] > self.ttl:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """Store `value` under `key`, evicting the oldest entry if full."""
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value of `key`, calling `compute()` and caching
+        its result on a miss.
+
+        Parameters
+        ----------
+        key : hashable
+            Cache key, e.g. (algorithm, titles, top_n).
+        compute : callable
+            Zero-argument function producing the value.
+
+        Returns
+        -------
+        object
+            The cached or freshly computed value.
+
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            # Computed outside the lock so slow queries don't block others
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        """Drop every entry."""
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,258 @@
+"""
+
+    Shared, memory-mapped snapshot of the serving data.
+
+    Author: Explore Data Science Academy.
+
+    Description: Every process serving recommendations would otherwise
+    build its own copy of the ratings index, content features, popularity
+    table and similarity index. A snapshot stores all of them as plain
+    NumPy files, which workers memory-map read-only: the pages live once
+    in the operating system's page cache and are shared by every process
+    on the machine, whichever way it was started.
+
+        <snapshot>/CURRENT
+        <snapshot>/<generation>/manifest.json
+        <snapshot>/<generation>/<group>/<array>.npy
+
+    Snapshots are published as generations, like model bundles (see
+    `recommenders.model_bundle`). Publishing a new generation swaps it in
+    atomically: each process re-attaches after CURRENT changes. A request
+    wrapped in `pinned` resolves the live generation once, and every
+    lookup it makes (including from tasks run in a copy of its context)
+    is served from that generation, so it never mixes data of two
+    generations.
+
+    Every group records the SHA-1 checksums of the files it was built
+    from, and is only served to callers whose files have the same
+    contents, wherever they are stored.
+
+    Serving from a snapshot is enabled by pointing the
+    RECOMMENDER_SHARED_DIR environment variable (or `configure`) at its
+    directory. See `api.snapshot` for building one.
+
+"""
+
+# Script dependencies
+import os
+import json
+import threading
+import contextvars
+import numpy as np
+from contextlib import contextmanager
+from utils.registry import registry
+from utils.data_store import source_checksum
+
+# Directory of the snapshot to serve from, None to load everything
+# in-process as usual
+SHARED_DIR = os.environ.get('RECOMMENDER_SHARED_DIR') or None
+# Bump whenever the layout of a snapshot changes
+SNAPSHOT_VERSION = 2
+
+# Generation pinned by the request running in the current thread or task
+_pinned = contextvars.ContextVar('shared_snapshot', default=None)
+
+
+def configure(snapshot_dir):
+    """Serve from the snapshot in a directory (None to stop). Processes
+    forked afterwards inherit the setting."""
+    global SHARED_DIR
+    SHARED_DIR = snapshot_dir
+
+
+class SharedSnapshot:
+    """Read-only view of one published snapshot generation.
+
+    Parameters
+    ----------
+    directory : str
+        Directory of the generation.
+
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'manifest.json')) as manifest_file:
+            self.manifest = json.load(manifest_file)
+        if self.manifest['version'] != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version "
+                             f"{self.manifest['version']} in: {directory}")
+        self.generation = self.manifest['generation']
+        self._resources = {}
+        self._lock = threading.Lock()
+
+    def arrays(self, group):
+        """Memory-mapped arrays of a group, by name."""
+        names = self.manifest['groups'][group]['arrays']
+        return {name: np.load(os.path.join(self.directory, group,
+                                           f'{name}.npy'),
+                              mmap_mode='r')
+                for name in names}
+
+    def resource(self, group, sources, factory):
+        """Object built over a group's arrays, once per generation.
+
+        Parameters
+        ----------
+        group : str
+            Name of the group.
+        sources : list (str)
+            Files the caller would build the object from, e.g. the ratings
+            and movie files; their contents must match those the group was
+            built from.
+        factory : callable
+            Called with the group's arrays and attributes as keyword
+            arguments; must not copy the arrays.
+
+        Returns
+        -------
+        object or None
+            The built object, or None if the snapshot holds no such group.
+
+        """
+        entry = self.manifest['groups'].get(group)
+        if entry is None or entry['checksums'] != [
+                source_checksum(path) for path in sources]:
+            return None
+        with self._lock:
+            if group not in self._resources:
+                self._resources[group] = factory(**self.arrays(group),
+                                                 **entry['attrs'])
+            return self._resources[group]
+
+
+def write_snapshot(snapshot_dir, groups):
+    """Write arrays as a new snapshot generation and publish it.
+
+    Parameters
+    ----------
+    snapshot_dir : str
+        Snapshot directory, created if needed.
+    groups : dict
+        Group name -> (sources, arrays, attrs): the files the data was
+        built from, a dict of NumPy arrays, and a dict of
+        JSON-serialisable attributes.
+
+    Returns
+    -------
+    str
+        Directory of the new generation.
+
+    """
+    from recommenders.model_bundle import new_generation, publish
+    os.makedirs(snapshot_dir, exist_ok=True)
+    generation, directory = new_generation(snapshot_dir)
+    manifest = {'version': SNAPSHOT_VERSION, 'generation': generation,
+                'groups': {}}
+    for group, (sources, arrays, attrs) in groups.items():
+        os.makedirs(os.path.join(directory, group))
+        for name, values in arrays.items():
+            np.save(os.path.join(directory, group, f'{name}.npy'),
+                    np.ascontiguousarray(values))
+        manifest['groups'][group] = {
+            'checksums': [source_checksum(path) for path in sources],
+            'attrs': attrs, 'arrays': list(arrays)}
+    with open(os.path.join(directory, 'manifest.json'), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    publish(snapshot_dir, generation)
+    return directory
+
+
+def attach(snapshot_dir=None):
+    """Live generation of a snapshot, re-attached whenever a new one is
+    published.
+
+    Parameters
+    ----------
+    snapshot_dir : str, optional
+        Snapshot directory. Defaults to `SHARED_DIR`.
+
+    Returns
+    -------
+    SharedSnapshot or None
+        The live generation, or None if no snapshot is configured or
+        published.
+
+    """
+    from recommenders.model_bundle import current_generation
+    snapshot_dir = snapshot_dir or SHARED_DIR
+    if snapshot_dir is None:
+        return None
+
+    def load():
+        directory = current_generation(snapshot_dir)
+        return open_generation(directory) if directory else None
+    return registry.get(('shared_snapshot', snapshot_dir), load,
+                        [os.path.join(snapshot_dir, 'CURRENT')])
+
+
+def open_generation(directory):
+    """Snapshot generation in a directory, opened once per process;
+    published generations never change."""
+    return registry.get(('shared_generation', directory),
+                        lambda: SharedSnapshot(directory))
+
+
+@contextmanager
+def pinned(directory=None):
+    """Serve every lookup of a request from one snapshot generation.
+
+    Parameters
+    ----------
+    directory : str, optional
+        Directory of the generation, e.g. as resolved by the process
+        dispatching the request. Defaults to the live generation (see
+        `attach`). Ignored within a request already pinned.
+
+    Yields
+    ------
+    SharedSnapshot or None
+        The pinned generation, or None when not serving from a snapshot.
+
+    """
+    pin = _pinned.get()
+    if pin is not None:
+        yield pin[0]
+        return
+    snapshot = open_generation(directory) if directory else attach()
+    token = _pinned.set((snapshot,))
+    try:
+        yield snapshot
+    finally:
+        _pinned.reset(token)
+
+
+def shared_resource(group, sources, factory):
+    """Object built over a group of the generation pinned by the current
+    request, or else of the live one; None when not serving from a
+    snapshot. See `SharedSnapshot.resource`."""
+    pin = _pinned.get()
+    snapshot = pin[0] if pin is not None else attach()
+    if snapshot is None:
+        return None
+    return snapshot.resource(group, sources, factory)
+
+
+def memory_usage():
+    """Memory of the current process, in MB.
+
+    Returns
+    -------
+    dict
+        `rss` (resident), `pss` (proportional: shared pages divided among
+        the processes sharing them), `shared` and `private` memory, or an
+        empty dict where /proc is not available (outside Linux).
+
+    """
+    try:
+        with open('/proc/self/smaps_rollup') as rollup:
+            fields = dict(line.split(':', 1) for line in rollup
+                          if line.count(':') == 1)
+    except FileNotFoundError:
+        return {}
+
+    def mb(*names):
+        return sum(int(fields[name].split()[0]) for name in names) / 1024
+    return {'rss': mb('Rss'), 'pss': mb('Pss'),
+            'shared': mb('Shared_Clean', 'Shared_Dirty'),
+            'private': mb('Private_Clean', 'Private_Dirty')}
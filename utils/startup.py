@@ -0,0 +1,114 @@
+"""
+
+    Startup timing and background warm-up for the Streamlit app.
+
+    Author: Explore Data Science Academy.
+
+    Description: The recommenders, their heavy dependencies (surprise,
+    scikit-learn) and the model artefacts are only loaded the first time a
+    recommendation is requested. This module records how long each of
+    those loading stages took, so cold-start time can be reported, and can
+    optionally perform the loading on a background thread as soon as the
+    app starts (set RECOMMENDER_WARM_UP=1) so that the first request does
+    not pay for it.
+
+    Streamlit re-runs the app script on every interaction, but this module
+    is only imported once per process, so timings and the warm-up thread
+    are process-wide.
+
+"""
+
+# Script dependencies
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+# Stage name -> duration (in seconds) of its first run, in order of first run
+_stages = {}
+_stages_lock = threading.Lock()
+_reported = False
+_warm_up_thread = None
+
+
+@contextmanager
+def stage(name):
+    """Time a loading stage. Only the first run of each stage is kept,
+    as later runs find everything already loaded.
+
+    Parameters
+    ----------
+    name : str
+        Description of the stage, e.g. 'import streamlit'.
+
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _stages_lock:
+            _stages.setdefault(name, elapsed)
+
+
+def timings():
+    """Recorded stage timings as a list of (stage, seconds) pairs."""
+    with _stages_lock:
+        return list(_stages.items())
+
+
+def report():
+    """Format the recorded stage timings as a plain-text table.
+
+    Returns
+    -------
+    str
+        One line per stage, followed by the total.
+
+    """
+    stages = timings()
+    width = max([len(name) for name, _ in stages] + [len('total')])
+    lines = [f'{name:<{width}}  {seconds * 1000:9.1f} ms'
+             for name, seconds in stages]
+    total = sum(seconds for _, seconds in stages)
+    lines.append(f"{'total':<{width}}  {total * 1000:9.1f} ms")
+    return '\n'.join(lines)
+
+
+def print_report_once():
+    """Print the startup report the first time the app has rendered."""
+    global _reported
+    if not _reported:
+        _reported = True
+        print('Startup timings:\n' + report())
+
+
+def warm_up():
+    """Load every recommender and its model artefacts."""
+    with stage('import content-based recommender'):
+        import recommenders.content_based
+    with stage('import collaborative recommender'):
+        from recommenders import collaborative_based
+    with stage('load SVD factors'):
+        from recommenders.svd_scoring import load_factors
+        load_factors(collaborative_based.MODEL_PATH)
+    with stage('load rating user ids'):
+        from utils.registry import get_user_ids
+        get_user_ids(collaborative_based.RATINGS_PATH)
+    with stage('build title search index'):
+        from utils.title_search import get_title_index
+        get_title_index()
+
+
+def start_background_warm_up():
+    """Run `warm_up` on a daemon thread, once per process, if enabled
+    through the RECOMMENDER_WARM_UP environment variable."""
+    global _warm_up_thread
+    if os.environ.get('RECOMMENDER_WARM_UP', '0') != '1':
+        return
+    with _stages_lock:
+        if _warm_up_thread is not None:
+            return
+        _warm_up_thread = threading.Thread(target=warm_up, name='warm-up',
+                                           daemon=True)
+    _warm_up_thread.start()
@@ -0,0 +1,356 @@
+"""
+
+    Search-as-you-type index over the movie titles.
+
+    Author: Explore Data Science Academy.
+
+    Description: Lets the movie pickers search the whole catalogue instead
+    of offering a fixed slice of it. A query matches a title, best matches
+    first:
+
+    1. exactly, ignoring case, accents, punctuation and the year suffix
+       ("the matrix" matches "Matrix, The (1999)");
+    2. as a prefix of the title ("the mat");
+    3. word by word, every word of the query being a prefix of a word of
+       the title or its year, in any order ("matrix 1999", "reloaded ma");
+    4. word by word again, after replacing misspelt words by the words of
+       the catalogue within one or two edits of them ("matirx").
+
+    Within each level, the most rated movies come first. A trailing year
+    in the query ("heat 1995", "Heat (1995)") restricts the exact and
+    prefix matches to the movies released that year.
+
+    Titles are normalised into a sorted list of keys, searched by
+    bisection, and an inverted index from words to catalogue rows whose
+    postings are stored in word order, so every word sharing a prefix maps
+    to one contiguous slice. Misspellings are looked up through the
+    bigrams of the words; only the few words whose length, bigrams and
+    letter counts put them within reach are then aligned with the query
+    word, by a bit-parallel edit distance. Queries take well under a
+    millisecond.
+
+"""
+
+# Script dependencies
+import re
+import bisect
+import unicodedata
+import numpy as np
+from utils.registry import registry
+from utils.catalogue import get_catalogue
+from utils.popularity import get_popularity
+from utils.topk import top_k
+from utils.data_store import MOVIES_PATH, RATINGS_PATH
+
+# Number of titles returned by default
+LIMIT = 20
+# Articles MovieLens moves to the end of titles ("Matrix, The")
+ARTICLES = ('the', 'a', 'an', 'le', 'la', 'les', 'l', 'il', 'el', 'los',
+            'las', 'der', 'die', 'das', 'un', 'une', 'ein', 'eine')
+# Misspelt words are only corrected when at least this long
+MIN_FUZZY_LENGTH = 3
+# Most close words aligned per misspelt word, among those within reach
+FUZZY_CANDIDATES = 5
+
+_year = re.compile(r'\s*\((\d{4})\)\s*$')
+_alternative = re.compile(r'^(.*?)\s+\((.+)\)$')
+_article = re.compile(r'^(.*),\s*(' + '|'.join(ARTICLES) + r')$',
+                      re.IGNORECASE)
+_word = re.compile(r'[a-z0-9]+')
+_alphabet = '#abcdefghijklmnopqrstuvwxyz0123456789'
+_letter = {letter: code for code, letter in enumerate(_alphabet)}
+
+
+def normalise(text):
+    """Lower-case words of a text, without accents or punctuation."""
+    text = unicodedata.normalize('NFKD', text.replace("'", ''))
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(_word.findall(text.lower()))
+
+
+def title_keys(title):
+    """Normalised names of a title and its release year.
+
+    Returns
+    -------
+    tuple (list (str), int)
+        The title and its alternative (bracketed) title, each as written
+        and with a trailing article moved to the front; the year, or 0.
+
+    """
+    year = _year.search(title)
+    name = _year.sub('', title)
+    names = [name]
+    alternative = _alternative.match(name)
+    if alternative:
+        names = list(alternative.groups())
+    keys = []
+    for name in names:
+        keys.append(name)
+        article = _article.match(name)
+        if article:
+            keys.append(f'{article.group(2)} {article.group(1)}')
+    keys = [key for key in dict.fromkeys(map(normalise, keys)) if key]
+    return keys, int(year.group(1)) if year else 0
+
+
+def _bigrams(word):
+    """Codes of the bigrams of a word padded with '#'."""
+    padded = f'#{word}#'
+    return [_letter[first] * len(_alphabet) + _letter[second]
+            for first, second in zip(padded, padded[1:])]
+
+
+def _letter_counts(word):
+    """Number of occurrences of every letter of `_alphabet` in a word."""
+    return np.bincount([_letter[char] for char in word],
+                       minlength=len(_alphabet))
+
+
+def _edit_distance(first, second, bound):
+    """Optimal string alignment distance (edits and adjacent swaps)
+    between two words, or `bound + 1` if it exceeds `bound`.
+
+    Computed a column at a time with the bit-vector algorithm of Hyyrö
+    (2003), each bit standing for one letter of `first`, so a column
+    costs a few integer operations rather than a loop over its cells.
+    """
+    if abs(len(first) - len(second)) > bound:
+        return bound + 1
+    if not first:
+        return min(len(second), bound + 1)
+    mask = (1 << len(first)) - 1
+    last = 1 << (len(first) - 1)
+    # Letter -> positions of the letter in `first`
+    matches = {}
+    for position, char in enumerate(first):
+        matches[char] = matches.get(char, 0) | (1 << position)
+    # Vertical +1 / -1 deltas of the current column, its diagonal zero
+    # deltas, and the matches of the previous letter (for swaps)
+    positive, negative, zero, previous = mask, 0, 0, 0
+    distance = len(first)
+    for char in second:
+        match = matches.get(char, 0)
+        swap = ((~zero & match) << 1) & previous
+        zero = ((((match & positive) + positive) ^ positive) | match
+                | negative | swap) & mask
+        up = (negative | ~(zero | positive)) & mask
+        down = zero & positive
+        if up & last:
+            distance += 1
+        elif down & last:
+            distance -= 1
+        up = (up << 1) | 1
+        down = down << 1
+        positive = (down | ~(zero | up)) & mask
+        negative = zero & up & mask
+        previous = match
+    return distance if distance <= bound else bound + 1
+
+
+class TitleIndex:
+    """Title search over the catalogue.
+
+    Parameters
+    ----------
+    titles : list (str)
+        Title of every catalogue row.
+    weights : numpy.ndarray, optional
+        Popularity of every row (e.g. its number of ratings), ranking the
+        matches within a level. Ties, and every match when omitted, are
+        ranked on catalogue position.
+
+    """
+
+    def __init__(self, titles, weights=None):
+        n_titles = len(titles)
+        if weights is None:
+            weights = np.zeros(n_titles)
+        # Rows from most to least popular, and the position of every row
+        self.order = np.lexsort((np.arange(n_titles),
+                                 -np.asarray(weights, dtype=np.float64)))
+        self.rank = np.empty(n_titles, dtype=np.int64)
+        self.rank[self.order] = np.arange(n_titles)
+        self.years = np.zeros(n_titles, dtype=np.int32)
+
+        keys, words = [], {}
+        for row, title in enumerate(titles):
+            names, self.years[row] = title_keys(title)
+            keys += [(name, row) for name in names]
+            tokens = {word for name in names for word in name.split()}
+            if self.years[row]:
+                tokens.add(str(self.years[row]))
+            for word in tokens:
+                words.setdefault(word, []).append(row)
+        keys.sort()
+        # Sorted title keys, searched by bisection
+        self.keys = [key for key, _ in keys]
+        self.key_rows = np.array([row for _, row in keys], dtype=np.int32)
+        # Sorted words; the rows of every word sharing a prefix form one
+        # slice of `word_rows`
+        self.words = sorted(words)
+        self.word_lengths = np.array([len(word) for word in self.words])
+        lengths = [len(words[word]) for word in self.words]
+        self.word_indptr = np.concatenate(([0], np.cumsum(lengths)))
+        self.word_rows = np.fromiter(
+            (row for word in self.words for row in words[word]),
+            dtype=np.int32, count=self.word_indptr[-1])
+        # Bigram -> words containing it, for misspellings
+        pairs = [(code, position) for position, word in enumerate(self.words)
+                 for code in set(_bigrams(word))]
+        codes = np.array([code for code, _ in pairs], dtype=np.int64)
+        self.bigram_indptr = np.concatenate(
+            ([0], np.cumsum(np.bincount(codes,
+                                        minlength=len(_alphabet) ** 2))))
+        self.bigram_words = np.array([position for _, position in pairs],
+                                     dtype=np.int32)[np.argsort(codes,
+                                                                kind='stable')]
+        # Letter counts of every word, bounding its distance to a query
+        # word before aligning them
+        self.word_letters = np.array([_letter_counts(word)
+                                      for word in self.words],
+                                     dtype=np.int8).reshape(-1, len(_alphabet))
+
+    def __len__(self):
+        return len(self.rank)
+
+    def _key_rows(self, key):
+        """Rows with a title key equal to, and starting with, a key."""
+        low = bisect.bisect_left(self.keys, key)
+        exact = bisect.bisect_right(self.keys, key, lo=low)
+        high = bisect.bisect_left(self.keys, key + '\uffff', lo=exact)
+        return self.key_rows[low:exact], self.key_rows[low:high]
+
+    def _prefix_rows(self, prefix):
+        """Rows with a word starting with a prefix (possibly repeated)."""
+        low = bisect.bisect_left(self.words, prefix)
+        high = bisect.bisect_left(self.words, prefix + '\uffff', lo=low)
+        return self.word_rows[self.word_indptr[low]:self.word_indptr[high]]
+
+    def _word_rows(self, positions):
+        """Rows with any of the words at some positions of `words`."""
+        return np.concatenate(
+            [self.word_rows[self.word_indptr[position]:
+                            self.word_indptr[position + 1]]
+             for position in positions] or [np.empty(0, dtype=np.int32)])
+
+    def close_words(self, word):
+        """Words of the catalogue within one edit of a word (two for words
+        longer than seven letters), closest first."""
+        bound = 1 if len(word) <= 7 else 2
+        codes = _bigrams(word)
+        counts = np.bincount(
+            np.concatenate([self.bigram_words[self.bigram_indptr[code]:
+                                              self.bigram_indptr[code + 1]]
+                            for code in codes]),
+            minlength=len(self.words))
+        # An edit (or swap) changes at most three bigrams
+        shared = max(1, len(codes) - 3 * bound)
+        candidates = np.flatnonzero(counts >= shared)
+        candidates = candidates[
+            np.abs(self.word_lengths[candidates] - len(word)) <= bound]
+        # Every edit adds and removes at most one letter (a swap neither),
+        # so a word missing more letters of the query, or having more
+        # letters not in it, is out of reach
+        extra = np.maximum(self.word_letters[candidates]
+                           - _letter_counts(word), 0).sum(axis=1)
+        missing = extra - (self.word_lengths[candidates] - len(word))
+        candidates = candidates[np.maximum(extra, missing) <= bound]
+        candidates = candidates[top_k(counts[candidates], FUZZY_CANDIDATES)]
+        distances = [(_edit_distance(word, self.words[position], bound),
+                      position) for position in candidates]
+        return [position for distance, position in sorted(distances)
+                if distance <= bound]
+
+    def _matching(self, slices):
+        """Rows present in every one of several arrays of rows."""
+        slices = sorted(slices, key=len)
+        rows = np.unique(slices[0])
+        for other in slices[1:]:
+            present = np.zeros(len(self.rank), dtype=bool)
+            present[other] = True
+            rows = rows[present[rows]]
+        return rows
+
+    def search(self, query, limit=LIMIT):
+        """Catalogue rows of the titles best matching a query.
+
+        Parameters
+        ----------
+        query : str
+            Text typed by the user.
+        limit : int
+            Maximum number of rows to return.
+
+        Returns
+        -------
+        list (int)
+            Catalogue rows, best match first. An empty query returns the
+            most popular movies.
+
+        """
+        words = normalise(query).split()
+        if not words:
+            return self.order[:limit].tolist()
+        found = []
+        # Ranks already returned
+        taken = np.zeros(len(self.rank), dtype=bool)
+        for rows in self._levels(words):
+            # Sorted ranks of the rows, without repeats
+            ranks = np.unique(self.rank[rows])
+            ranks = ranks[~taken[ranks]][:limit - len(found)]
+            taken[ranks] = True
+            found += self.order[ranks].tolist()
+            if len(found) >= limit:
+                break
+        return found
+
+    def _levels(self, words):
+        """Rows matching normalised query words, one array per level
+        (possibly repeating rows); later levels are only computed when
+        the earlier ones do not fill the results."""
+        key = ' '.join(words)
+        # A trailing year restricts the title matches to that year
+        year = 0
+        if len(words) > 1 and len(words[-1]) == 4 and words[-1].isdigit():
+            year = int(words[-1])
+            key = ' '.join(words[:-1])
+        exact, prefixed = self._key_rows(key)
+        if year:
+            exact = exact[self.years[exact] == year]
+            prefixed = prefixed[self.years[prefixed] == year]
+        yield exact
+        yield prefixed
+
+        slices = [self._prefix_rows(word) for word in words]
+        missing = [i for i, rows in enumerate(slices) if not len(rows)]
+        if not missing:
+            yield self._matching(slices)
+            return
+        for i in missing:
+            if len(words[i]) >= MIN_FUZZY_LENGTH:
+                slices[i] = self._word_rows(self.close_words(words[i]))
+        # Words matching nothing, even misspelt, are ignored
+        slices = [rows for rows in slices if len(rows)]
+        if slices:
+            yield self._matching(slices)
+
+
+def get_title_index(path_to_movies=MOVIES_PATH, path_to_ratings=RATINGS_PATH):
+    """Title index shared by the whole process, ranking matches by their
+    number of ratings; rebuilt whenever the data files change."""
+    def load():
+        catalogue = get_catalogue(path_to_movies)
+        counts = get_popularity(path_to_ratings, path_to_movies,
+                                live=False).counts
+        return TitleIndex(list(catalogue.titles), counts)
+    return registry.get(('title_index', path_to_movies, path_to_ratings),
+                        load, [path_to_movies, path_to_ratings])
+
+
+def search_titles(query, limit=LIMIT, path_to_movies=MOVIES_PATH,
+                  path_to_ratings=RATINGS_PATH):
+    """Titles best matching a query; see `TitleIndex.search`."""
+    rows = get_title_index(path_to_movies, path_to_ratings).search(query,
+                                                                   limit)
+    return get_catalogue(path_to_movies).titles_of(rows)